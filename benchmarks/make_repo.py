@@ -0,0 +1,181 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Generate synthetic repositories following LSST tagging conventions.
+
+The history is written with ``git fast-import`` so that repositories with
+tens of thousands of commits and tags take seconds to create. The
+repository is bare and ``HEAD`` refers to the tip of the unmerged tail, if
+there is one, otherwise to ``main``.
+"""
+
+from __future__ import annotations
+
+__all__ = ("RepoSpec", "make_repo")
+
+import argparse
+import dataclasses
+import os
+import subprocess
+from typing import List, Optional
+
+# Arbitrary but fixed so that generated repositories are reproducible.
+_EPOCH = 1577836800  # 2020-01-01T00:00:00Z
+_IDENT = "Benchmark <benchmark@example.com>"
+
+
+@dataclasses.dataclass
+class RepoSpec:
+    """Shape of a synthetic repository."""
+
+    weeklies: int = 52
+    """Number of weekly tags on ``main``."""
+
+    commits_per_week: int = 5
+    """Number of commits on ``main`` between weeklies."""
+
+    releases: int = 3
+    """Number of major releases, each on its own release branch."""
+
+    release_candidates: int = 2
+    """Number of release candidate tags before each final release."""
+
+    release_commits: int = 3
+    """Number of commits on each release branch."""
+
+    tail: int = 0
+    """Length of an unmerged branch started after the last weekly."""
+
+    lightweight_every: int = 0
+    """Make every n-th tag lightweight rather than annotated; 0 for none."""
+
+    pack_refs: bool = False
+    """Whether to pack the references after the repository is written."""
+
+    commit_graph: bool = False
+    """Whether to write a commit-graph file."""
+
+
+class _Stream:
+    """Build a ``git fast-import`` stream."""
+
+    def __init__(self, spec: RepoSpec):
+        self.spec = spec
+        self.chunks: List[bytes] = []
+        self.mark = 0
+        self.time = _EPOCH
+        self.n_tags = 0
+
+    def commit(self, branch: str, parent: Optional[int], message: str) -> int:
+        self.mark += 1
+        self.time += 3600
+        data = message.encode()
+        lines = [
+            f"commit refs/heads/{branch}",
+            f"mark :{self.mark}",
+            f"committer {_IDENT} {self.time} +0000",
+            f"data {len(data)}",
+        ]
+        self.chunks.append("\n".join(lines).encode() + b"\n" + data + b"\n")
+        if parent is not None:
+            self.chunks.append(f"from :{parent}\n".encode())
+        return self.mark
+
+    def tag(self, name: str, mark: int) -> None:
+        self.n_tags += 1
+        every = self.spec.lightweight_every
+        if every and self.n_tags % every == 0:
+            self.chunks.append(f"reset refs/tags/{name}\nfrom :{mark}\n".encode())
+            return
+        data = f"Tag {name}".encode()
+        lines = [f"tag {name}", f"from :{mark}", f"tagger {_IDENT} {self.time} +0000", f"data {len(data)}"]
+        self.chunks.append("\n".join(lines).encode() + b"\n" + data + b"\n")
+
+
+def make_repo(path: str, spec: RepoSpec) -> str:
+    """Create a synthetic repository.
+
+    Parameters
+    ----------
+    path : `str`
+        Directory in which to create the bare repository. It must not
+        exist.
+    spec : `RepoSpec`
+        The shape of the repository.
+
+    Returns
+    -------
+    path : `str`
+        The path to the repository.
+    """
+    stream = _Stream(spec)
+
+    # Release branches are spread evenly over the weeklies.
+    interval = spec.weeklies // (spec.releases + 1) if spec.releases else 0
+    major = 0
+    tip: Optional[int] = None
+    for week in range(spec.weeklies):
+        for i in range(spec.commits_per_week):
+            tip = stream.commit("main", tip, f"Week {week} commit {i}")
+        assert tip is not None
+        year, week_number = divmod(week, 52)
+        stream.tag(f"w.{2020 + year}.{week_number + 1:02d}", tip)
+
+        if interval and (week + 1) % interval == 0 and major < spec.releases:
+            # Branch from the weekly with the first release candidate.
+            major += 1
+            branch = f"v{major}.x"
+            stream.tag(f"v{major}.0.0.rc1", tip)
+            branch_tip = tip
+            for i in range(spec.release_commits):
+                branch_tip = stream.commit(branch, branch_tip, f"Release {major} fix {i}")
+                if i + 2 <= spec.release_candidates:
+                    stream.tag(f"v{major}.0.0.rc{i + 2}", branch_tip)
+            stream.tag(f"v{major}.0.0", branch_tip)
+
+    head = "main"
+    if spec.tail:
+        head = "tail"
+        branch_tip = tip
+        for i in range(spec.tail):
+            branch_tip = stream.commit(head, branch_tip, f"Unmerged commit {i}")
+
+    def git(*args: str, **kwargs: object) -> None:
+        subprocess.run(["git", f"--git-dir={path}", *args], check=True, **kwargs)  # type: ignore
+
+    os.makedirs(path)
+    git("init", "--quiet", "--bare")
+    git("fast-import", "--quiet", input=b"".join(stream.chunks))
+    git("symbolic-ref", "HEAD", f"refs/heads/{head}")
+    if spec.pack_refs:
+        git("pack-refs", "--all")
+    if spec.commit_graph:
+        git("commit-graph", "write", "--reachable")
+    return path
+
+
+def main() -> None:
+    """Create a synthetic repository from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", help="Directory in which to create the bare repository.")
+    for field in dataclasses.fields(RepoSpec):
+        option = f"--{field.name.replace('_', '-')}"
+        if field.type == "bool":
+            parser.add_argument(option, action="store_true")
+        else:
+            parser.add_argument(option, type=int, default=field.default)
+    args = parser.parse_args()
+    spec = RepoSpec(**{field.name: getattr(args, field.name) for field in dataclasses.fields(RepoSpec)})
+    make_repo(args.path, spec)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Benchmark version determination on synthetic repositories.
+
+Each benchmark records the wall time, the number of subprocesses started
+and the peak memory use. The results are written to a JSON file named
+after the commit of this package being measured, and two such files can be
+compared to find regressions.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from lsst_versions import find_lsst_version, get_lsst_version
+from make_repo import RepoSpec, make_repo
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+
+SCENARIOS: Dict[str, RepoSpec] = {
+    "small": RepoSpec(weeklies=52, commits_per_week=5, releases=3),
+    "many-tags": RepoSpec(weeklies=1000, commits_per_week=2, releases=25, release_candidates=4),
+    "deep-history": RepoSpec(weeklies=200, commits_per_week=100, releases=5),
+    "long-tail": RepoSpec(weeklies=200, commits_per_week=5, releases=5, tail=5000),
+    "lightweight-packed": RepoSpec(
+        weeklies=500, commits_per_week=5, releases=10, lightweight_every=2, pack_refs=True, commit_graph=True
+    ),
+}
+"""The repositories to benchmark, by name."""
+
+# Run in a child process to measure the command-line interface. The number
+# of subprocesses and the peak resident memory are reported on exit.
+_CLI_PROBE = """
+import atexit, json, resource, subprocess, sys
+count = 0
+init = subprocess.Popen.__init__
+def counting_init(self, *args, **kwargs):
+    global count
+    count += 1
+    init(self, *args, **kwargs)
+subprocess.Popen.__init__ = counting_init
+def report():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        rss *= 1024
+    print(json.dumps({"subprocesses": count, "peak_memory": rss}), file=sys.stderr)
+atexit.register(report)
+sys.argv = ["lsst-version", *sys.argv[1:]]
+from lsst_versions._cmd import main
+main()
+"""
+
+
+class _SubprocessCounter:
+    """Count the subprocesses started by this process."""
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    @contextlib.contextmanager
+    def counting(self) -> Iterator[None]:
+        original = subprocess.Popen.__init__
+        counter = self
+
+        def counting_init(self: subprocess.Popen, *args: Any, **kwargs: Any) -> None:
+            counter.count += 1
+            original(self, *args, **kwargs)
+
+        subprocess.Popen.__init__ = counting_init  # type: ignore
+        try:
+            yield
+        finally:
+            subprocess.Popen.__init__ = original  # type: ignore
+
+
+def _measure(func: Callable[[], Any], repeat: int) -> Dict[str, Any]:
+    """Measure a function called in this process."""
+    # Tracing memory slows everything down so is done separately. This
+    # also ensures that any caches are populated before timing starts.
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    counter = _SubprocessCounter()
+    times = []
+    for _ in range(repeat):
+        counter.count = 0
+        with counter.counting():
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+    subprocesses = counter.count
+    return {
+        "wall_min": min(times),
+        "wall_median": statistics.median(times),
+        "subprocesses": subprocesses,
+        "peak_memory": peak,
+    }
+
+
+def _measure_cli(args: List[str], repeat: int) -> Dict[str, Any]:
+    """Measure the command-line interface run in a child process."""
+    times = []
+    report: Dict[str, Any] = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-c", _CLI_PROBE, *args], capture_output=True, text=True, check=True
+        )
+        times.append(time.perf_counter() - start)
+        report = json.loads(result.stderr.strip().splitlines()[-1])
+    return {"wall_min": min(times), "wall_median": statistics.median(times), **report}
+
+
+@contextlib.contextmanager
+def _environment(**values: str) -> Iterator[None]:
+    """Temporarily set environment variables."""
+    previous = {key: os.environ.get(key) for key in values}
+    os.environ.update(values)
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                del os.environ[key]
+            else:
+                os.environ[key] = value
+
+
+def run_scenario(name: str, repo: str, repeat: int) -> List[Dict[str, Any]]:
+    """Run every benchmark on one repository.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the scenario.
+    repo : `str`
+        Path to the repository.
+    repeat : `int`
+        Number of times each benchmark is timed.
+
+    Returns
+    -------
+    results : `list` [`dict`]
+        One entry per benchmark and variant.
+    """
+    benchmarks: Dict[str, Callable[[str], Dict[str, Any]]] = {
+        "find_lsst_version": lambda backend: _measure(
+            lambda: find_lsst_version(repo, backend=backend), repeat
+        ),
+        "find_lsst_version_main": lambda backend: _measure(
+            lambda: find_lsst_version(repo, "main", backend=backend), repeat
+        ),
+        "get_lsst_version": lambda backend: _measure(lambda: get_lsst_version(repo, fallback=False), repeat),
+        "cli": lambda backend: _measure_cli(["--backend", backend, repo], repeat),
+    }
+
+    results = []
+    for cache in ("1", "0"):
+        for backend in ("plumbing", "gitpython"):
+            variant = f"{backend}{'' if cache == '1' else ',no-cache'}"
+            with _environment(LSST_VERSIONS_CACHE=cache, LSST_VERSIONS_BACKEND=backend):
+                for benchmark, run in benchmarks.items():
+                    print(f"{name} {benchmark} [{variant}]", file=sys.stderr, flush=True)
+                    results.append(
+                        {"scenario": name, "benchmark": benchmark, "variant": variant, **run(backend)}
+                    )
+    return results
+
+
+def _current_commit() -> Dict[str, Any]:
+    """Describe the commit of this package being measured."""
+
+    def git(*args: str) -> str:
+        return subprocess.run(
+            ["git", *args], cwd=BENCHMARK_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+
+    changes = git("status", "--porcelain", "--untracked-files=no", "--", os.path.join("..", "python"))
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(changes)}
+
+
+def run(scenarios: List[str], repeat: int, output_dir: str, work_dir: Optional[str]) -> str:
+    """Run the benchmarks and store the results.
+
+    Parameters
+    ----------
+    scenarios : `list` [`str`]
+        Names of the scenarios to run.
+    repeat : `int`
+        Number of times each benchmark is timed.
+    output_dir : `str`
+        Directory to receive the results.
+    work_dir : `str`, optional
+        Directory holding the generated repositories. Repositories that
+        already exist are reused. A temporary directory is used if not
+        given.
+
+    Returns
+    -------
+    path : `str`
+        Path of the results file.
+    """
+    metadata = {
+        **_current_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+    }
+    results = []
+    with contextlib.ExitStack() as stack:
+        if work_dir is None:
+            work_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        for name in scenarios:
+            repo = os.path.join(work_dir, name)
+            if not os.path.exists(repo):
+                make_repo(repo, SCENARIOS[name])
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                results.extend(run_scenario(name, repo, repeat))
+
+    os.makedirs(output_dir, exist_ok=True)
+    suffix = "-dirty" if metadata["dirty"] else ""
+    path = os.path.join(output_dir, f"{metadata['commit'][:12]}{suffix}.json")
+    with open(path, "w") as fh:
+        json.dump({**metadata, "results": results}, fh, indent=2)
+    return path
+
+
+def compare(old_path: str, new_path: str, threshold: float) -> int:
+    """Report the differences between two results files.
+
+    Parameters
+    ----------
+    old_path : `str`
+        The reference results.
+    new_path : `str`
+        The results to check.
+    threshold : `float`
+        Fractional increase in wall time or peak memory, or any increase in
+        the number of subprocesses, treated as a regression.
+
+    Returns
+    -------
+    n_regressions : `int`
+        The number of benchmarks that regressed.
+    """
+    with open(old_path) as fh:
+        old = json.load(fh)
+    with open(new_path) as fh:
+        new = json.load(fh)
+
+    def key(result: Dict[str, Any]) -> tuple:
+        return result["scenario"], result["benchmark"], result["variant"]
+
+    previous = {key(result): result for result in old["results"]}
+    print(f"{old['commit'][:12]} -> {new['commit'][:12]}")
+    n_regressions = 0
+    for result in new["results"]:
+        if (reference := previous.get(key(result))) is None:
+            continue
+        time_ratio = result["wall_min"] / reference["wall_min"]
+        memory_ratio = result["peak_memory"] / max(reference["peak_memory"], 1)
+        regressed = (
+            time_ratio > 1 + threshold
+            or memory_ratio > 1 + threshold
+            or result["subprocesses"] > reference["subprocesses"]
+        )
+        n_regressions += regressed
+        print(
+            f"{'REGRESSION' if regressed else '':10} {' '.join(key(result)):60} "
+            f"time {time_ratio:6.2f}x  memory {memory_ratio:6.2f}x  "
+            f"subprocesses {reference['subprocesses']} -> {result['subprocesses']}"
+        )
+    return n_regressions
+
+
+def main() -> None:
+    """Run the benchmark harness from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=list(SCENARIOS),
+        help="Scenario to run. Can be given more than once. Defaults to all.",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timings of each benchmark.")
+    parser.add_argument("--output-dir", default=RESULTS_DIR, help="Directory to receive the results.")
+    parser.add_argument("--work-dir", help="Directory in which to create and reuse the repositories.")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("OLD", "NEW"),
+        help="Compare two results files instead of running the benchmarks.",
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.2, help="Fractional slowdown reported as a regression."
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        if compare(*args.compare, args.threshold):
+            sys.exit(1)
+        return
+
+    path = run(args.scenario or list(SCENARIOS), args.repeat, args.output_dir, args.work_dir)
+    print(f"Results written to {path}")
+
+
+if __name__ == "__main__":
+    main()
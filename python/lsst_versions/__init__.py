@@ -20,9 +20,61 @@ It avoids the need to hard-code and continually update a version string.
 It assumes the use of LSST DM release and tagging practices.
 """
 
-from .__version__ import *
+from __future__ import annotations
 
-# Importing __all__ ensures that the docstrings for the public APis
-# in _versions.py are lifted into the main namespace.
-from ._versions import *
-from ._versions import __all__
+from typing import TYPE_CHECKING, Any, Dict, List
+
+try:
+    from .__version__ import *
+except ImportError:
+    # The version file is written when the package is built.
+    __version__ = "unknown"
+
+if TYPE_CHECKING:
+    from ._async import *
+    from ._budget import *
+    from ._metadata import *
+    from ._multi import *
+    from ._profile import *
+    from ._range import *
+    from ._reverse import *
+    from ._versions import *
+
+# The public APIs are imported from their modules on first use so that
+# importing the package, as every build using the setuptools hook does,
+# does not load the machinery needed to determine a version. Defining
+# __all__ ensures that their docstrings are lifted into the main namespace.
+_EXPORTS: Dict[str, str] = {
+    "find_lsst_version": "_versions",
+    "get_lsst_version": "_versions",
+    "infer_version_for_setuptools": "_versions",
+    "RepoVersion": "_multi",
+    "get_lsst_versions": "_multi",
+    "find_lsst_version_async": "_async",
+    "get_lsst_version_async": "_async",
+    "get_lsst_versions_async": "_async",
+    "ResolutionBudget": "_budget",
+    "iter_lsst_versions": "_range",
+    "resolve_lsst_version": "_reverse",
+    "DistributionVersion": "_metadata",
+    "scan_versions": "_metadata",
+    "Span": "_profile",
+    "add_span_callback": "_profile",
+    "remove_span_callback": "_profile",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str) -> Any:
+    if (module_name := _EXPORTS.get(name)) is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> List[str]:
+    return sorted({*globals(), *__all__})
@@ -0,0 +1,453 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Determine versions from an asyncio event loop.
+
+Git is run with asyncio subprocesses so that many repositories can be
+examined concurrently without a thread for each.
+"""
+
+from __future__ import annotations
+
+__all__ = ["find_lsst_version_async", "get_lsst_version_async", "get_lsst_versions_async"]
+
+import contextlib
+import functools
+import itertools
+import logging
+import os
+import tempfile
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from . import _history
+from ._backend import DEFAULT_BACKEND, get_backend_name
+from ._budget import BudgetExceededError, Meter, ResolutionBudget, get_budget, metered
+from ._cache import load_tag_tables
+from ._git import _git_command
+from ._graph import load_commit_graph
+from ._multi import RepoVersion
+from ._objects import iter_first_parents
+from ._profile import count, span
+from ._refs import find_git_dir, resolve_head
+from ._stream import get_tag_patterns
+from ._versions import (
+    _fall_back_after_overrun,
+    _find_lsst_version,
+    _find_version_from_metadata,
+    _major_release_tags,
+    _make_dev_version,
+    _select_relevant_release,
+)
+from ._walk import WeeklySearch
+
+if TYPE_CHECKING:
+    import asyncio
+
+    from ._tags import TagTables
+
+_LOG = logging.getLogger("lsst_versions")
+
+_T = TypeVar("_T")
+
+
+async def _in_thread(func: Callable[..., _T], *args: Any, meter: Optional[Meter] = None) -> _T:
+    """Run a blocking function in a worker thread.
+
+    Parameters
+    ----------
+    func : `~collections.abc.Callable`
+        The function.
+    *args
+        Arguments for the function.
+    meter : `~lsst_versions._budget.Meter`, optional
+        The meter charged for the work done by the function.
+
+    Returns
+    -------
+    result
+        The value returned by the function.
+    """
+    import asyncio
+
+    return await asyncio.get_running_loop().run_in_executor(None, _call_metered, meter, func, *args)
+
+
+def _call_metered(meter: Optional[Meter], func: Callable[..., _T], *args: Any) -> _T:
+    """Call a function, charging its work to a meter."""
+    with metered(meter):
+        return func(*args)
+
+
+@contextlib.asynccontextmanager
+async def _git_output(git_dir: str, *args: str) -> AsyncIterator[asyncio.StreamReader]:
+    """Run a git command, giving access to its standard output.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    *args : `str`
+        Arguments to pass to ``git``.
+
+    Yields
+    ------
+    stdout : `asyncio.StreamReader`
+        The standard output of the command.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if the command fails. If the context is left before the
+        output has been read, including on cancellation, the command is
+        killed without raising.
+    """
+    import asyncio
+
+    command = _git_command(git_dir, *args)
+    _LOG.debug("Running %s", command)
+    # Standard error goes to a file so that a chatty command can never
+    # block on a full pipe while we are consuming standard output.
+    with tempfile.TemporaryFile() as stderr:
+        proc = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE, stderr=stderr)
+        assert proc.stdout is not None
+        finished = False
+        try:
+            yield proc.stdout
+            finished = proc.stdout.at_eof()
+        finally:
+            if not finished:
+                with contextlib.suppress(ProcessLookupError):
+                    proc.kill()
+            # The process is always reaped, even if this task is cancelled
+            # again while waiting.
+            await asyncio.shield(proc.wait())
+        if finished and proc.returncode != 0:
+            stderr.seek(0)
+            message = stderr.read().decode(errors="replace").strip()
+            raise RuntimeError(f"Command {command} failed with status {proc.returncode}: {message}")
+
+
+async def _resolve(git_dir: str, rev: str) -> str:
+    """Resolve a revision to the hex SHA of a commit."""
+    if rev == "HEAD" and (hexsha := await _in_thread(resolve_head, git_dir)) is not None:
+        return hexsha
+    async with _git_output(git_dir, "rev-parse", "--verify", "--quiet", f"{rev}^{{commit}}") as stdout:
+        output = await stdout.read()
+    return output.decode().strip()
+
+
+def _graph_containing(git_dir: str, hexsha: str, tags: Dict[str, str]) -> Optional[Set[str]]:
+    """Determine which tags have a commit in their history using the
+    commit-graph, returning `None` if it can not say.
+    """
+    # Writing a commit-graph would hold up the calculation so only an
+    # existing one is used.
+    graph = load_commit_graph(git_dir, allow_write=False)
+    if graph is None:
+        return None
+    try:
+        commits = graph.containing(hexsha, set(tags.values()))
+    finally:
+        graph.close()
+    return None if commits is None else {name for name, commit in tags.items() if commit in commits}
+
+
+async def _tags_containing(
+    git_dir: str, hexsha: str, tags: Dict[str, str], meter: Optional[Meter]
+) -> Set[str]:
+    """Determine which tags have a commit in their history."""
+    if not tags:
+        return set()
+    count("ancestry_checks", len(tags))
+    if meter is not None:
+        meter.check()
+    if (found := await _in_thread(_graph_containing, git_dir, hexsha, tags)) is not None:
+        return found
+    patterns = [f"refs/tags/{tag}" for tag in tags]
+    args = ("for-each-ref", "--format=%(refname:strip=2)", f"--contains={hexsha}", *patterns)
+    async with _git_output(git_dir, *args) as stdout:
+        output = await stdout.read()
+    return set(output.decode().split())
+
+
+async def _find_nearest_weekly(
+    git_dir: str, hexsha: str, weeklies: Mapping[str, str], meter: Optional[Meter]
+) -> Tuple[int, str]:
+    """Find the closest weekly in the first-parent history of a commit."""
+    # An index of the history of main is read, and extended, in a worker
+    # thread.
+    found = await _in_thread(
+        _history.find_nearest_weekly,
+        git_dir,
+        hexsha,
+        weeklies,
+        functools.partial(iter_first_parents, git_dir),
+        meter=meter,
+    )
+    if found is not None:
+        return found
+
+    search = WeeklySearch(weeklies, meter)
+    args = ("--no-replace-objects", "rev-list", "--first-parent", hexsha, "--")
+    async with _git_output(git_dir, *args) as stdout:
+        async for line in stdout:
+            if search.visit(line.decode().rstrip("\n")):
+                break
+    return search.result()
+
+
+async def _calculate_plumbing_version(repo_dir: str, version_commit: str, meter: Optional[Meter]) -> str:
+    """Calculate the version of a commit running git as asyncio
+    subprocesses.
+    """
+    git_dir = await _in_thread(find_git_dir, repo_dir)
+    tables: TagTables = await _in_thread(load_tag_tables, git_dir, meter=meter)
+    hexsha = await _resolve(git_dir, version_commit)
+
+    if hexsha in tables.releases:
+        _LOG.debug("Requested commit %s matches release %s.", hexsha, tables.releases[hexsha])
+        return str(tables.releases[hexsha])
+
+    containing = await _tags_containing(git_dir, hexsha, _major_release_tags(tables), meter)
+    relevant_release = _select_relevant_release(tables, containing)
+    counter, weekly_name = await _find_nearest_weekly(git_dir, hexsha, tables.weeklies, meter)
+    return _make_dev_version(repo_dir, hexsha, relevant_release, weekly_name, counter)
+
+
+def _read_config(
+    repo_dir: str, backend: Optional[str], budget: Optional[ResolutionBudget]
+) -> Tuple[str, bool, Optional[ResolutionBudget]]:
+    """Read the backend, whether tags are streamed, and the budget."""
+    return (
+        get_backend_name(repo_dir, backend),
+        get_tag_patterns(repo_dir) is not None,
+        get_budget(repo_dir, budget),
+    )
+
+
+async def _calculate_version(
+    repo_dir: str, version_commit: str, backend: Optional[str], budget: Optional[ResolutionBudget]
+) -> str:
+    """Calculate the version of a commit from an event loop."""
+    import asyncio
+
+    name, streamed, budget = await _in_thread(_read_config, repo_dir, backend, budget)
+    if name != DEFAULT_BACKEND or streamed:
+        # Only the default backend reading every tag runs git as asyncio
+        # subprocesses.
+        return await _in_thread(_find_lsst_version, repo_dir, version_commit, name, budget)
+
+    if budget is None:
+        return await _calculate_plumbing_version(repo_dir, version_commit, None)
+    meter = Meter(budget)
+    try:
+        try:
+            return await asyncio.wait_for(
+                _calculate_plumbing_version(repo_dir, version_commit, meter), meter.remaining()
+            )
+        except asyncio.TimeoutError:
+            raise BudgetExceededError(f"Time budget of {budget.seconds} seconds exceeded") from None
+    except BudgetExceededError as e:
+        return await _in_thread(_fall_back_after_overrun, repo_dir, version_commit, meter, e)
+
+
+async def find_lsst_version_async(
+    repo_dir: str = ".",
+    version_commit: str = "HEAD",
+    timeout: Optional[float] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    backend: Optional[str] = None,
+    budget: Optional[ResolutionBudget] = None,
+) -> str:
+    """Return the version for the given LSST commit without blocking the
+    event loop.
+
+    Parameters
+    ----------
+    repo_dir : `str`, optional
+        Path to the relevant Git repository.
+    version_commit : `str`, optional
+        Commit for which the version is to be calculated.
+    timeout : `float`, optional
+        Maximum time in seconds to spend determining the version.
+    semaphore : `asyncio.Semaphore`, optional
+        Limits the number of repositories examined at once when shared
+        between calls. The timeout starts once it has been acquired.
+    backend : `str`, optional
+        Name of the implementation of the git operations to use, as for
+        `find_lsst_version`.
+    budget : `ResolutionBudget`, optional
+        Limits on the time taken and the number of commits examined, as
+        for `find_lsst_version`.
+
+    Returns
+    -------
+    dev_version : `str`
+        The development version of the commit, as calculated by
+        `find_lsst_version`, including the fallback version if the budget
+        runs out.
+
+    Raises
+    ------
+    asyncio.TimeoutError
+        Raised if the timeout expires. Any git command that was running is
+        killed, as it is if the calling task is cancelled.
+
+    Notes
+    -----
+    With the ``plumbing`` backend and every tag examined, git is run as
+    asyncio subprocesses and files, such as the tag index and the history
+    index, are read in worker threads. Otherwise the calculation is done by
+    `find_lsst_version` in a worker thread, which the timeout does not
+    stop. The version server named by ``LSST_VERSIONS_SOCKET`` is not
+    consulted.
+    """
+    import asyncio
+
+    calculation = _calculate_version(repo_dir, version_commit, backend, budget)
+    if semaphore is None:
+        return await asyncio.wait_for(calculation, timeout)
+    async with semaphore:
+        return await asyncio.wait_for(calculation, timeout)
+
+
+async def get_lsst_version_async(
+    dirname: str = ".",
+    fallback: bool = True,
+    timeout: Optional[float] = None,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    backend: Optional[str] = None,
+    budget: Optional[ResolutionBudget] = None,
+) -> str:
+    """Determine the version of a directory without blocking the event
+    loop.
+
+    Parameters
+    ----------
+    dirname : `str`, optional
+        The directory to use to find a version.
+    fallback : `bool`, optional
+        If `True` and no Git version can be found, including because the
+        timeout expired, an attempt will be made to find the version from
+        package metadata.
+    timeout : `float`, optional
+        Maximum time in seconds to spend determining the version from Git.
+    semaphore : `asyncio.Semaphore`, optional
+        Limits the number of repositories examined at once when shared
+        between calls.
+    backend : `str`, optional
+        Name of the implementation of the git operations to use. See
+        `find_lsst_version`.
+    budget : `ResolutionBudget`, optional
+        Limits on the work done to find the version from Git. See
+        `find_lsst_version`.
+
+    Returns
+    -------
+    version : `str`
+        The version string, as returned by `get_lsst_version`. If the
+        budget runs out this is the same fallback version.
+    """
+    try:
+        return await find_lsst_version_async(dirname, "HEAD", timeout, semaphore, backend, budget)
+    except Exception:
+        if not fallback:
+            raise
+    with span("metadata_fallback", dirname=dirname):
+        version = _find_version_from_metadata(dirname)
+    if version is None:
+        raise RuntimeError(f"Unable to find a version from Git or metadata within directory {dirname}")
+    return version
+
+
+async def get_lsst_versions_async(
+    dirnames: Iterable[str],
+    fallback: bool = True,
+    max_concurrency: Optional[int] = None,
+    timeout: Optional[float] = None,
+    backend: Optional[str] = None,
+    budget: Optional[ResolutionBudget] = None,
+) -> AsyncIterator[RepoVersion]:
+    """Determine the versions of many repositories from one event loop.
+
+    Parameters
+    ----------
+    dirnames : `~collections.abc.Iterable` [`str`]
+        The directories to examine. This can be a lazy iterable; only a
+        bounded number of directories are read ahead of the results.
+    fallback : `bool`, optional
+        If `True` and no Git version can be found, an attempt will be made
+        to find the version from package metadata.
+    max_concurrency : `int`, optional
+        Maximum number of repositories to process at the same time.
+        Defaults to the number of CPUs.
+    timeout : `float`, optional
+        Maximum time in seconds to spend on each repository, not counting
+        the time spent waiting for others to finish.
+    backend : `str`, optional
+        Name of the implementation of the git operations to use for every
+        repository. See `find_lsst_version`.
+    budget : `ResolutionBudget`, optional
+        Limits on the work done for each repository. See
+        `find_lsst_version`.
+
+    Yields
+    ------
+    result : `RepoVersion`
+        The outcome for each directory, in the order in which they
+        complete. A failure is reported in the result rather than raised.
+        If the generator is closed early, the outstanding work is
+        cancelled.
+    """
+    import asyncio
+
+    if max_concurrency is None:
+        max_concurrency = os.cpu_count() or 1
+
+    async def get_one(dirname: str) -> RepoVersion:
+        try:
+            version = await get_lsst_version_async(dirname, fallback, timeout, None, backend, budget)
+        except asyncio.TimeoutError:
+            return RepoVersion(dirname, None, None, f"Timed out after {timeout} s.")
+        except Exception as e:
+            return RepoVersion(dirname, None, None, str(e) or repr(e))
+        return RepoVersion(dirname, version, None, None)
+
+    remaining = iter(dirnames)
+    pending: Set[asyncio.Task[RepoVersion]] = set()
+    try:
+        while True:
+            # Only as many repositories as are allowed to run are started so
+            # the timeout does not include time spent waiting.
+            for dirname in itertools.islice(remaining, max_concurrency - len(pending)):
+                pending.add(asyncio.ensure_future(get_one(dirname)))
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
@@ -0,0 +1,365 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Interchangeable implementations of the git operations used to calculate
+versions.
+
+The plumbing backend reads references and the commit-graph directly and
+otherwise runs ``git`` plumbing commands. The GitPython backend uses the
+GitPython object model, as earlier releases of this package did, and is
+kept as a reference implementation.
+"""
+
+from __future__ import annotations
+
+__all__ = (
+    "BACKENDS",
+    "BACKEND_ENV",
+    "CROSS_CHECK",
+    "DEFAULT_BACKEND",
+    "GitBackend",
+    "GitPythonBackend",
+    "PlumbingBackend",
+    "get_backend_name",
+    "open_backend",
+)
+
+import abc
+import logging
+import os
+from typing import TYPE_CHECKING, ClassVar, Dict, Generator, Iterable, Mapping, Optional, Set, Tuple, Type
+
+from . import _history
+from ._budget import get_meter
+from ._cache import load_tag_tables
+from ._config import read_tool_config
+from ._git import is_ancestor, iter_git_lines, iter_tags, tags_containing
+from ._graph import load_commit_graph
+from ._objects import iter_first_parents
+from ._profile import count
+from ._refs import find_git_dir, read_tags, resolve_head
+from ._tags import TagTables, build_tables, classify_tag
+from ._walk import find_nearest_weekly
+
+if TYPE_CHECKING:
+    import git
+
+_LOG = logging.getLogger("lsst_versions")
+
+BACKEND_ENV = "LSST_VERSIONS_BACKEND"
+"""Environment variable selecting the backend."""
+
+CROSS_CHECK = "cross-check"
+"""Backend name requesting that every backend is run and compared."""
+
+
+class GitBackend(abc.ABC):
+    """The operations on a git repository needed to calculate versions.
+
+    Parameters
+    ----------
+    repo_dir : `str`
+        Path to the repository. Parent directories are not searched.
+    """
+
+    name: ClassVar[str]
+    """Name used to select the backend."""
+
+    git_dir: str
+    """Path to the git directory of the repository."""
+
+    def __init__(self, repo_dir: str):
+        self.git_dir = find_git_dir(repo_dir)
+
+    @abc.abstractmethod
+    def iter_tags(self) -> Iterable[Tuple[str, str, Optional[str]]]:
+        """Return the tags that refer to commits, sorted by name.
+
+        Returns
+        -------
+        tags : `~collections.abc.Iterable` [`tuple`]
+            The name of each tag, the hex SHA of the commit it refers to
+            and the hex SHA of the tag object (`None` for a lightweight tag).
+        """
+
+    def load_tag_tables(self) -> TagTables:
+        """Classify the tags of the repository.
+
+        Returns
+        -------
+        tables : `TagTables`
+            The releases, major releases and weeklies of the repository.
+        """
+        return build_tables(classify_tag(*tag) for tag in self.iter_tags())
+
+    @abc.abstractmethod
+    def resolve(self, rev: str) -> str:
+        """Resolve a revision to a commit.
+
+        Parameters
+        ----------
+        rev : `str`
+            Any revision understood by git.
+
+        Returns
+        -------
+        hexsha : `str`
+            Hex SHA of the commit.
+        """
+
+    @abc.abstractmethod
+    def iter_first_parents(self, hexsha: str) -> Generator[str, None, None]:
+        """Walk the first-parent history of a commit.
+
+        Parameters
+        ----------
+        hexsha : `str`
+            Hex SHA of the commit to start from.
+
+        Yields
+        ------
+        hexsha : `str`
+            Hex SHA of each commit, starting with ``hexsha`` itself. The
+            generator should be closed if it is not exhausted.
+        """
+
+    def find_nearest_weekly(self, hexsha: str, weeklies: Mapping[str, str]) -> Tuple[int, str]:
+        """Find the closest weekly in the first-parent history of a commit.
+
+        Parameters
+        ----------
+        hexsha : `str`
+            Hex SHA of the commit.
+        weeklies : `~collections.abc.Mapping` [`str`, `str`]
+            The normalized weekly tag associated with each commit.
+
+        Returns
+        -------
+        counter : `int`
+            The number of first-parent steps from the commit to the weekly,
+            or to the root commit if there is none.
+        weekly_name : `str`
+            The weekly that was found, or an empty string.
+        """
+        history = self.iter_first_parents(hexsha)
+        try:
+            return find_nearest_weekly(history, weeklies)
+        finally:
+            history.close()
+
+    @abc.abstractmethod
+    def is_ancestor(self, ancestor: str, rev: str) -> bool:
+        """Determine whether one commit is an ancestor of another.
+
+        Parameters
+        ----------
+        ancestor : `str`
+            Hex SHA of the potential ancestor.
+        rev : `str`
+            Hex SHA of the commit whose history is searched.
+
+        Returns
+        -------
+        is_ancestor : `bool`
+            `True` if ``ancestor`` is ``rev`` or one of its ancestors.
+        """
+
+    def tags_containing(self, hexsha: str, tags: Dict[str, str]) -> Set[str]:
+        """Determine which tags have a commit in their history.
+
+        Parameters
+        ----------
+        hexsha : `str`
+            Hex SHA of the commit to look for.
+        tags : `dict` [`str`, `str`]
+            The hex SHA of the commit for each tag name to check.
+
+        Returns
+        -------
+        containing : `set` [`str`]
+            The names of the tags whose history includes the commit.
+        """
+        count("ancestry_checks", len(tags))
+        meter = get_meter()
+        containing = set()
+        for name, commit in tags.items():
+            if meter is not None:
+                meter.check()
+            if self.is_ancestor(hexsha, commit):
+                containing.add(name)
+        return containing
+
+
+class PlumbingBackend(GitBackend):
+    """Backend reading git files directly and running ``git`` plumbing
+    commands. GitPython is not needed.
+    """
+
+    name = "plumbing"
+
+    def iter_tags(self) -> Iterable[Tuple[str, str, Optional[str]]]:
+        tags = read_tags(self.git_dir)
+        return tags if tags is not None else iter_tags(self.git_dir)
+
+    def load_tag_tables(self) -> TagTables:
+        # The classified tags are cached in the git directory and only
+        # refreshed when the tag references change.
+        return load_tag_tables(self.git_dir)
+
+    def resolve(self, rev: str) -> str:
+        if rev == "HEAD" and (hexsha := resolve_head(self.git_dir)) is not None:
+            return hexsha
+        lines = iter_git_lines(self.git_dir, "rev-parse", "--verify", "--quiet", f"{rev}^{{commit}}")
+        try:
+            return next(lines)
+        finally:
+            lines.close()
+
+    def iter_first_parents(self, hexsha: str) -> Generator[str, None, None]:
+        # Commits are read from the object store, falling back to git.
+        return iter_first_parents(self.git_dir, hexsha)
+
+    def is_ancestor(self, ancestor: str, rev: str) -> bool:
+        return is_ancestor(self.git_dir, ancestor, rev)
+
+    def find_nearest_weekly(self, hexsha: str, weeklies: Mapping[str, str]) -> Tuple[int, str]:
+        # An index of the history of main, if one has been built, saves
+        # walking back to the weekly.
+        found = _history.find_nearest_weekly(self.git_dir, hexsha, weeklies, self.iter_first_parents)
+        return found if found is not None else super().find_nearest_weekly(hexsha, weeklies)
+
+    def tags_containing(self, hexsha: str, tags: Dict[str, str]) -> Set[str]:
+        found = _history.tags_containing(self.git_dir, hexsha, tags, self._tags_containing)
+        return found if found is not None else self._tags_containing(hexsha, tags)
+
+    def _tags_containing(self, hexsha: str, tags: Dict[str, str]) -> Set[str]:
+        # The commit-graph answers this without running git, otherwise git
+        # is asked about all the tags in a single call.
+        count("ancestry_checks", len(tags))
+        graph = load_commit_graph(self.git_dir)
+        if graph is not None:
+            try:
+                commits = graph.containing(hexsha, set(tags.values()))
+            finally:
+                graph.close()
+            if commits is not None:
+                return {name for name, commit in tags.items() if commit in commits}
+        return tags_containing(self.git_dir, hexsha, tags)
+
+
+class GitPythonBackend(GitBackend):
+    """Backend using the GitPython object model."""
+
+    name = "gitpython"
+
+    def __init__(self, repo_dir: str):
+        # GitPython is slow to import so only load it once a repository is
+        # actually needed.
+        try:
+            import git
+        except ImportError:
+            raise RuntimeError("GitPython package not installed. Unable to determine version.") from None
+        self.repo: git.Repo = git.Repo(repo_dir)
+        self.git_dir = str(self.repo.git_dir)
+
+    def iter_tags(self) -> Iterable[Tuple[str, str, Optional[str]]]:
+        tags = []
+        for tagref in self.repo.tags:
+            try:
+                commit = tagref.commit
+            except ValueError:
+                # The tag refers to a tree or blob.
+                continue
+            tag = tagref.tag
+            tags.append((tagref.name, commit.hexsha, tag.hexsha if tag is not None else None))
+        return sorted(tags)
+
+    def resolve(self, rev: str) -> str:
+        return self.repo.commit(rev).hexsha
+
+    def iter_first_parents(self, hexsha: str) -> Generator[str, None, None]:
+        commit: Optional[git.Commit] = self.repo.commit(hexsha)
+        while commit is not None:
+            yield commit.hexsha
+            parents = commit.parents
+            commit = parents[0] if parents else None
+
+    def is_ancestor(self, ancestor: str, rev: str) -> bool:
+        return self.repo.is_ancestor(self.repo.commit(ancestor), self.repo.commit(rev))
+
+
+BACKENDS: Dict[str, Type[GitBackend]] = {
+    backend.name: backend for backend in (PlumbingBackend, GitPythonBackend)
+}
+"""The available backends, indexed by name."""
+
+DEFAULT_BACKEND = PlumbingBackend.name
+"""Name of the backend used unless another is configured."""
+
+
+def get_backend_name(repo_dir: str, backend: Optional[str] = None) -> str:
+    """Determine which backend to use for a repository.
+
+    Parameters
+    ----------
+    repo_dir : `str`
+        Path to the repository.
+    backend : `str`, optional
+        Name of the backend requested by the caller.
+
+    Returns
+    -------
+    name : `str`
+        The name of a backend in `BACKENDS`, or `CROSS_CHECK`.
+
+    Notes
+    -----
+    In order of priority the backend is taken from the ``backend``
+    parameter, the ``LSST_VERSIONS_BACKEND`` environment variable and the
+    ``backend`` key of the ``[tool.lsst_versions]`` table of the
+    ``pyproject.toml`` file in ``repo_dir``.
+    """
+    if not backend:
+        backend = os.environ.get(BACKEND_ENV)
+    if not backend:
+        try:
+            config = read_tool_config(os.path.join(repo_dir, "pyproject.toml"))
+        except FileNotFoundError:
+            config = None
+        except (OSError, ImportError, ValueError) as e:
+            _LOG.debug("Unable to read backend from pyproject.toml in %s: %s", repo_dir, e)
+            config = None
+        if config is not None:
+            backend = config.get("backend")
+    if not backend:
+        return DEFAULT_BACKEND
+    if backend not in BACKENDS and backend != CROSS_CHECK:
+        choices = ", ".join([*BACKENDS, CROSS_CHECK])
+        raise ValueError(f"Unknown git backend '{backend}'. Choose from {choices}.")
+    return backend
+
+
+def open_backend(repo_dir: str, name: str = DEFAULT_BACKEND) -> GitBackend:
+    """Open a repository with a backend.
+
+    Parameters
+    ----------
+    repo_dir : `str`
+        Path to the repository.
+    name : `str`, optional
+        Name of the backend.
+
+    Returns
+    -------
+    backend : `GitBackend`
+        The backend for the repository.
+    """
+    return BACKENDS[name](repo_dir)
@@ -0,0 +1,291 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Limits on the work done to determine a version.
+
+While a budget is in force in a thread, the walks of history and the
+ancestry checks charge the commits they examine to its meter and check its
+deadline, raising `BudgetExceededError` when either runs out. Commands run
+by ``git`` are killed when the deadline passes.
+"""
+
+from __future__ import annotations
+
+__all__ = ["ResolutionBudget"]
+
+import contextlib
+import logging
+import os
+import threading
+import time
+from typing import Iterator, NamedTuple, Optional
+
+from ._config import read_tool_config
+from ._profile import count
+
+_LOG = logging.getLogger("lsst_versions")
+
+BUDGET_SECONDS_ENV = "LSST_VERSIONS_BUDGET_SECONDS"
+"""Environment variable setting the time budget."""
+
+BUDGET_COMMITS_ENV = "LSST_VERSIONS_BUDGET_COMMITS"
+"""Environment variable setting the commit budget."""
+
+BUDGET_LABEL = "budget"
+"""Local version label marking a version found when the budget ran out."""
+
+# The meter of the budget in force in each thread.
+_LOCAL = threading.local()
+
+
+def is_budget_fallback(version: str) -> bool:
+    """Determine whether a version was found when the budget ran out.
+
+    Parameters
+    ----------
+    version : `str`
+        The version.
+
+    Returns
+    -------
+    is_fallback : `bool`
+        `True` if the version has the local label of a fallback.
+    """
+    return version.endswith(f"+{BUDGET_LABEL}")
+
+
+class ResolutionBudget(NamedTuple):
+    """Limits on the work done to determine a version."""
+
+    seconds: Optional[float] = None
+    """Maximum time to spend, `None` for no limit."""
+
+    commits: Optional[int] = None
+    """Maximum number of commits to examine while walking history and
+    checking ancestry, `None` for no limit."""
+
+
+class BudgetExceededError(RuntimeError):
+    """Raised when version determination runs out of budget."""
+
+
+class Meter:
+    """The use of a budget.
+
+    Parameters
+    ----------
+    budget : `ResolutionBudget`
+        The limits.
+    """
+
+    __slots__ = ("budget", "start", "deadline", "commits")
+
+    def __init__(self, budget: ResolutionBudget):
+        self.budget = budget
+        self.start = time.monotonic()
+        self.deadline = None if budget.seconds is None else self.start + budget.seconds
+        self.commits = 0
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the budget came into force (`float`)."""
+        return time.monotonic() - self.start
+
+    def remaining(self) -> Optional[float]:
+        """Return the number of seconds left, `None` if there is no
+        deadline.
+        """
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def check(self) -> None:
+        """Raise if the deadline has passed.
+
+        Raises
+        ------
+        BudgetExceededError
+            Raised if the deadline has passed.
+        """
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise BudgetExceededError(f"Time budget of {self.budget.seconds} seconds exceeded")
+
+    def charge(self, n: int = 1) -> None:
+        """Record commits that have been examined.
+
+        Parameters
+        ----------
+        n : `int`, optional
+            Number of commits.
+
+        Raises
+        ------
+        BudgetExceededError
+            Raised if the commit budget is exhausted or the deadline has
+            passed.
+        """
+        self.commits += n
+        if self.budget.commits is not None and self.commits > self.budget.commits:
+            raise BudgetExceededError(f"Commit budget of {self.budget.commits} commits exceeded")
+        self.check()
+
+
+def get_meter() -> Optional[Meter]:
+    """Return the meter of the budget in force in this thread.
+
+    Returns
+    -------
+    meter : `Meter` or `None`
+        The meter, or `None` if there is no budget.
+    """
+    return _LOCAL.__dict__.get("meter")
+
+
+@contextlib.contextmanager
+def metered(meter: Optional[Meter]) -> Iterator[None]:
+    """Charge the work done in this thread to an existing meter.
+
+    Parameters
+    ----------
+    meter : `Meter` or `None`
+        The meter, `None` for no budget.
+    """
+    previous = get_meter()
+    _LOCAL.meter = meter
+    try:
+        yield
+    finally:
+        _LOCAL.meter = previous
+
+
+@contextlib.contextmanager
+def limit(budget: ResolutionBudget) -> Iterator[Meter]:
+    """Put a budget in force in this thread.
+
+    Parameters
+    ----------
+    budget : `ResolutionBudget`
+        The limits.
+
+    Yields
+    ------
+    meter : `Meter`
+        The meter charged while the budget is in force.
+    """
+    meter = Meter(budget)
+    with metered(meter):
+        yield meter
+
+
+def _parse_limit(value: object, kind: type, source: str) -> Optional[float]:
+    """Convert a configured limit, checking that it is not negative."""
+    if value is None or value == "":
+        return None
+    try:
+        number = kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid budget {value!r} from {source}") from None
+    if number < 0:
+        raise ValueError(f"Budget from {source} must not be negative, got {value!r}")
+    return number
+
+
+def get_budget(repo_dir: str, budget: Optional[ResolutionBudget] = None) -> Optional[ResolutionBudget]:
+    """Determine the budget for determining the version of a repository.
+
+    Parameters
+    ----------
+    repo_dir : `str`
+        Path to the repository.
+    budget : `ResolutionBudget`, optional
+        Budget requested by the caller.
+
+    Returns
+    -------
+    budget : `ResolutionBudget` or `None`
+        The budget, or `None` if there is no limit.
+
+    Raises
+    ------
+    ValueError
+        Raised if a configured limit is not a non-negative number.
+
+    Notes
+    -----
+    In order of priority the budget is taken from the ``budget`` parameter,
+    the ``LSST_VERSIONS_BUDGET_SECONDS`` and
+    ``LSST_VERSIONS_BUDGET_COMMITS`` environment variables and the
+    ``budget_seconds`` and ``budget_commits`` keys of the
+    ``[tool.lsst_versions]`` table of the ``pyproject.toml`` file in
+    ``repo_dir``.
+    """
+    if budget is None:
+        seconds = _parse_limit(os.environ.get(BUDGET_SECONDS_ENV), float, BUDGET_SECONDS_ENV)
+        commits = _parse_limit(os.environ.get(BUDGET_COMMITS_ENV), int, BUDGET_COMMITS_ENV)
+        if seconds is not None or commits is not None:
+            budget = ResolutionBudget(seconds, None if commits is None else int(commits))
+    if budget is None:
+        try:
+            config = read_tool_config(os.path.join(repo_dir, "pyproject.toml"))
+        except FileNotFoundError:
+            config = None
+        except (OSError, ImportError, ValueError) as e:
+            _LOG.debug("Unable to read budget from pyproject.toml in %s: %s", repo_dir, e)
+            config = None
+        if config is not None:
+            seconds = _parse_limit(config.get("budget_seconds"), float, "budget_seconds")
+            commits = _parse_limit(config.get("budget_commits"), int, "budget_commits")
+            if seconds is not None or commits is not None:
+                budget = ResolutionBudget(seconds, None if commits is None else int(commits))
+    if budget is None or (budget.seconds is None and budget.commits is None):
+        return None
+    return budget
+
+
+def report_overrun(repo_dir: str, commit: str, meter: Meter, reason: str, version: str) -> None:
+    """Log that a budget ran out.
+
+    Parameters
+    ----------
+    repo_dir : `str`
+        Path to the repository.
+    commit : `str`
+        The commit whose version was being determined.
+    meter : `Meter`
+        The meter of the budget.
+    reason : `str`
+        Description of the limit that was reached.
+    version : `str`
+        The fallback version used instead.
+
+    Notes
+    -----
+    The log record carries an ``event`` attribute of ``budget_exceeded``
+    and a ``details`` attribute holding a `dict` of the values, for
+    handlers that emit structured logs.
+    """
+    details = {
+        "repo_dir": repo_dir,
+        "commit": commit,
+        "reason": reason,
+        "elapsed_seconds": round(meter.elapsed, 6),
+        "commits_examined": meter.commits,
+        "budget_seconds": meter.budget.seconds,
+        "budget_commits": meter.budget.commits,
+        "fallback_version": version,
+    }
+    count("budget_exceeded")
+    _LOG.warning(
+        "Version determination for %s in repo '%s' stopped: %s. Using %s.",
+        commit,
+        repo_dir,
+        reason,
+        version,
+        extra={"event": "budget_exceeded", "details": details},
+    )
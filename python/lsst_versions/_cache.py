@@ -0,0 +1,389 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Persistent cache of classified tags stored in the git directory."""
+
+from __future__ import annotations
+
+__all__ = (
+    "cache_enabled",
+    "load_tag_tables",
+    "read_version_stamp",
+    "repository_state",
+    "write_version_stamp",
+)
+
+import contextlib
+import json
+import logging
+import os
+import tempfile
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore
+
+try:
+    from .__version__ import __version__
+except ImportError:
+    # The version file is written when the package is built.
+    __version__ = "unknown"
+
+from ._budget import is_budget_fallback
+from ._git import iter_tags
+from ._profile import count
+from ._refs import get_alternates, get_common_dir, read_tags, refs_fingerprint, resolve_head
+from ._tags import TagRecord, TagTables, build_tables, classify_tag
+
+_LOG = logging.getLogger("lsst_versions")
+
+# Directory within the common git directory used for cached data.
+CACHE_DIRNAME = "lsst_versions"
+
+# Increment whenever the content of the tag index changes meaning.
+_TAG_INDEX_FORMAT = 2
+_TAG_INDEX_FILENAME = "tags.json"
+
+# Increment whenever the content of the version stamps changes meaning.
+_STAMP_FORMAT = 2
+_STAMP_FILENAME = "version_stamps.json"
+
+# Environment variable that can be used to disable persistent caches.
+_CACHE_ENV = "LSST_VERSIONS_CACHE"
+
+# Tag tables already loaded by this process, keyed by cache directory.
+# Each entry holds the fingerprint of the references it was built from.
+_LOADED_TABLES: Dict[str, Tuple[str, TagTables]] = {}
+
+
+def cache_enabled() -> bool:
+    """Report whether persistent caches should be used.
+
+    Returns
+    -------
+    enabled : `bool`
+        `False` if the ``LSST_VERSIONS_CACHE`` environment variable is set to
+        ``0``, ``false`` or ``no``.
+    """
+    return os.environ.get(_CACHE_ENV, "1").lower() not in ("0", "false", "no")
+
+
+def get_cache_dir(git_dir: str) -> str:
+    """Return the directory used to store cached data for a repository.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+
+    Returns
+    -------
+    cache_dir : `str`
+        Path to the cache directory. It is not created.
+    """
+    return os.path.join(get_common_dir(git_dir), CACHE_DIRNAME)
+
+
+def get_shared_cache_dirs(git_dir: str) -> List[str]:
+    """Return the cache directories of repositories that lend objects.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+
+    Returns
+    -------
+    cache_dirs : `list` [`str`]
+        The cache directories of the repositories owning the alternate
+        object directories, in the order git searches them. Only those that
+        exist are returned.
+
+    Notes
+    -----
+    Cached data describing commits is valid in any repository with those
+    commits, so it can be read from these directories if the repository
+    has none of its own. Updates are only written to its own directory.
+    """
+    cache_dirs = []
+    for objects_dir in get_alternates(git_dir):
+        if os.path.basename(objects_dir) != "objects":
+            continue
+        cache_dir = os.path.join(os.path.dirname(objects_dir), CACHE_DIRNAME)
+        if os.path.isdir(cache_dir):
+            cache_dirs.append(cache_dir)
+    return cache_dirs
+
+
+@contextlib.contextmanager
+def locked(cache_dir: str, name: str) -> Iterator[None]:
+    """Hold an exclusive lock on a file in the cache directory.
+
+    Parameters
+    ----------
+    cache_dir : `str`
+        The cache directory. It is created if necessary.
+    name : `str`
+        Name of the cached file to lock.
+
+    Notes
+    -----
+    Locking is advisory and is skipped on platforms without `fcntl`.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, f"{name}.lock"), "w") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Write a file such that readers never see partial content.
+
+    Parameters
+    ----------
+    path : `str`
+        The file to write.
+    data : `bytes`
+        The content of the file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
+
+
+def _read_index(path: str) -> Optional[Tuple[str, List[TagRecord]]]:
+    """Read the tag index, returning the fingerprint and records."""
+    try:
+        with open(path, "rb") as fh:
+            content = json.loads(fh.read())
+        if content.get("format") != _TAG_INDEX_FORMAT:
+            return None
+        return content["fingerprint"], [TagRecord(*record) for record in content["tags"]]
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        _LOG.debug("Ignoring unreadable tag index %s: %s", path, e)
+        return None
+
+
+def _refresh_records(git_dir: str, previous: Iterable[TagRecord]) -> List[TagRecord]:
+    """Read the current tags, classifying only the tags that changed."""
+    by_name = {record.name: record for record in previous}
+    known = {record.tag or record.commit: (record.commit, record.tag) for record in by_name.values()}
+    tags: Optional[Iterable[Tuple[str, str, Optional[str]]]] = read_tags(git_dir, known)
+    if tags is None:
+        tags = iter_tags(git_dir)
+
+    records = []
+    n_new = 0
+    for name, commit, tag in tags:
+        record = by_name.get(name)
+        if record is None or record.commit != commit or record.tag != tag:
+            record = classify_tag(name, commit, tag)
+            n_new += 1
+        records.append(record)
+    _LOG.debug("Classified %d new or changed tags out of %d.", n_new, len(records))
+    count("tags_classified", n_new)
+    return records
+
+
+def load_tag_tables(git_dir: str) -> TagTables:
+    """Return the classified tags for a repository.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+
+    Returns
+    -------
+    tables : `TagTables`
+        The releases, major releases and weeklies of the repository.
+
+    Notes
+    -----
+    The classified tags are stored in the common git directory together with
+    a fingerprint of the tag references. When the fingerprint no longer
+    matches, only tags that were added or changed are classified again.
+    A repository without an index of its own, such as a clone made with
+    ``--reference``, starts from the index of a repository it borrows
+    objects from. Linked worktrees share the index of their common git
+    directory.
+    If the cache is disabled or can not be written, the tags are classified
+    from scratch.
+
+    The tables are also retained in memory so that a long-lived process
+    only needs to check the fingerprint on later calls.
+    """
+    if not cache_enabled():
+        return build_tables(_refresh_records(git_dir, []))
+
+    cache_dir = get_cache_dir(git_dir)
+    path = os.path.join(cache_dir, _TAG_INDEX_FILENAME)
+    fingerprint = refs_fingerprint(git_dir)
+
+    if (loaded := _LOADED_TABLES.get(cache_dir)) is not None and loaded[0] == fingerprint:
+        _LOG.debug("Using cached tag index from memory for %s", path)
+        return loaded[1]
+    tables = _load_tag_tables(git_dir, cache_dir, path, fingerprint)
+    _LOADED_TABLES[cache_dir] = (fingerprint, tables)
+    return tables
+
+
+def _read_shared_records(git_dir: str) -> List[TagRecord]:
+    """Read the classified tags of a repository that lends objects."""
+    for cache_dir in get_shared_cache_dirs(git_dir):
+        if (stored := _read_index(os.path.join(cache_dir, _TAG_INDEX_FILENAME))) is not None:
+            # Only tags whose references are unchanged are reused.
+            _LOG.debug("Using classified tags from %s", cache_dir)
+            return stored[1]
+    return []
+
+
+def _load_tag_tables(git_dir: str, cache_dir: str, path: str, fingerprint: str) -> TagTables:
+    """Load the tag tables from the index file, updating it if needed."""
+    stored = _read_index(path)
+    if stored is not None and stored[0] == fingerprint:
+        _LOG.debug("Using cached tag index from %s", path)
+        return build_tables(stored[1])
+
+    try:
+        with locked(cache_dir, _TAG_INDEX_FILENAME):
+            # Another process may have refreshed the index while we waited.
+            stored = _read_index(path)
+            if stored is not None and stored[0] == fingerprint:
+                return build_tables(stored[1])
+            records = _refresh_records(git_dir, stored[1] if stored else _read_shared_records(git_dir))
+            content: Dict[str, object] = {
+                "format": _TAG_INDEX_FORMAT,
+                "fingerprint": fingerprint,
+                "tags": [list(record) for record in records],
+            }
+            write_atomic(path, json.dumps(content, separators=(",", ":")).encode())
+    except OSError as e:
+        _LOG.debug("Unable to update tag index in %s: %s", cache_dir, e)
+        records = _refresh_records(git_dir, stored[1] if stored else _read_shared_records(git_dir))
+
+    return build_tables(records)
+
+
+def repository_state(git_dir: str) -> Optional[Dict[str, str]]:
+    """Describe everything a version depends on, without running git.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+
+    Returns
+    -------
+    state : `dict` [`str`, `str`] or `None`
+        The ``HEAD`` commit, a fingerprint of the tags and the version of
+        this package. `None` if ``HEAD`` can not be resolved from the
+        files in the git directory.
+    """
+    head = resolve_head(git_dir)
+    if head is None:
+        return None
+    return {"head": head, "fingerprint": refs_fingerprint(git_dir), "package_version": __version__}
+
+
+def _read_stamps(path: str) -> Dict[str, Dict[str, str]]:
+    """Read the version stamps, returning an empty mapping if unusable."""
+    try:
+        with open(path, "rb") as fh:
+            content = json.loads(fh.read())
+        if content.get("format") == _STAMP_FORMAT:
+            return dict(content["stamps"])
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        _LOG.debug("Ignoring unreadable version stamps %s: %s", path, e)
+    return {}
+
+
+def read_version_stamp(git_dir: str, write_to: str, config: str) -> Optional[str]:
+    """Return the version recorded when a version file was last written.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    write_to : `str`
+        Path to the version file.
+    config : `str`
+        Fingerprint of the configuration used to determine versions.
+
+    Returns
+    -------
+    version : `str` or `None`
+        The recorded version, or `None` if ``HEAD``, the tags, the
+        configuration or this package have changed since, or there is no
+        usable record.
+
+    Notes
+    -----
+    Only files in the git directory are examined, so a build that
+    determines the version several times only calculates it once.
+    """
+    if not cache_enabled() or (state := repository_state(git_dir)) is None:
+        return None
+    state["config"] = config
+    stamp = _read_stamps(os.path.join(get_cache_dir(git_dir), _STAMP_FILENAME)).get(os.path.abspath(write_to))
+    if not isinstance(stamp, dict) or any(stamp.get(key) != value for key, value in state.items()):
+        return None
+    version = stamp.get("version")
+    return None if version is None or is_budget_fallback(version) else version
+
+
+def write_version_stamp(git_dir: str, write_to: str, version: str, config: str) -> None:
+    """Record the version written to a version file.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    write_to : `str`
+        Path to the version file.
+    version : `str`
+        The version that was written. A fallback found when a budget ran
+        out is not recorded, so that the next build tries again.
+    config : `str`
+        Fingerprint of the configuration used to determine the version.
+    """
+    if is_budget_fallback(version):
+        return
+    if not cache_enabled() or (state := repository_state(git_dir)) is None:
+        return
+    state["config"] = config
+    cache_dir = get_cache_dir(git_dir)
+    path = os.path.join(cache_dir, _STAMP_FILENAME)
+    try:
+        with locked(cache_dir, _STAMP_FILENAME):
+            stamps = _read_stamps(path)
+            stamps[os.path.abspath(write_to)] = {**state, "version": version}
+            content = {"format": _STAMP_FORMAT, "stamps": stamps}
+            write_atomic(path, json.dumps(content, separators=(",", ":")).encode())
+    except OSError as e:
+        _LOG.debug("Unable to record version stamp in %s: %s", cache_dir, e)
@@ -12,13 +12,82 @@
 from __future__ import annotations
 
 import argparse
+import contextlib
+import itertools
+import json
 import logging
+import os
+import sys
+import sysconfig
+from typing import Iterator, List, Optional, TextIO
 
+from ._backend import BACKEND_ENV, BACKENDS, CROSS_CHECK, PlumbingBackend
+from ._budget import BUDGET_COMMITS_ENV, BUDGET_SECONDS_ENV, ResolutionBudget
+from ._daemon import SOCKET_ENV, serve
+from ._git import symbolic_full_name
+from ._history import build_history_index
+from ._metadata import scan_versions
+from ._multi import get_lsst_versions
+from ._profile import TraceRecorder
+from ._range import iter_lsst_versions
+from ._reverse import resolve_lsst_version
 from ._versions import _process_version_writing
 
 _LOG = logging.getLogger("lsst_versions")
 
 
+def _add_resolution_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the options selecting the backend and the budget to a parser.
+
+    Parameters
+    ----------
+    parser : `argparse.ArgumentParser`
+        The parser to modify.
+    """
+    parser.add_argument(
+        "--backend",
+        choices=(*BACKENDS, CROSS_CHECK),
+        default=None,
+        help="Implementation of the git operations to use. With cross-check every implementation is used "
+        f"and they must agree. Defaults to ${BACKEND_ENV}, then the pyproject.toml setting, then plumbing.",
+    )
+
+    parser.add_argument(
+        "--budget-seconds",
+        type=float,
+        metavar="SECONDS",
+        help="Stop determining a version after this time and use a fallback version marked with a +budget "
+        f"local label. Defaults to ${BUDGET_SECONDS_ENV}, then the budget_seconds setting in pyproject.toml.",
+    )
+
+    parser.add_argument(
+        "--budget-commits",
+        type=int,
+        metavar="N",
+        help="Stop determining a version after examining this many commits and use a fallback version. "
+        f"Defaults to ${BUDGET_COMMITS_ENV}, then the budget_commits setting in pyproject.toml.",
+    )
+
+
+def _get_budget(args: argparse.Namespace) -> Optional[ResolutionBudget]:
+    """Return the budget given on the command line.
+
+    Parameters
+    ----------
+    args : `argparse.Namespace`
+        The parsed arguments.
+
+    Returns
+    -------
+    budget : `ResolutionBudget` or `None`
+        The budget, or `None` if neither limit was given. Giving one limit
+        replaces both configured elsewhere.
+    """
+    if args.budget_seconds is None and args.budget_commits is None:
+        return None
+    return ResolutionBudget(args.budget_seconds, args.budget_commits)
+
+
 def build_argparser() -> argparse.ArgumentParser:
     """Construct an argument parser for ``lsst-versions`` command.
 
@@ -28,7 +97,11 @@ def build_argparser() -> argparse.ArgumentParser:
         The argument parser that defines the ``lsst-versions``
         command-line interface.
     """
-    parser = argparse.ArgumentParser(description="Determine version information for LSST DM package.")
+    parser = argparse.ArgumentParser(
+        description="Determine version information for LSST DM package.",
+        epilog=f"Other commands: {', '.join(_SUBCOMMANDS)}. Run lsst-version COMMAND --help for details. "
+        "A package whose path is the name of a command must be given as, for example, ./index or after --.",
+    )
 
     parser.add_argument(
         "--log-level",
@@ -45,16 +118,127 @@ def build_argparser() -> argparse.ArgumentParser:
     )
 
     parser.add_argument(
-        "repo",
+        "--from-file",
+        type=str,
+        metavar="FILE",
+        help="Read additional package paths, one per line, from this file ('-' for standard input).",
+    )
+
+    _add_resolution_arguments(parser)
+
+    parser.add_argument(
+        "--profile",
+        type=str,
+        metavar="FILE",
+        help="Write the time taken by each phase of version determination to this file in Chrome trace "
+        "format.",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Maximum number of packages to process concurrently. Defaults to the number of CPUs.",
+    )
+
+    parser.add_argument(
+        "repos",
+        type=str,
+        nargs="*",
+        metavar="repo",
+        help="Path to package from which to determine the version. Defaults to the current directory. "
+        "If more than one path is given, or --from-file is used, a JSON-lines manifest with one "
+        "entry per package is written instead of a single version.",
+    )
+
+    return parser
+
+
+def build_range_argparser() -> argparse.ArgumentParser:
+    """Construct an argument parser for ``lsst-versions range`` command.
+
+    Returns
+    -------
+    argparser : `argparse.ArgumentParser`
+        The argument parser that defines the ``lsst-versions range``
+        command-line interface.
+    """
+    parser = argparse.ArgumentParser(
+        prog="lsst-version range",
+        description="Report the version of every commit in the first-parent history of a revision range, "
+        "oldest first.",
+    )
+
+    parser.add_argument(
+        "--log-level",
+        default="WARN",
+        type=str.upper,
+        choices=("WARN", "INFO", "DEBUG"),
+        help="Logging level.",
+    )
+
+    parser.add_argument(
+        "--repo",
         type=str,
         default=".",
-        help="Path to package from which to determine the version.",
+        help="Path to the Git repository.",
+    )
+
+    _add_resolution_arguments(parser)
+
+    parser.add_argument(
+        "rev_range",
+        type=str,
+        metavar="range",
+        help="Git revision range, for example w.2024.10..main.",
     )
 
     return parser
 
 
-def _run_command(repo: str, write_version: bool) -> str:
+def _run_range(
+    repo: str,
+    rev_range: str,
+    out: TextIO,
+    backend: Optional[str] = None,
+    budget: Optional[ResolutionBudget] = None,
+) -> None:
+    """Write the version of every commit in a range.
+
+    Parameters
+    ----------
+    repo : `str`
+        Path to a git repository.
+    rev_range : `str`
+        The revision range.
+    out : `typing.TextIO`
+        Stream to receive one ``<sha> <version>`` line per commit.
+    backend : `str`, optional
+        Name of the backend to use.
+    budget : `ResolutionBudget`, optional
+        Limits on the work done to find the state of the start of the
+        range.
+    """
+    for hexsha, version in iter_lsst_versions(repo, rev_range, backend, budget):
+        print(hexsha, version, file=out)
+
+
+def _main_range(argv: List[str]) -> None:
+    """Run the ``lsst-versions range`` command."""
+    args = build_range_argparser().parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+
+    _run_range(args.repo, args.rev_range, sys.stdout, args.backend, _get_budget(args))
+
+
+def _run_command(
+    repo: str,
+    write_version: bool,
+    backend: Optional[str] = None,
+    budget: Optional[ResolutionBudget] = None,
+) -> str:
     """Run the main command implementation code.
 
     Parameters
@@ -63,13 +247,17 @@ def _run_command(repo: str, write_version: bool) -> str:
         Path to a git repository.
     write_version : `bool`
         Whether to write a version file or not.
+    backend : `str`, optional
+        Name of the backend to use.
+    budget : `ResolutionBudget`, optional
+        Limits on the work done to determine the version.
 
     Returns
     -------
     version : `str`
         The version string.
     """
-    version, written = _process_version_writing(repo, write_version)
+    version, written = _process_version_writing(repo, write_version, backend=backend, budget=budget)
     if write_version:
         if written:
             _LOG.info("Written version file to %s", written)
@@ -78,11 +266,385 @@ def _run_command(repo: str, write_version: bool) -> str:
     return version
 
 
-def main() -> None:
-    """Run entry point for ``lsst-versions`` command."""
-    args = build_argparser().parse_args()
+def _read_paths(fh: TextIO) -> Iterator[str]:
+    """Read package paths, ignoring blank lines and comments."""
+    for line in fh:
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield line
+
+
+def _run_manifest(
+    repos: List[str],
+    from_file: Optional[str],
+    write_version: bool,
+    jobs: Optional[int],
+    out: TextIO,
+    backend: Optional[str] = None,
+    budget: Optional[ResolutionBudget] = None,
+) -> int:
+    """Write a JSON-lines manifest of the versions of many packages.
+
+    Parameters
+    ----------
+    repos : `list` [`str`]
+        Paths to the packages.
+    from_file : `str` or `None`
+        File listing further package paths, ``-`` for standard input.
+    write_version : `bool`
+        Whether to write a version file for each package.
+    jobs : `int` or `None`
+        Maximum number of packages to process concurrently.
+    out : `typing.TextIO`
+        Stream to receive the manifest.
+    backend : `str`, optional
+        Name of the backend to use for every package.
+    budget : `ResolutionBudget`, optional
+        Limits on the work done to determine the version of each package.
+
+    Returns
+    -------
+    n_failed : `int`
+        The number of packages whose version could not be determined.
+    """
+    n_failed = 0
+    fh: Optional[TextIO] = None
+    if from_file == "-":
+        fh = sys.stdin
+    elif from_file is not None:
+        fh = open(from_file)
+    try:
+        paths = itertools.chain(repos, _read_paths(fh) if fh is not None else [])
+        results = get_lsst_versions(
+            paths, write_version, fallback=False, max_workers=jobs, backend=backend, budget=budget
+        )
+        for result in results:
+            if result.error is not None:
+                n_failed += 1
+                _LOG.warning("Unable to determine version of %s: %s", result.path, result.error)
+            print(json.dumps(result.to_dict()), file=out, flush=True)
+    finally:
+        if fh is not None and fh is not sys.stdin:
+            fh.close()
+    return n_failed
+
+
+def build_index_argparser() -> argparse.ArgumentParser:
+    """Construct an argument parser for ``lsst-versions index`` command.
+
+    Returns
+    -------
+    argparser : `argparse.ArgumentParser`
+        The argument parser that defines the ``lsst-versions index``
+        command-line interface.
+    """
+    parser = argparse.ArgumentParser(
+        prog="lsst-version index",
+        description="Index the first-parent history of a branch so that the versions of its commits can be "
+        "determined without walking history. The index is extended automatically as commits are added.",
+    )
+
+    parser.add_argument(
+        "--log-level",
+        default="WARN",
+        type=str.upper,
+        choices=("WARN", "INFO", "DEBUG"),
+        help="Logging level.",
+    )
+
+    parser.add_argument(
+        "--repo",
+        type=str,
+        default=".",
+        help="Path to the Git repository.",
+    )
+
+    parser.add_argument(
+        "rev",
+        type=str,
+        nargs="?",
+        default="HEAD",
+        help="The newest commit of the branch to index, usually main. Defaults to HEAD.",
+    )
+
+    return parser
+
+
+def _run_index(repo: str, rev: str) -> int:
+    """Index the first-parent history of a revision.
+
+    Parameters
+    ----------
+    repo : `str`
+        Path to a git repository.
+    rev : `str`
+        The revision at the tip of the history.
+
+    Returns
+    -------
+    count : `int`
+        The number of commits indexed.
+    """
+    backend = PlumbingBackend(repo)
+    branch = symbolic_full_name(backend.git_dir, rev)
+    if branch is None:
+        _LOG.warning("%s is not a branch so the index will not be extended as commits are added.", rev)
+    return build_history_index(backend.git_dir, backend.resolve(rev), backend.iter_first_parents, branch)
+
+
+def _main_index(argv: List[str]) -> None:
+    """Run the ``lsst-versions index`` command."""
+    args = build_index_argparser().parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+
+    print(f"Indexed {_run_index(args.repo, args.rev)} commits.")
+
+
+def build_resolve_argparser() -> argparse.ArgumentParser:
+    """Construct an argument parser for ``lsst-versions resolve`` command.
+
+    Returns
+    -------
+    argparser : `argparse.ArgumentParser`
+        The argument parser that defines the ``lsst-versions resolve``
+        command-line interface.
+    """
+    parser = argparse.ArgumentParser(
+        prog="lsst-version resolve",
+        description="Find the commits that have a version. Developer versions are looked for in the "
+        "first-parent history of a revision.",
+    )
+
+    parser.add_argument(
+        "--log-level",
+        default="WARN",
+        type=str.upper,
+        choices=("WARN", "INFO", "DEBUG"),
+        help="Logging level.",
+    )
+
+    parser.add_argument(
+        "--repo",
+        type=str,
+        default=".",
+        help="Path to the Git repository.",
+    )
+
+    parser.add_argument(
+        "--rev",
+        type=str,
+        default="HEAD",
+        help="The revision whose first-parent history contains developer versions. Defaults to HEAD.",
+    )
+
+    parser.add_argument("version", type=str, help="The version to find.")
+
+    return parser
+
+
+def _main_resolve(argv: List[str]) -> None:
+    """Run the ``lsst-versions resolve`` command."""
+    args = build_resolve_argparser().parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+
+    try:
+        commits = resolve_lsst_version(args.version, args.repo, args.rev)
+    except ValueError as e:
+        _LOG.warning("%s", e)
+        sys.exit(1)
+    if not commits:
+        _LOG.warning("No commit found with version %s", args.version)
+        sys.exit(1)
+    for commit in commits:
+        print(commit)
+
+
+def build_scan_argparser() -> argparse.ArgumentParser:
+    """Construct an argument parser for ``lsst-versions scan`` command.
+
+    Returns
+    -------
+    argparser : `argparse.ArgumentParser`
+        The argument parser that defines the ``lsst-versions scan``
+        command-line interface.
+    """
+    parser = argparse.ArgumentParser(
+        prog="lsst-version scan",
+        description="Report the versions of installed distributions and unpacked sdists from their "
+        "metadata as JSON lines, without using Git.",
+    )
+
+    parser.add_argument(
+        "--log-level",
+        default="WARN",
+        type=str.upper,
+        choices=("WARN", "INFO", "DEBUG"),
+        help="Logging level.",
+    )
+
+    parser.add_argument(
+        "--max-depth",
+        type=int,
+        default=None,
+        help="Maximum number of levels of subdirectories to descend into. Defaults to no limit, or 0 when "
+        "scanning the installation directories.",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Maximum number of directories to read concurrently. Defaults to the number of CPUs.",
+    )
+
+    parser.add_argument(
+        "paths",
+        type=str,
+        nargs="*",
+        metavar="path",
+        help="Directory to scan. Defaults to the installation directories of this Python.",
+    )
+
+    return parser
+
+
+def _run_scan(paths: List[str], max_depth: Optional[int], jobs: Optional[int], out: TextIO) -> int:
+    """Write the versions found in directory trees as JSON lines.
+
+    Parameters
+    ----------
+    paths : `list` [`str`]
+        The directories to scan. If empty, the installation directories
+        of this Python are scanned, by default without descending into
+        subdirectories.
+    max_depth : `int` or `None`
+        Maximum number of levels of subdirectories to descend into.
+    jobs : `int` or `None`
+        Maximum number of directories to read concurrently.
+    out : `typing.TextIO`
+        Stream to receive one entry per distribution.
+
+    Returns
+    -------
+    n_failed : `int`
+        The number of metadata files whose version could not be read.
+    """
+    if not paths:
+        install_paths = sysconfig.get_paths()
+        paths = sorted({install_paths["purelib"], install_paths["platlib"]})
+        if max_depth is None:
+            max_depth = 0
+    n_failed = 0
+    for result in scan_versions(paths, max_depth=max_depth, max_workers=jobs):
+        if result.error is not None:
+            n_failed += 1
+            _LOG.warning("Unable to read version from %s: %s", result.path, result.error)
+        print(json.dumps(result.to_dict()), file=out, flush=True)
+    return n_failed
+
+
+def _main_scan(argv: List[str]) -> None:
+    """Run the ``lsst-versions scan`` command."""
+    args = build_scan_argparser().parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+
+    if _run_scan(args.paths, args.max_depth, args.jobs, sys.stdout):
+        sys.exit(1)
+
+
+def build_serve_argparser() -> argparse.ArgumentParser:
+    """Construct an argument parser for ``lsst-versions serve`` command.
+
+    Returns
+    -------
+    argparser : `argparse.ArgumentParser`
+        The argument parser that defines the ``lsst-versions serve``
+        command-line interface.
+    """
+    parser = argparse.ArgumentParser(
+        prog="lsst-version serve",
+        description="Run a server that keeps version information in memory. Clients use it when the "
+        f"{SOCKET_ENV} environment variable is set to the socket path.",
+    )
+
+    parser.add_argument(
+        "--log-level",
+        default="WARN",
+        type=str.upper,
+        choices=("WARN", "INFO", "DEBUG"),
+        help="Logging level.",
+    )
+
+    parser.add_argument(
+        "--socket",
+        type=str,
+        default=os.environ.get(SOCKET_ENV),
+        required=SOCKET_ENV not in os.environ,
+        help=f"Path of the Unix domain socket to listen on. Defaults to ${SOCKET_ENV}.",
+    )
+
+    return parser
+
+
+def _main_serve(argv: List[str]) -> None:
+    """Run the ``lsst-versions serve`` command."""
+    args = build_serve_argparser().parse_args(argv)
 
     logging.basicConfig(level=args.log_level)
 
-    version = _run_command(args.repo, args.write_version)
-    print(version)
+    serve(args.socket)
+
+
+_SUBCOMMANDS = {
+    "index": _main_index,
+    "range": _main_range,
+    "resolve": _main_resolve,
+    "scan": _main_scan,
+    "serve": _main_serve,
+}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Run entry point for ``lsst-versions`` command.
+
+    Parameters
+    ----------
+    argv : `list` [`str`], optional
+        The command-line arguments, without the program name. Defaults to
+        those of this process.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    # Subcommands are only recognized as the first argument, exactly as
+    # written, so that the original form of the command, taking only
+    # package paths, continues to work. A package whose path is the name of
+    # a subcommand is given as, for example, ./index or after --.
+    if argv and argv[0] in _SUBCOMMANDS:
+        _SUBCOMMANDS[argv[0]](argv[1:])
+        return
+
+    args = build_argparser().parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+
+    budget = _get_budget(args)
+    with contextlib.ExitStack() as stack:
+        if args.profile:
+            recorder = stack.enter_context(TraceRecorder())
+            stack.callback(recorder.write, args.profile)
+
+        if args.from_file is None and len(args.repos) <= 1:
+            repo = args.repos[0] if args.repos else "."
+            print(_run_command(repo, args.write_version, args.backend, budget))
+            return
+
+        n_failed = _run_manifest(
+            args.repos, args.from_file, args.write_version, args.jobs, sys.stdout, args.backend, budget
+        )
+
+    if n_failed:
+        sys.exit(1)
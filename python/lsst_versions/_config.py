@@ -0,0 +1,57 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Reading of the package configuration from ``pyproject.toml``."""
+
+from __future__ import annotations
+
+__all__ = ("read_tool_config",)
+
+from typing import Any, Dict, Optional
+
+
+def read_tool_config(path: str) -> Optional[Dict[str, Any]]:
+    """Read the ``[tool.lsst_versions]`` table of a ``pyproject.toml`` file.
+
+    Parameters
+    ----------
+    path : `str`
+        Path to the ``pyproject.toml`` file.
+
+    Returns
+    -------
+    config : `dict` or `None`
+        The content of the table, or `None` if the file has no such table.
+
+    Raises
+    ------
+    OSError
+        Raised if the file can not be read.
+    ImportError
+        Raised if the file needs to be parsed but ``tomli`` is not
+        installed.
+    ValueError
+        Raised if the file is not valid TOML.
+    """
+    with open(path) as fh:
+        content = fh.read()
+
+    # Most builds that trigger the setuptools hook do not use this package,
+    # so avoid loading a TOML parser unless the table could be present.
+    if "lsst_versions" not in content:
+        return None
+
+    import tomli
+
+    try:
+        return tomli.loads(content)["tool"]["lsst_versions"]
+    except KeyError:
+        return None
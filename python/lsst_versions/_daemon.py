@@ -0,0 +1,208 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""A long-lived version resolver listening on a Unix domain socket.
+
+The server keeps tag indexes and calculated versions in memory. Versions
+are keyed on the resolved commit and a fingerprint of the tag references,
+so any change to ``HEAD`` or the tags is noticed on the next request.
+
+The protocol is one JSON object per line in each direction. A request
+``{"repo_dir": ..., "commit": ...}`` receives either ``{"version": ...}``
+or ``{"error": ...}``.
+"""
+
+from __future__ import annotations
+
+__all__ = ("SOCKET_ENV", "VersionServer", "request_version")
+
+import contextlib
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from ._backend import PlumbingBackend
+from ._budget import is_budget_fallback
+from ._refs import get_common_dir, refs_fingerprint
+
+_LOG = logging.getLogger("lsst_versions")
+
+SOCKET_ENV = "LSST_VERSIONS_SOCKET"
+"""Environment variable naming the socket of a running server."""
+
+# How long a client waits to connect, and then for an answer.
+_CONNECT_TIMEOUT = 1.0
+_REQUEST_TIMEOUT = 300.0
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Answer the requests arriving on one connection."""
+
+    server: VersionServer
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                response: Dict[str, Any] = {
+                    "version": self.server.find_version(request["repo_dir"], request.get("commit", "HEAD"))
+                }
+            except Exception as e:
+                response = {"error": str(e) or repr(e)}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class VersionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve versions from a Unix domain socket.
+
+    Parameters
+    ----------
+    socket_path : `str`
+        Path of the socket to create. A stale socket left by a server that
+        is no longer running is replaced.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str):
+        if os.path.exists(socket_path):
+            if request_version(".", socket_path=socket_path, ping=True) is not None:
+                raise RuntimeError(f"A server is already listening on {socket_path}")
+            os.remove(socket_path)
+        super().__init__(socket_path, _Handler)
+        self.socket_path = socket_path
+        self._lock = threading.Lock()
+        # Calculated versions keyed by common git directory, tag fingerprint,
+        # configuration fingerprint and commit. The versions of commits never
+        # change unless the tags do, so entries with an old tag fingerprint
+        # are dropped.
+        self._versions: Dict[Tuple[str, str, str, str], str] = {}
+        self._fingerprints: Dict[str, str] = {}
+
+    def server_close(self) -> None:
+        super().server_close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.socket_path)
+
+    def find_version(self, repo_dir: str, commit: str) -> str:
+        """Return the version of a commit, using cached results if valid.
+
+        Parameters
+        ----------
+        repo_dir : `str`
+            Path to the relevant Git repository.
+        commit : `str`
+            Commit for which the version is to be calculated.
+
+        Returns
+        -------
+        version : `str`
+            The version of the commit.
+        """
+        from ._versions import _config_fingerprint, _find_lsst_version
+
+        backend = PlumbingBackend(repo_dir)
+        common_dir = get_common_dir(backend.git_dir)
+        fingerprint = refs_fingerprint(backend.git_dir)
+        hexsha = backend.resolve(commit)
+        # The backend, tag resolution and budget are configured for each
+        # checkout, and could change the version.
+        key = (common_dir, fingerprint, _config_fingerprint(repo_dir), hexsha)
+
+        with self._lock:
+            if self._fingerprints.get(common_dir) != fingerprint:
+                # The tags changed, so every version may have changed.
+                self._versions = {k: v for k, v in self._versions.items() if k[0] != common_dir}
+                self._fingerprints[common_dir] = fingerprint
+            if (version := self._versions.get(key)) is not None:
+                _LOG.debug("Using cached version %s for %s in %s", version, hexsha, repo_dir)
+                return version
+
+        version = _find_lsst_version(repo_dir, hexsha)
+        if is_budget_fallback(version):
+            # A later request may have the time to find the real version.
+            return version
+        with self._lock:
+            if self._fingerprints.get(common_dir) == fingerprint:
+                self._versions[key] = version
+        return version
+
+
+def serve(socket_path: str) -> None:
+    """Run a version server until interrupted.
+
+    Parameters
+    ----------
+    socket_path : `str`
+        Path of the socket to listen on.
+    """
+    with VersionServer(socket_path) as server:
+        _LOG.info("Listening on %s", socket_path)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def request_version(
+    repo_dir: str, commit: str = "HEAD", socket_path: Optional[str] = None, ping: bool = False
+) -> Optional[str]:
+    """Ask a running server for a version.
+
+    Parameters
+    ----------
+    repo_dir : `str`
+        Path to the relevant Git repository.
+    commit : `str`, optional
+        Commit for which the version is to be calculated.
+    socket_path : `str`, optional
+        Path to the server socket. Defaults to the value of the
+        ``LSST_VERSIONS_SOCKET`` environment variable.
+    ping : `bool`, optional
+        If `True` only check that a server is listening. An empty string is
+        returned if it is.
+
+    Returns
+    -------
+    version : `str` or `None`
+        The version, or `None` if no server is configured or reachable, or
+        the server could not determine the version. The caller should then
+        determine the version itself.
+    """
+    if socket_path is None:
+        socket_path = os.environ.get(SOCKET_ENV)
+    if not socket_path or not hasattr(socket, "AF_UNIX"):
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(_CONNECT_TIMEOUT)
+            sock.connect(socket_path)
+            if ping:
+                return ""
+            sock.settimeout(_REQUEST_TIMEOUT)
+            request = {"repo_dir": os.path.abspath(repo_dir), "commit": commit}
+            sock.sendall(json.dumps(request).encode() + b"\n")
+            with sock.makefile("rb") as fh:
+                response = json.loads(fh.readline())
+    except (OSError, ValueError) as e:
+        _LOG.debug("Version server at %s not usable: %s", socket_path, e)
+        return None
+
+    if (version := response.get("version")) is None:
+        _LOG.debug("Version server could not determine version: %s", response.get("error"))
+        return None
+    return version
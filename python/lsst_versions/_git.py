@@ -0,0 +1,262 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Thin helpers for running ``git`` plumbing commands."""
+
+from __future__ import annotations
+
+import logging
+import subprocess
+import tempfile
+import threading
+from typing import Generator, Iterable, List, Optional, Set, Tuple
+
+from ._budget import BudgetExceededError, get_meter
+from ._profile import count
+
+_LOG = logging.getLogger("lsst_versions")
+
+# Format used to list tags. The peeled object name is empty for lightweight
+# tags, in which case the object name is already the tagged commit.
+_TAG_FORMAT = "%(refname:strip=2) %(objecttype) %(objectname) %(*objecttype) %(*objectname)"
+
+
+def _git_command(git_dir: str, *args: str) -> List[str]:
+    """Construct the command line for a git invocation."""
+    return ["git", f"--git-dir={git_dir}", *args]
+
+
+def iter_git_lines(git_dir: str, *args: str) -> Generator[str, None, None]:
+    """Run a git command and stream its standard output line by line.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    *args : `str`
+        Arguments to pass to ``git``.
+
+    Yields
+    ------
+    line : `str`
+        Each line of output, without the trailing newline.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if the command fails. Closing the generator early terminates
+        the command without raising.
+    BudgetExceededError
+        Raised if the deadline of the budget in force passes, in which case
+        the command is killed.
+    """
+    command = _git_command(git_dir, *args)
+    if (meter := get_meter()) is not None:
+        meter.check()
+    _LOG.debug("Running %s", command)
+    count("git_invocations")
+    # Standard error goes to a file so that a chatty command can never
+    # block on a full pipe while we are consuming standard output.
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=stderr,
+            encoding="utf-8",
+            errors="surrogateescape",
+        )
+        assert proc.stdout is not None
+        # The command is killed if it is still running at the deadline.
+        watchdog: Optional[threading.Timer] = None
+        if meter is not None and (remaining := meter.remaining()) is not None:
+            watchdog = threading.Timer(remaining, proc.kill)
+            watchdog.start()
+        completed = False
+        try:
+            for line in proc.stdout:
+                yield line.rstrip("\n")
+            completed = True
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            if not completed:
+                proc.kill()
+            proc.stdout.close()
+            proc.wait()
+        if proc.returncode != 0:
+            if meter is not None:
+                meter.check()
+            stderr.seek(0)
+            message = stderr.read().decode(errors="replace").strip()
+            raise RuntimeError(f"Command {command} failed with status {proc.returncode}: {message}")
+
+
+def is_ancestor(git_dir: str, ancestor: str, rev: str) -> bool:
+    """Determine whether one commit is an ancestor of another.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    ancestor : `str`
+        The potential ancestor commit.
+    rev : `str`
+        The commit whose history is to be searched.
+
+    Returns
+    -------
+    is_ancestor : `bool`
+        `True` if ``ancestor`` is ``rev`` or one of its ancestors.
+
+    Raises
+    ------
+    BudgetExceededError
+        Raised if the deadline of the budget in force passes, in which case
+        the command is killed.
+    """
+    command = _git_command(git_dir, "merge-base", "--is-ancestor", ancestor, rev)
+    timeout: Optional[float] = None
+    if (meter := get_meter()) is not None:
+        meter.check()
+        timeout = meter.remaining()
+    _LOG.debug("Running %s", command)
+    count("git_invocations")
+    try:
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise BudgetExceededError(f"Time budget exceeded while running {command}") from None
+    if result.returncode not in (0, 1):
+        message = result.stderr.decode(errors="replace").strip()
+        raise RuntimeError(f"Command {command} failed with status {result.returncode}: {message}")
+    return result.returncode == 0
+
+
+def tags_containing(git_dir: str, rev: str, tags: Iterable[str]) -> Set[str]:
+    """Find the tags whose history contains a commit, with one git call.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    rev : `str`
+        The commit to look for.
+    tags : `~collections.abc.Iterable` [`str`]
+        Names of the tags to consider, without the ``refs/tags/`` prefix.
+
+    Returns
+    -------
+    containing : `set` [`str`]
+        The tags that have ``rev`` as an ancestor or tag it directly.
+    """
+    patterns = [f"refs/tags/{tag}" for tag in tags]
+    if not patterns:
+        return set()
+    return set(
+        iter_git_lines(git_dir, "for-each-ref", "--format=%(refname:strip=2)", f"--contains={rev}", *patterns)
+    )
+
+
+def symbolic_full_name(git_dir: str, rev: str) -> Optional[str]:
+    """Determine the branch or other reference named by a revision.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    rev : `str`
+        The revision, for example ``main`` or ``HEAD``.
+
+    Returns
+    -------
+    refname : `str` or `None`
+        The full name of the reference, for example ``refs/heads/main``,
+        or `None` if the revision does not name a reference.
+    """
+    lines = iter_git_lines(git_dir, "rev-parse", "--symbolic-full-name", rev)
+    try:
+        refname = next(lines, "")
+    finally:
+        lines.close()
+    return refname if refname.startswith("refs/") else None
+
+
+def iter_first_parents(git_dir: str, rev: str) -> Generator[str, None, None]:
+    """Stream the first-parent history of a commit.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    rev : `str`
+        The commit to start from.
+
+    Yields
+    ------
+    hexsha : `str`
+        The hex SHA of ``rev`` followed by those of its first parent, that
+        commit's first parent, and so on. Closing the generator stops the
+        walk.
+    """
+    # Replacement objects are ignored since the parents recorded in the
+    # commits themselves are what define the history.
+    yield from iter_git_lines(git_dir, "--no-replace-objects", "rev-list", "--first-parent", rev, "--")
+
+
+def iter_tags(
+    git_dir: str, *patterns: str, sort: Optional[str] = None, points_at: Iterable[str] = ()
+) -> Generator[Tuple[str, str, Optional[str]], None, None]:
+    """Stream every tag in the repository with a single git call.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    *patterns : `str`
+        Restrict the tags to those matching these ``for-each-ref`` patterns.
+        Defaults to all tags.
+    sort : `str`, optional
+        The ``for-each-ref`` sort key, for example ``-version:refname``.
+        Defaults to the name of the tag.
+    points_at : `~collections.abc.Iterable` [`str`], optional
+        Only return tags of these commits.
+
+    Yields
+    ------
+    name : `str`
+        The name of the tag, without the ``refs/tags/`` prefix.
+    commit : `str`
+        The hex SHA of the commit that is tagged.
+    tag_object : `str` or `None`
+        The hex SHA of the tag object for annotated tags, `None` for
+        lightweight tags.
+
+    Notes
+    -----
+    Tags that do not resolve to a commit (for example tags of trees or
+    blobs) are skipped.
+    """
+    if not patterns:
+        patterns = ("refs/tags",)
+    options = [f"--format={_TAG_FORMAT}"]
+    if sort is not None:
+        options.append(f"--sort={sort}")
+    options.extend(f"--points-at={commit}" for commit in points_at)
+    for line in iter_git_lines(git_dir, "for-each-ref", *options, *patterns):
+        # Tag names can not contain spaces so a plain split is safe.
+        fields = line.split(" ")
+        name, object_type, object_name = fields[:3]
+        peeled_type, peeled_name = fields[3:5] if len(fields) >= 5 else ("", "")
+        if object_type == "commit":
+            yield name, object_name, None
+        elif object_type == "tag" and peeled_type == "commit":
+            yield name, peeled_name, object_name
+        else:
+            _LOG.debug("Ignoring tag %s which does not refer to a commit.", name)
@@ -0,0 +1,371 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Read-only access to the git commit-graph file.
+
+The commit-graph records the parents and generation number of every
+commit it contains. This allows ancestry questions to be answered without
+running ``git``, and the generation numbers allow the search to skip
+commits that can not possibly lead to the ancestor being looked for.
+See the git documentation of ``gitformat-commit-graph`` for the format.
+"""
+
+from __future__ import annotations
+
+__all__ = ("CommitGraph", "load_commit_graph")
+
+import heapq
+import logging
+import mmap
+import os
+import struct
+import subprocess
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from ._budget import get_meter
+from ._profile import count
+from ._refs import get_alternates, get_common_dir
+
+_LOG = logging.getLogger("lsst_versions")
+
+_SIGNATURE = b"CGPH"
+_HASH_SIZES = {1: 20, 2: 32}
+_NO_PARENT = 0x70000000
+_EXTRA_EDGES = 0x80000000
+_LAST_EDGE = 0x80000000
+
+# Environment variable that allows a missing commit-graph to be written.
+_WRITE_ENV = "LSST_VERSIONS_WRITE_COMMIT_GRAPH"
+
+
+class _GraphLayer:
+    """A single commit-graph file.
+
+    Parameters
+    ----------
+    path : `str`
+        Path to the file.
+    base : `int`
+        Number of commits in the layers below this one.
+    """
+
+    def __init__(self, path: str, base: int):
+        with open(path, "rb") as fh:
+            self._data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self._data
+        signature, version, hash_version, n_chunks = struct.unpack_from(">4sBBB", data, 0)
+        if signature != _SIGNATURE or version != 1 or hash_version not in _HASH_SIZES:
+            raise ValueError(f"Unsupported commit-graph file {path}")
+        self.hash_size = _HASH_SIZES[hash_version]
+        self.base = base
+
+        chunks: Dict[bytes, int] = {}
+        for i in range(n_chunks):
+            chunk_id, offset = struct.unpack_from(">4sQ", data, 8 + 12 * i)
+            chunks[chunk_id] = offset
+        for required in (b"OIDF", b"OIDL", b"CDAT"):
+            if required not in chunks:
+                raise ValueError(f"Commit-graph file {path} has no {required.decode()} chunk")
+        self._fanout = chunks[b"OIDF"]
+        self._oids = chunks[b"OIDL"]
+        self._cdat = chunks[b"CDAT"]
+        self._edges = chunks.get(b"EDGE")
+        self.count = struct.unpack_from(">I", data, self._fanout + 4 * 255)[0]
+
+    def close(self) -> None:
+        self._data.close()
+
+    def oid(self, index: int) -> bytes:
+        """Return the binary object ID at a local index."""
+        start = self._oids + index * self.hash_size
+        return self._data[start : start + self.hash_size]
+
+    def find(self, oid: bytes) -> Optional[int]:
+        """Find the local index of a binary object ID."""
+        first = oid[0]
+        low = struct.unpack_from(">I", self._data, self._fanout + 4 * (first - 1))[0] if first else 0
+        high = struct.unpack_from(">I", self._data, self._fanout + 4 * first)[0]
+        while low < high:
+            middle = (low + high) // 2
+            found = self.oid(middle)
+            if found == oid:
+                return middle
+            if found < oid:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def commit_data(self, index: int) -> Tuple[List[int], int]:
+        """Return the global parent positions and generation of a commit."""
+        offset = self._cdat + index * (self.hash_size + 16)
+        parent1, parent2, generation_high = struct.unpack_from(">III", self._data, offset + self.hash_size)
+        parents: List[int] = []
+        if parent1 != _NO_PARENT:
+            parents.append(parent1)
+        if parent2 & _EXTRA_EDGES:
+            if self._edges is None:
+                raise ValueError("Commit-graph refers to extra edges but has no EDGE chunk")
+            edge = parent2 & ~_EXTRA_EDGES
+            while True:
+                value = struct.unpack_from(">I", self._data, self._edges + 4 * edge)[0]
+                parents.append(value & ~_LAST_EDGE)
+                if value & _LAST_EDGE:
+                    break
+                edge += 1
+        elif parent2 != _NO_PARENT:
+            parents.append(parent2)
+        # The top 30 bits hold the topological level.
+        return parents, generation_high >> 2
+
+
+class CommitGraph:
+    """The commit-graph of a repository, possibly split into layers.
+
+    Parameters
+    ----------
+    paths : `list` [`str`]
+        Paths to the commit-graph files, base layer first.
+    """
+
+    def __init__(self, paths: List[str]):
+        self._layers: List[_GraphLayer] = []
+        base = 0
+        try:
+            for path in paths:
+                layer = _GraphLayer(path, base)
+                self._layers.append(layer)
+                base += layer.count
+        except BaseException:
+            self.close()
+            raise
+        self.count = base
+
+    def close(self) -> None:
+        """Release the memory maps."""
+        for layer in self._layers:
+            layer.close()
+        self._layers = []
+
+    def _layer(self, position: int) -> _GraphLayer:
+        for layer in self._layers:
+            if position < layer.base + layer.count:
+                return layer
+        raise IndexError(f"Commit-graph position {position} out of range")
+
+    def position(self, hexsha: str) -> Optional[int]:
+        """Return the position of a commit in the graph.
+
+        Parameters
+        ----------
+        hexsha : `str`
+            Hex SHA of the commit.
+
+        Returns
+        -------
+        position : `int` or `None`
+            The position, or `None` if the commit is not in the graph.
+        """
+        oid = bytes.fromhex(hexsha)
+        # Search the newest layers first since they are the most likely to
+        # hold recently-tagged commits.
+        for layer in reversed(self._layers):
+            if len(oid) != layer.hash_size:
+                return None
+            if (index := layer.find(oid)) is not None:
+                return layer.base + index
+        return None
+
+    def hexsha(self, position: int) -> str:
+        """Return the hex SHA of the commit at a position."""
+        layer = self._layer(position)
+        return layer.oid(position - layer.base).hex()
+
+    def parents(self, position: int) -> List[int]:
+        """Return the positions of the parents of a commit."""
+        layer = self._layer(position)
+        return layer.commit_data(position - layer.base)[0]
+
+    def generation(self, position: int) -> int:
+        """Return the generation number of a commit, 0 if unknown."""
+        layer = self._layer(position)
+        return layer.commit_data(position - layer.base)[1]
+
+    def is_ancestor(self, ancestor: str, rev: str) -> Optional[bool]:
+        """Determine whether one commit is an ancestor of another.
+
+        Parameters
+        ----------
+        ancestor : `str`
+            Hex SHA of the potential ancestor.
+        rev : `str`
+            Hex SHA of the commit whose history is searched.
+
+        Returns
+        -------
+        is_ancestor : `bool` or `None`
+            `True` if ``ancestor`` is ``rev`` or one of its ancestors.
+            `None` if either commit is not in the graph and the question
+            must be answered some other way.
+        """
+        target = self.position(ancestor)
+        start = self.position(rev)
+        if target is None or start is None:
+            return None
+        if target == start:
+            return True
+
+        # Visit the commits with the highest generation first so that the
+        # walk can stop as soon as everything left is too old.
+        target_generation = self.generation(target)
+        seen: Set[int] = {start}
+        queue = [(-self.generation(start), start)]
+        while queue:
+            negative_generation, position = heapq.heappop(queue)
+            generation = -negative_generation
+            if generation and target_generation and generation <= target_generation:
+                # An ancestor always has a lower generation, so nothing
+                # reachable from here can be the target.
+                continue
+            for parent in self.parents(position):
+                if parent == target:
+                    return True
+                if parent not in seen:
+                    seen.add(parent)
+                    heapq.heappush(queue, (-self.generation(parent), parent))
+        return False
+
+    def containing(self, ancestor: str, revs: Iterable[str]) -> Optional[Set[str]]:
+        """Determine which of several commits contain a commit, in one walk.
+
+        Parameters
+        ----------
+        ancestor : `str`
+            Hex SHA of the commit to look for.
+        revs : `~collections.abc.Iterable` [`str`]
+            Hex SHAs of the commits whose histories are searched.
+
+        Returns
+        -------
+        containing : `set` [`str`] or `None`
+            The members of ``revs`` that have ``ancestor`` in their history
+            (including ``ancestor`` itself). `None` if any of the commits is
+            missing from the graph or the graph has no generation numbers.
+        """
+        target = self.position(ancestor)
+        if target is None or not (target_generation := self.generation(target)):
+            return None
+
+        # Each commit carries a bit mask of the revs that reach it. Visiting
+        # in order of decreasing generation guarantees that every child of
+        # a commit has been visited, and so its mask is complete, before the
+        # commit itself is visited.
+        revs = list(revs)
+        masks: Dict[int, int] = {}
+        queue: List[Tuple[int, int]] = []
+        for bit, rev in enumerate(revs):
+            if (position := self.position(rev)) is None or not self.generation(position):
+                return None
+            if position not in masks:
+                masks[position] = 0
+                heapq.heappush(queue, (-self.generation(position), position))
+            masks[position] |= 1 << bit
+
+        found = 0
+        meter = get_meter()
+        while queue:
+            if meter is not None:
+                meter.charge()
+            negative_generation, position = heapq.heappop(queue)
+            mask = masks.pop(position)
+            if position == target:
+                found = mask
+                break
+            if -negative_generation <= target_generation:
+                # Nothing reachable from here can be the target.
+                continue
+            for parent in self.parents(position):
+                if parent not in masks:
+                    if not (generation := self.generation(parent)):
+                        return None
+                    masks[parent] = 0
+                    heapq.heappush(queue, (-generation, parent))
+                masks[parent] |= mask
+        return {rev for bit, rev in enumerate(revs) if found >> bit & 1}
+
+
+def _graph_paths(objects_dir: str) -> List[str]:
+    """Return the commit-graph files in an object directory."""
+    info_dir = os.path.join(objects_dir, "info")
+    chain = os.path.join(info_dir, "commit-graphs", "commit-graph-chain")
+    try:
+        with open(chain) as fh:
+            hashes = [line.strip() for line in fh if line.strip()]
+    except FileNotFoundError:
+        pass
+    else:
+        return [os.path.join(info_dir, "commit-graphs", f"graph-{h}.graph") for h in hashes]
+    single = os.path.join(info_dir, "commit-graph")
+    return [single] if os.path.exists(single) else []
+
+
+def _write_allowed() -> bool:
+    return os.environ.get(_WRITE_ENV, "0").lower() in ("1", "true", "yes")
+
+
+def load_commit_graph(git_dir: str, allow_write: Optional[bool] = None) -> Optional[CommitGraph]:
+    """Load the commit-graph of a repository.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    allow_write : `bool`, optional
+        Whether a commit-graph may be written if none exists. Defaults to
+        the value of the ``LSST_VERSIONS_WRITE_COMMIT_GRAPH`` environment
+        variable, which is false unless set.
+
+    Returns
+    -------
+    graph : `CommitGraph` or `None`
+        The commit-graph, or `None` if there is no usable commit-graph.
+    """
+    objects_dir = os.path.join(get_common_dir(git_dir), "objects")
+    paths = _graph_paths(objects_dir)
+    if not paths:
+        # As git does, use the commit-graph of a repository that lends
+        # objects. Commits it does not cover are answered by git.
+        for alternate in get_alternates(git_dir):
+            if paths := _graph_paths(alternate):
+                objects_dir = alternate
+                break
+    if not paths:
+        if allow_write is None:
+            allow_write = _write_allowed()
+        if not allow_write:
+            return None
+        _LOG.info("Writing commit-graph for %s", git_dir)
+        count("git_invocations")
+        result = subprocess.run(
+            ["git", f"--git-dir={git_dir}", "commit-graph", "write", "--reachable"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        if result.returncode != 0:
+            _LOG.info("Unable to write commit-graph: %s", result.stderr.decode(errors="replace").strip())
+            return None
+        paths = _graph_paths(objects_dir)
+
+    try:
+        return CommitGraph(paths)
+    except (OSError, ValueError, struct.error) as e:
+        _LOG.debug("Ignoring unusable commit-graph in %s: %s", objects_dir, e)
+        return None
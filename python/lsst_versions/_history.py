@@ -0,0 +1,534 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Persistent index of the first-parent history of a branch.
+
+The index records every commit of a first-parent chain, from the root up
+to a tip, in a memory-mappable file in the cache directory. A commit in the
+chain is found by binary search and its distance from the root then gives
+the number of commits back to the nearest weekly without walking any
+history. Since history never changes once written, the index only grows:
+when the version of the head of the indexed branch is determined and its
+walk arrives at the tip, the commits walked are appended.
+
+The file also records, for release commits, the depth of the newest
+commit of the chain that each contains. Commits of a chain contained by a
+release always form a prefix of the chain, so this single number answers
+whether the release contains any commit of the chain.
+"""
+
+from __future__ import annotations
+
+__all__ = (
+    "HistoryIndex",
+    "build_history_index",
+    "find_nearest_weekly",
+    "open_history_index",
+    "tags_containing",
+)
+
+import bisect
+import itertools
+import logging
+import mmap
+import os
+import struct
+from typing import Callable, Dict, Generator, List, Mapping, Optional, Sequence, Set, Tuple
+
+from ._budget import get_meter
+from ._cache import cache_enabled, get_cache_dir, get_shared_cache_dirs, locked, write_atomic
+from ._profile import count
+from ._refs import resolve_ref
+
+_LOG = logging.getLogger("lsst_versions")
+
+_SIGNATURE = b"LVFP"
+# Increment whenever the layout of the file changes.
+_FORMAT = 2
+_FILENAME = "first_parents.idx"
+_HEADER = struct.Struct(">4sIIIII")
+_BOUNDARY = struct.Struct(">i")
+
+# How far beyond a weekly the head of the indexed branch is walked in order
+# to reach the index so that it can be extended.
+_EXTEND_LIMIT = 10_000
+
+# The commits walked from a commit, newest first.
+WalkFunction = Callable[[str], Generator[str, None, None]]
+
+# Determines which tags contain a commit without using the index.
+ContainingFunction = Callable[[str, Dict[str, str]], Set[str]]
+
+# The depths of the weeklies in the chain of each index file, in order, and
+# their names, with the tip of the chain and the weeklies they were found
+# from. Tag tables are reused while the tags are unchanged, so the same
+# weeklies mapping means the same tags.
+_WEEKLY_DEPTHS: Dict[str, Tuple[str, Mapping[str, str], List[int], List[str]]] = {}
+
+
+class HistoryIndex:
+    """A read-only view of a first-parent history index file.
+
+    Parameters
+    ----------
+    path : `str`
+        Path to the index file.
+
+    Notes
+    -----
+    The file holds a header, the binary object IDs of the chain ordered
+    from the root, the same IDs sorted, the depth of each sorted ID, the
+    boundary of each recorded release commit and the name of the branch
+    that was indexed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as fh:
+            self._data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            signature, version, self.hash_size, self.count, n_boundaries, branch_size = _HEADER.unpack_from(
+                self._data
+            )
+            if signature != _SIGNATURE or version != _FORMAT or self.count == 0:
+                raise ValueError(f"Unsupported history index {path}")
+            self._chain = _HEADER.size
+            self._sorted = self._chain + self.count * self.hash_size
+            self._depths = self._sorted + self.count * self.hash_size
+            offset = self._depths + 4 * self.count
+            record_size = self.hash_size + _BOUNDARY.size
+            branch_offset = offset + n_boundaries * record_size
+            if len(self._data) != branch_offset + branch_size:
+                raise ValueError(f"History index {path} has an unexpected size")
+            self.boundaries: Dict[str, int] = {}
+            for i in range(n_boundaries):
+                start = offset + i * record_size
+                commit = self._data[start : start + self.hash_size].hex()
+                self.boundaries[commit] = _BOUNDARY.unpack_from(self._data, start + self.hash_size)[0]
+            self.branch: Optional[str] = (
+                self._data[branch_offset : branch_offset + branch_size].decode() if branch_size else None
+            )
+            """Full name of the branch whose history is indexed, `None` if
+            it is not known."""
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        """Release the memory map."""
+        self._data.close()
+
+    def oid(self, depth: int) -> bytes:
+        """Return the binary object ID of the commit at a depth.
+
+        Parameters
+        ----------
+        depth : `int`
+            Number of first-parent steps from the root commit.
+
+        Returns
+        -------
+        oid : `bytes`
+            The object ID.
+        """
+        start = self._chain + depth * self.hash_size
+        return self._data[start : start + self.hash_size]
+
+    @property
+    def tip(self) -> str:
+        """Hex SHA of the newest commit in the index (`str`)."""
+        return self.oid(self.count - 1).hex()
+
+    def chain(self) -> List[bytes]:
+        """Return the object IDs of the chain, root first."""
+        return [self.oid(depth) for depth in range(self.count)]
+
+    def depth(self, hexsha: str) -> Optional[int]:
+        """Find a commit in the index.
+
+        Parameters
+        ----------
+        hexsha : `str`
+            Hex SHA of the commit.
+
+        Returns
+        -------
+        depth : `int` or `None`
+            Number of first-parent steps from the root commit, or `None` if
+            the commit is not in the index.
+        """
+        oid = bytes.fromhex(hexsha)
+        if len(oid) != self.hash_size:
+            return None
+        data, size = self._data, self.hash_size
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = self._sorted + middle * size
+            found = data[start : start + size]
+            if found == oid:
+                return struct.unpack_from(">I", data, self._depths + 4 * middle)[0]
+            if found < oid:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def weekly_depths(self, weeklies: Mapping[str, str]) -> Tuple[List[int], List[str]]:
+        """Find the weeklies in the chain.
+
+        Parameters
+        ----------
+        weeklies : `~collections.abc.Mapping` [`str`, `str`]
+            The normalized weekly tag associated with each commit. The
+            mapping must not be modified, since the result is cached for as
+            long as the same mapping is given.
+
+        Returns
+        -------
+        depths : `list` [`int`]
+            The depths of the weeklies in the chain, in increasing order.
+        names : `list` [`str`]
+            The name of the weekly at each depth.
+        """
+        tip = self.tip
+        cached = _WEEKLY_DEPTHS.get(self.path)
+        if cached is not None and cached[0] == tip and cached[1] is weeklies:
+            return cached[2], cached[3]
+        found = sorted(
+            (depth, name) for hexsha, name in weeklies.items() if (depth := self.depth(hexsha)) is not None
+        )
+        depths = [depth for depth, _ in found]
+        names = [name for _, name in found]
+        _WEEKLY_DEPTHS[self.path] = (tip, weeklies, depths, names)
+        return depths, names
+
+    def nearest_weekly(self, depth: int, weeklies: Mapping[str, str]) -> Tuple[int, str]:
+        """Find the closest weekly at or before a commit in the chain.
+
+        Parameters
+        ----------
+        depth : `int`
+            Depth of the commit.
+        weeklies : `~collections.abc.Mapping` [`str`, `str`]
+            The normalized weekly tag associated with each commit.
+
+        Returns
+        -------
+        counter : `int`
+            The number of first-parent steps to the weekly, or to the root
+            commit if there is none.
+        weekly_name : `str`
+            The weekly that was found, or an empty string.
+
+        Notes
+        -----
+        The depths of the weeklies are found once for each set of tags and
+        then searched by bisection.
+        """
+        depths, names = self.weekly_depths(weeklies)
+        if (position := bisect.bisect_right(depths, depth)) == 0:
+            return depth, ""
+        return depth - depths[position - 1], names[position - 1]
+
+
+def _index_path(git_dir: str) -> str:
+    return os.path.join(get_cache_dir(git_dir), _FILENAME)
+
+
+def open_history_index(git_dir: str) -> Optional[HistoryIndex]:
+    """Open the index of a repository, if there is a usable one.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+
+    Returns
+    -------
+    index : `HistoryIndex` or `None`
+        The index, which should be closed after use. `None` if the cache is
+        disabled or there is no usable index.
+
+    Notes
+    -----
+    If the repository has no index, that of a repository it borrows objects
+    from is used. The first update then writes an index of its own.
+    """
+    if not cache_enabled():
+        return None
+    path = _index_path(git_dir)
+    if not os.path.exists(path):
+        shared = (os.path.join(cache_dir, _FILENAME) for cache_dir in get_shared_cache_dirs(git_dir))
+        path = next((candidate for candidate in shared if os.path.exists(candidate)), path)
+    try:
+        return HistoryIndex(path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, struct.error) as e:
+        _LOG.debug("Ignoring unreadable history index %s: %s", path, e)
+        return None
+
+
+def _write_index(
+    path: str, chain: Sequence[bytes], boundaries: Mapping[str, int], branch: Optional[str]
+) -> None:
+    """Write an index file."""
+    hash_size = len(chain[0])
+    order = sorted(range(len(chain)), key=chain.__getitem__)
+    branch_name = (branch or "").encode()
+    parts = [_HEADER.pack(_SIGNATURE, _FORMAT, hash_size, len(chain), len(boundaries), len(branch_name))]
+    parts.extend(chain)
+    parts.extend(chain[depth] for depth in order)
+    parts.append(struct.pack(f">{len(order)}I", *order))
+    for commit, boundary in sorted(boundaries.items()):
+        parts.append(bytes.fromhex(commit) + _BOUNDARY.pack(boundary))
+    parts.append(branch_name)
+    write_atomic(path, b"".join(parts))
+
+
+# The chain, boundaries and branch of an index to be written.
+IndexContent = Tuple[List[bytes], Dict[str, int], Optional[str]]
+
+
+def _update_index(git_dir: str, update: Callable[[Optional[HistoryIndex]], Optional[IndexContent]]) -> None:
+    """Rewrite the index while holding its lock.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    update : `~collections.abc.Callable`
+        Given the current index, or `None`, returns the new chain,
+        boundaries and branch, or `None` if nothing should be written.
+    """
+    cache_dir = get_cache_dir(git_dir)
+    try:
+        with locked(cache_dir, _FILENAME):
+            # Another process may have changed the index in the meantime.
+            index = open_history_index(git_dir)
+            try:
+                content = update(index)
+            finally:
+                if index is not None:
+                    index.close()
+            if content is not None:
+                _write_index(_index_path(git_dir), *content)
+    except OSError as e:
+        _LOG.debug("Unable to update history index in %s: %s", cache_dir, e)
+
+
+def build_history_index(git_dir: str, hexsha: str, walk: WalkFunction, branch: Optional[str] = None) -> int:
+    """Index the first-parent history of a commit.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    hexsha : `str`
+        Hex SHA of the commit at the tip of the chain, usually the newest
+        commit on ``main``.
+    walk : `~collections.abc.Callable`
+        Function returning the first-parent history of a commit.
+    branch : `str`, optional
+        Full name of the branch whose head is ``hexsha``, for example
+        ``refs/heads/main``. The index is only extended automatically as
+        this branch advances. Without a branch it is never extended.
+
+    Returns
+    -------
+    count : `int`
+        The number of commits in the index.
+
+    Notes
+    -----
+    Any existing index is replaced.
+    """
+    history = walk(hexsha)
+    try:
+        chain = [bytes.fromhex(commit) for commit in history]
+    finally:
+        history.close()
+    chain.reverse()
+    _update_index(git_dir, lambda index: (chain, {}, branch))
+    _LOG.info("Indexed %d commits of the first-parent history of %s", len(chain), hexsha)
+    return len(chain)
+
+
+def _extend(git_dir: str, tip: str, branch: str, tail: List[str]) -> None:
+    """Append commits to the index if its tip and branch are unchanged."""
+
+    def update(index: Optional[HistoryIndex]) -> Optional[IndexContent]:
+        if index is None or index.tip != tip or index.branch != branch:
+            return None
+        # A release that contained the old tip may also contain some of
+        # the new commits so its boundary must be determined again.
+        boundaries = {
+            commit: boundary for commit, boundary in index.boundaries.items() if boundary < index.count - 1
+        }
+        return index.chain() + [bytes.fromhex(commit) for commit in reversed(tail)], boundaries, branch
+
+    _update_index(git_dir, update)
+    _LOG.debug("Extended history index with %d commits", len(tail))
+
+
+def find_nearest_weekly(
+    git_dir: str, hexsha: str, weeklies: Mapping[str, str], walk: WalkFunction
+) -> Optional[Tuple[int, str]]:
+    """Find the closest weekly in first-parent history using the index.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    hexsha : `str`
+        Hex SHA of the commit.
+    weeklies : `~collections.abc.Mapping` [`str`, `str`]
+        The normalized weekly tag associated with each commit.
+    walk : `~collections.abc.Callable`
+        Function returning the first-parent history of a commit.
+
+    Returns
+    -------
+    result : `tuple` [`int`, `str`] or `None`
+        The number of first-parent steps to the weekly and its name, as
+        returned by `lsst_versions._walk.find_nearest_weekly`. `None` if
+        there is no index.
+
+    Notes
+    -----
+    History is walked until a weekly or a commit in the index is reached.
+    If ``hexsha`` is the head of the indexed branch and the walk arrives at
+    the tip of the index, the commits walked are added to it. For that, the
+    walk of the head of the branch continues beyond a weekly for a while,
+    unless a budget is in force.
+    """
+    index = open_history_index(git_dir)
+    if index is None:
+        return None
+
+    tail: List[str] = []
+    weekly: Optional[Tuple[int, str]] = None
+    depth: Optional[int] = None
+    meter = get_meter()
+    try:
+        branch = index.branch
+        extendable = branch is not None and resolve_ref(git_dir, branch) == hexsha
+        history = walk(hexsha)
+        try:
+            for commit in history:
+                if meter is not None:
+                    meter.charge()
+                if (depth := index.depth(commit)) is not None:
+                    break
+                tail.append(commit)
+                if commit in weeklies:
+                    weekly = len(tail) - 1, weeklies[commit]
+                    break
+            if weekly is not None and extendable and meter is None:
+                # The version is known, so this is only to extend the index.
+                for commit in itertools.islice(history, _EXTEND_LIMIT):
+                    if (depth := index.depth(commit)) is not None:
+                        break
+                    tail.append(commit)
+        finally:
+            history.close()
+
+        if weekly is not None:
+            counter, weekly_name = weekly
+        elif depth is not None:
+            counter, weekly_name = index.nearest_weekly(depth, weeklies)
+            counter += len(tail)
+        else:
+            # The root commit was reached.
+            counter, weekly_name = len(tail) - 1, ""
+        tip = index.tip if depth == index.count - 1 else None
+    finally:
+        index.close()
+
+    _LOG.debug("Walked %d commits to reach the history index", len(tail))
+    count("commits_walked", len(tail))
+    if tip is not None and tail and extendable and branch is not None:
+        _extend(git_dir, tip, branch, tail)
+    return counter, weekly_name
+
+
+def _find_boundaries(
+    index: HistoryIndex, tags: Dict[str, str], containing: ContainingFunction
+) -> Dict[str, int]:
+    """Determine the newest commit of the chain contained by each tag."""
+    boundaries: Dict[str, int] = {}
+
+    # Every tag still to be placed has its boundary between low and high.
+    # Each check of a commit in the chain splits the tags in two.
+    def place(low: int, high: int, pending: Dict[str, str]) -> None:
+        if not pending:
+            return
+        if low == high:
+            boundaries.update({commit: low for commit in pending.values()})
+            return
+        middle = (low + high + 1) // 2
+        contained = containing(index.oid(middle).hex(), pending)
+        place(middle, high, {name: commit for name, commit in pending.items() if name in contained})
+        place(low, middle - 1, {name: commit for name, commit in pending.items() if name not in contained})
+
+    place(-1, index.count - 1, tags)
+    return boundaries
+
+
+def tags_containing(
+    git_dir: str, hexsha: str, tags: Dict[str, str], containing: ContainingFunction
+) -> Optional[Set[str]]:
+    """Determine which tags have a commit in their history using the index.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    hexsha : `str`
+        Hex SHA of the commit to look for.
+    tags : `dict` [`str`, `str`]
+        The hex SHA of the commit for each tag name to check.
+    containing : `~collections.abc.Callable`
+        Function answering the same question without the index. It is used
+        to record the tags in the index the first time they are seen.
+
+    Returns
+    -------
+    containing : `set` [`str`] or `None`
+        The names of the tags whose history includes the commit. `None` if
+        the commit is not in the index.
+    """
+    index = open_history_index(git_dir)
+    if index is None:
+        return None
+    try:
+        if (depth := index.depth(hexsha)) is None:
+            return None
+        boundaries = dict(index.boundaries)
+        missing = {name: commit for name, commit in tags.items() if commit not in boundaries}
+        if missing:
+            _LOG.debug("Adding %d tags to the history index", len(missing))
+            found = _find_boundaries(index, missing, containing)
+            boundaries.update(found)
+            tip = index.tip
+    finally:
+        index.close()
+
+    if missing:
+
+        def update(index: Optional[HistoryIndex]) -> Optional[IndexContent]:
+            if index is None or index.tip != tip:
+                return None
+            return index.chain(), {**index.boundaries, **found}, index.branch
+
+        _update_index(git_dir, update)
+    return {name for name, commit in tags.items() if depth <= boundaries[commit]}
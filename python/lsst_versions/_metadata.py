@@ -0,0 +1,204 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Read the versions of distributions from their metadata files."""
+
+from __future__ import annotations
+
+__all__ = ["DistributionVersion", "scan_versions"]
+
+import os
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    import concurrent.futures
+
+
+class DistributionVersion(NamedTuple):
+    """The version of a distribution read from its metadata."""
+
+    path: str
+    """The metadata file that was read."""
+
+    name: Optional[str]
+    """The name of the distribution, `None` if it is not given."""
+
+    version: Optional[str]
+    """The version, or `None` if it could not be determined."""
+
+    error: Optional[str]
+    """Description of the failure, `None` if the version was found."""
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the result in a form suitable for JSON serialization."""
+        return self._asdict()
+
+
+def read_metadata_version(path: str) -> Tuple[Optional[str], Optional[str]]:
+    """Read the name and version from a core metadata file.
+
+    Parameters
+    ----------
+    path : `str`
+        Path to a ``PKG-INFO`` or ``METADATA`` file.
+
+    Returns
+    -------
+    name : `str` or `None`
+        The name of the distribution, `None` if it was not found before
+        the version.
+    version : `str` or `None`
+        The version, `None` if the file has no ``Version`` field.
+
+    Raises
+    ------
+    OSError
+        Raised if the file can not be read.
+
+    Notes
+    -----
+    Only the header block is read and reading stops at the ``Version``
+    field, which follows the ``Name`` field.
+    """
+    name = None
+    with open(path, "rb") as fh:
+        for line in fh:
+            if not line.strip():
+                # The description follows the headers.
+                break
+            if line[:1] in (b" ", b"\t"):
+                # Continuation of a multi-line field.
+                continue
+            key, _, value = line.partition(b":")
+            if key == b"Name":
+                name = value.strip().decode(errors="replace")
+            elif key == b"Version":
+                return name, value.strip().decode(errors="replace")
+    return name, None
+
+
+def _read_one(path: str) -> DistributionVersion:
+    """Read the version from a metadata file, capturing errors."""
+    try:
+        name, version = read_metadata_version(path)
+    except OSError as e:
+        return DistributionVersion(path, None, None, str(e))
+    if version is None:
+        return DistributionVersion(path, name, None, "No Version field found.")
+    return DistributionVersion(path, name, version, None)
+
+
+def _scan_directory(dirname: str, depth: int) -> Tuple[List[DistributionVersion], List[Tuple[str, int]]]:
+    """Read the metadata in one directory.
+
+    Parameters
+    ----------
+    dirname : `str`
+        The directory.
+    depth : `int`
+        Number of further levels of subdirectories to scan, negative for
+        no limit.
+
+    Returns
+    -------
+    versions : `list` [`DistributionVersion`]
+        The versions found in the directory.
+    subdirs : `list` [`tuple` [`str`, `int`]]
+        The subdirectories still to be scanned and their depths.
+    """
+    try:
+        with os.scandir(dirname) as it:
+            entries = list(it)
+    except OSError as e:
+        return [DistributionVersion(dirname, None, None, str(e))], []
+
+    # An unpacked sdist has its metadata at the top and any egg-info
+    # inside it describes the same distribution.
+    names = {entry.name for entry in entries}
+    if "PKG-INFO" in names:
+        return [_read_one(os.path.join(dirname, "PKG-INFO"))], []
+    if dirname.endswith(".dist-info") and "METADATA" in names:
+        return [_read_one(os.path.join(dirname, "METADATA"))], []
+
+    versions = []
+    subdirs = []
+    for entry in entries:
+        if entry.name.endswith(".dist-info"):
+            versions.append(_read_one(os.path.join(entry.path, "METADATA")))
+        elif entry.name.endswith(".egg-info"):
+            if entry.is_dir():
+                versions.append(_read_one(os.path.join(entry.path, "PKG-INFO")))
+            else:
+                # Installed by distutils as a single file.
+                versions.append(_read_one(entry.path))
+        elif (
+            depth != 0
+            and entry.name != "__pycache__"
+            and not entry.name.startswith(".")
+            and entry.is_dir(follow_symlinks=False)
+        ):
+            subdirs.append((entry.path, depth - 1))
+    return versions, subdirs
+
+
+def scan_versions(
+    paths: Iterable[str], max_depth: Optional[int] = None, max_workers: Optional[int] = None
+) -> Iterator[DistributionVersion]:
+    """Read the versions of every distribution found in directory trees.
+
+    Parameters
+    ----------
+    paths : `~collections.abc.Iterable` [`str`]
+        Directories to scan, such as ``site-packages`` or a directory of
+        unpacked sdists. A metadata file can also be given directly.
+    max_depth : `int`, optional
+        Maximum number of levels of subdirectories to descend into. 0 only
+        examines the entries of each path. Defaults to no limit.
+    max_workers : `int`, optional
+        Maximum number of directories to read at the same time. Defaults to
+        the number of CPUs.
+
+    Yields
+    ------
+    result : `DistributionVersion`
+        The version from each ``.dist-info/METADATA`` file, each
+        ``.egg-info`` directory or file, and each unpacked sdist, in the
+        order in which they are read. A failure is reported in the result
+        rather than raised.
+
+    Notes
+    -----
+    Directories whose names start with ``.``, and links to directories,
+    are not descended into. Nothing below an unpacked sdist, identified by
+    its ``PKG-INFO`` file, is examined.
+    """
+    import concurrent.futures
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    depth = -1 if max_depth is None else max_depth
+    # Most of the time is spent waiting for the file system so threads are
+    # sufficient.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending: Set[concurrent.futures.Future[Tuple[List[DistributionVersion], List[Tuple[str, int]]]]] = (
+            set()
+        )
+        for path in paths:
+            if os.path.isfile(path):
+                yield _read_one(path)
+            else:
+                pending.add(executor.submit(_scan_directory, path, depth))
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                versions, subdirs = future.result()
+                pending.update(executor.submit(_scan_directory, *subdir) for subdir in subdirs)
+                yield from versions
@@ -0,0 +1,123 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Determine the versions of many repositories concurrently."""
+
+from __future__ import annotations
+
+__all__ = ["RepoVersion", "get_lsst_versions"]
+
+import itertools
+import logging
+import os
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, NamedTuple, Optional, Set
+
+from ._budget import ResolutionBudget
+from ._versions import _process_version_writing
+
+if TYPE_CHECKING:
+    import concurrent.futures
+
+_LOG = logging.getLogger("lsst_versions")
+
+
+class RepoVersion(NamedTuple):
+    """The outcome of determining the version of one repository."""
+
+    path: str
+    """The directory that was examined."""
+
+    version: Optional[str]
+    """The version, or `None` if it could not be determined."""
+
+    written: Optional[str]
+    """Path to the version file that was written, if any."""
+
+    error: Optional[str]
+    """Description of the failure, `None` if the version was found."""
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the result in a form suitable for JSON serialization."""
+        return self._asdict()
+
+
+def _get_one(
+    dirname: str,
+    write_version: bool,
+    fallback: bool,
+    backend: Optional[str],
+    budget: Optional[ResolutionBudget],
+) -> RepoVersion:
+    """Determine the version of a single repository, capturing errors."""
+    try:
+        version, written = _process_version_writing(dirname, write_version, fallback, backend, budget)
+    except Exception as e:
+        # git exceptions sometimes have no error message.
+        return RepoVersion(dirname, None, None, str(e) or repr(e))
+    if write_version and not written:
+        return RepoVersion(dirname, None, None, "Unable to write version file.")
+    return RepoVersion(dirname, version, written, None)
+
+
+def get_lsst_versions(
+    dirnames: Iterable[str],
+    write_version: bool = False,
+    fallback: bool = True,
+    max_workers: Optional[int] = None,
+    backend: Optional[str] = None,
+    budget: Optional[ResolutionBudget] = None,
+) -> Iterator[RepoVersion]:
+    """Determine the versions of many repositories concurrently.
+
+    Parameters
+    ----------
+    dirnames : `~collections.abc.Iterable` [`str`]
+        The directories to examine. This can be a lazy iterable; only a
+        bounded number of directories are read ahead of the results.
+    write_version : `bool`, optional
+        If `True` the version file named in each ``pyproject.toml`` is
+        written.
+    fallback : `bool`, optional
+        If `True` and no Git version can be found, an attempt will be made
+        to find the version from package metadata.
+    max_workers : `int`, optional
+        Maximum number of repositories to process at the same time.
+        Defaults to the number of CPUs.
+    backend : `str`, optional
+        Name of the implementation of the git operations to use for every
+        repository. See `find_lsst_version`.
+    budget : `ResolutionBudget`, optional
+        Limits on the work done to find the version of each repository
+        from Git. See `find_lsst_version`.
+
+    Yields
+    ------
+    result : `RepoVersion`
+        The outcome for each directory, in the order in which they
+        complete. A failure is reported in the result rather than raised.
+    """
+    import concurrent.futures
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    # Most of the time is spent waiting for git so threads are sufficient.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        remaining = iter(dirnames)
+        pending: Set[concurrent.futures.Future[RepoVersion]] = set()
+        while True:
+            # Keep the pool busy without reading every directory up front.
+            for dirname in itertools.islice(remaining, 2 * max_workers - len(pending)):
+                pending.add(executor.submit(_get_one, dirname, write_version, fallback, backend, budget))
+            if not pending:
+                break
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
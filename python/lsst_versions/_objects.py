@@ -0,0 +1,341 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Read the parents of commits directly from the git object store.
+
+Pack indexes and packs are memory-mapped and only the start of each commit,
+up to its last ``parent`` line, is decompressed. Commits stored as deltas,
+or in any form this reader does not understand, are left to ``git``.
+"""
+
+from __future__ import annotations
+
+__all__ = ("ObjectReader", "iter_first_parents")
+
+import contextlib
+import logging
+import mmap
+import os
+import struct
+import zlib
+from typing import Callable, Generator, List, Optional, Set, Tuple
+
+from . import _git
+from ._refs import get_alternates, get_common_dir
+
+_LOG = logging.getLogger("lsst_versions")
+
+_IDX_SIGNATURE = b"\377tOc"
+_IDX_FANOUT = 8
+_IDX_NAMES = _IDX_FANOUT + 4 * 256
+_LARGE_OFFSET = 0x80000000
+
+# Pack object type of a commit.
+_OBJ_COMMIT = 1
+
+# Number of compressed bytes decompressed at a time. The tree and parent
+# lines of a commit with up to two parents usually fit.
+_CHUNK_SIZE = 256
+
+
+def _inflate_header(read: Callable[[int], bytes]) -> bytes:
+    """Decompress the start of an object up to the end of its parents.
+
+    Parameters
+    ----------
+    read : `~collections.abc.Callable`
+        Function returning up to the requested number of compressed bytes.
+
+    Returns
+    -------
+    header : `bytes`
+        The decompressed data. All of the ``parent`` lines are included.
+    """
+    decompressor = zlib.decompressobj()
+    header = b""
+    # The author always follows the parents.
+    while b"\nauthor " not in header and b"\n\n" not in header and not decompressor.eof:
+        if not (chunk := read(_CHUNK_SIZE)):
+            break
+        header += decompressor.decompress(chunk)
+    return header
+
+
+def _parse_parents(body: bytes) -> List[str]:
+    """Extract the parents from the start of a commit."""
+    # Only the lines before the author need to be examined.
+    if (end := body.find(b"\nauthor ")) >= 0:
+        body = body[:end]
+    parents = []
+    for line in body.split(b"\n"):
+        if line.startswith(b"parent "):
+            parents.append(line[7:].decode())
+        elif not line.startswith(b"tree "):
+            break
+    return parents
+
+
+class _Pack:
+    """A version 2 pack index and its pack.
+
+    Parameters
+    ----------
+    idx_path : `str`
+        Path to the ``.idx`` file. The pack is expected alongside.
+    """
+
+    def __init__(self, idx_path: str):
+        with open(idx_path, "rb") as fh:
+            self._index = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self._pack: Optional[mmap.mmap] = None
+        self._pack_path = idx_path[: -len(".idx")] + ".pack"
+        try:
+            signature, version = struct.unpack_from(">4sI", self._index, 0)
+            if signature != _IDX_SIGNATURE or version != 2:
+                raise ValueError(f"Unsupported pack index {idx_path}")
+            self.count = struct.unpack_from(">I", self._index, _IDX_FANOUT + 4 * 255)[0]
+            self.hash_size = self._find_hash_size(len(self._index))
+        except BaseException:
+            self.close()
+            raise
+        self._names = _IDX_NAMES
+        self._offsets = self._names + self.count * (self.hash_size + 4)
+        self._large_offsets = self._offsets + self.count * 4
+
+    def _find_hash_size(self, size: int) -> int:
+        # The hash size is not recorded but only one is consistent with the
+        # size of the file: a name, CRC and offset per object, optional
+        # 8-byte offsets and two trailing checksums.
+        for hash_size in (20, 32):
+            remainder = size - _IDX_NAMES - self.count * (hash_size + 8) - 2 * hash_size
+            if remainder >= 0 and remainder % 8 == 0 and remainder // 8 <= self.count:
+                return hash_size
+        raise ValueError("Pack index has an unexpected size")
+
+    def close(self) -> None:
+        """Release the memory maps."""
+        self._index.close()
+        if self._pack is not None:
+            self._pack.close()
+            self._pack = None
+
+    def find(self, oid: bytes) -> Optional[int]:
+        """Find the offset of an object in the pack.
+
+        Parameters
+        ----------
+        oid : `bytes`
+            The binary object ID.
+
+        Returns
+        -------
+        offset : `int` or `None`
+            Offset of the object in the pack, `None` if it is not present.
+        """
+        if len(oid) != self.hash_size:
+            return None
+        index = self._index
+        first = oid[0]
+        low = struct.unpack_from(">I", index, _IDX_FANOUT + 4 * (first - 1))[0] if first else 0
+        high = struct.unpack_from(">I", index, _IDX_FANOUT + 4 * first)[0]
+        while low < high:
+            middle = (low + high) // 2
+            start = self._names + middle * self.hash_size
+            found = index[start : start + self.hash_size]
+            if found == oid:
+                offset = struct.unpack_from(">I", index, self._offsets + 4 * middle)[0]
+                if offset & _LARGE_OFFSET:
+                    large = self._large_offsets + 8 * (offset & ~_LARGE_OFFSET)
+                    offset = struct.unpack_from(">Q", index, large)[0]
+                return offset
+            if found < oid:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def parents(self, offset: int) -> Optional[List[str]]:
+        """Read the parents of the commit at an offset.
+
+        Returns
+        -------
+        parents : `list` [`str`] or `None`
+            Hex SHAs of the parents. `None` if the object is not stored
+            as a complete commit.
+        """
+        if self._pack is None:
+            with open(self._pack_path, "rb") as fh:
+                self._pack = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        data = self._pack
+        # A type and variable-length size precede the compressed data.
+        byte = data[offset]
+        object_type = (byte >> 4) & 7
+        while byte & 0x80:
+            offset += 1
+            byte = data[offset]
+        if object_type != _OBJ_COMMIT:
+            return None
+        position = offset + 1
+
+        def read(size: int) -> bytes:
+            nonlocal position
+            chunk = data[position : position + size]
+            position += len(chunk)
+            return chunk
+
+        return _parse_parents(_inflate_header(read))
+
+
+class ObjectReader:
+    """Read-only access to the commits of a repository.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+
+    Notes
+    -----
+    Object stores named in ``objects/info/alternates`` are also searched.
+    Commits listed in a ``shallow`` file are treated as having no parents,
+    as ``git`` does.
+    """
+
+    def __init__(self, git_dir: str):
+        common_dir = get_common_dir(git_dir)
+        self._object_dirs = [os.path.join(common_dir, "objects"), *get_alternates(git_dir)]
+
+        self._shallow: Set[str] = set()
+        with contextlib.suppress(OSError):
+            with open(os.path.join(common_dir, "shallow")) as fh:
+                self._shallow = {line.strip() for line in fh}
+
+        self._packs: List[_Pack] = []
+        for object_dir in self._object_dirs:
+            pack_dir = os.path.join(object_dir, "pack")
+            try:
+                entries = list(os.scandir(pack_dir))
+            except OSError:
+                continue
+            indexes: List[Tuple[float, str]] = []
+            for entry in entries:
+                if entry.name.endswith(".idx"):
+                    try:
+                        indexes.append((entry.stat().st_mtime, entry.path))
+                    except OSError as e:
+                        # A pack removed by a concurrent repack, for example.
+                        _LOG.debug("Ignoring pack index %s: %s", entry.path, e)
+            # Git looks in the newest packs first.
+            indexes.sort(reverse=True)
+            for _, path in indexes:
+                try:
+                    self._packs.append(_Pack(path))
+                except (OSError, ValueError) as e:
+                    _LOG.debug("Ignoring pack index %s: %s", path, e)
+
+    def close(self) -> None:
+        """Release the memory maps."""
+        for pack in self._packs:
+            pack.close()
+        self._packs = []
+
+    def parents(self, hexsha: str) -> Optional[List[str]]:
+        """Return the parents of a commit.
+
+        Parameters
+        ----------
+        hexsha : `str`
+            Hex SHA of the commit.
+
+        Returns
+        -------
+        parents : `list` [`str`] or `None`
+            Hex SHAs of the parents, in order. `None` if the commit could
+            not be read, in which case ``git`` should be asked instead.
+        """
+        if hexsha in self._shallow:
+            return []
+        oid = bytes.fromhex(hexsha)
+        for pack in self._packs:
+            if (offset := pack.find(oid)) is not None:
+                try:
+                    return pack.parents(offset)
+                except (OSError, IndexError, zlib.error):
+                    return None
+        for object_dir in self._object_dirs:
+            try:
+                with open(os.path.join(object_dir, hexsha[:2], hexsha[2:]), "rb") as fh:
+                    header = _inflate_header(fh.read)
+            except FileNotFoundError:
+                continue
+            except (OSError, zlib.error):
+                return None
+            object_type, _, rest = header.partition(b" ")
+            if object_type != b"commit":
+                return None
+            return _parse_parents(rest.partition(b"\0")[2])
+        return None
+
+    def iter_first_parents(self, hexsha: str) -> Generator[str, None, Optional[str]]:
+        """Walk first-parent history for as long as commits can be read.
+
+        Parameters
+        ----------
+        hexsha : `str`
+            Hex SHA of the commit to start from.
+
+        Yields
+        ------
+        hexsha : `str`
+            The hex SHA of each commit, starting with ``hexsha``.
+
+        Returns
+        -------
+        remaining : `str` or `None`
+            The first commit that could not be read, or `None` if the root
+            commit was reached.
+        """
+        current = hexsha
+        while (parents := self.parents(current)) is not None:
+            yield current
+            if not parents:
+                return None
+            current = parents[0]
+        return current
+
+
+def iter_first_parents(git_dir: str, hexsha: str) -> Generator[str, None, None]:
+    """Stream the first-parent history of a commit.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    hexsha : `str`
+        Hex SHA of the commit to start from.
+
+    Yields
+    ------
+    hexsha : `str`
+        The hex SHA of ``hexsha`` followed by those of its first parent,
+        that commit's first parent, and so on. The commits are read
+        directly from the object store until one is found that can not be,
+        from where ``git`` continues the walk. Closing the generator stops
+        the walk.
+    """
+    reader = ObjectReader(git_dir)
+    try:
+        remaining = yield from reader.iter_first_parents(hexsha)
+    finally:
+        reader.close()
+    if remaining is not None:
+        _LOG.debug("Continuing first-parent walk from %s with git", remaining)
+        yield from _git.iter_first_parents(git_dir, remaining)
@@ -0,0 +1,182 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Timing of the phases of version determination.
+
+Spans are only recorded while at least one callback is registered, so the
+instrumentation costs almost nothing otherwise.
+"""
+
+from __future__ import annotations
+
+__all__ = ["Span", "add_span_callback", "remove_span_callback"]
+
+import contextlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+_CALLBACKS: List[Callable[[Span], None]] = []
+
+# The spans that are open in each thread, innermost last.
+_LOCAL = threading.local()
+
+
+class Span:
+    """A timed phase of version determination.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the phase.
+    args : `dict` [`str`, `typing.Any`]
+        Values describing what the phase worked on.
+    parent : `Span` or `None`
+        The enclosing span.
+    """
+
+    __slots__ = ("name", "args", "counts", "parent", "start", "duration", "thread_id")
+
+    def __init__(self, name: str, args: Dict[str, Any], parent: Optional[Span]):
+        self.name = name
+        self.args = args
+        self.counts: Dict[str, int] = {}
+        self.parent = parent
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter_ns()
+        self.duration = 0
+
+    @property
+    def depth(self) -> int:
+        """Number of enclosing spans."""
+        return 0 if self.parent is None else self.parent.depth + 1
+
+    def __repr__(self) -> str:
+        return f"Span({self.name!r}, {self.duration / 1e6:.3f} ms, counts={self.counts})"
+
+
+def add_span_callback(callback: Callable[[Span], None]) -> None:
+    """Register a function to receive each completed span.
+
+    Parameters
+    ----------
+    callback : `~collections.abc.Callable`
+        Function called with each `Span` when it finishes. Spans finish
+        innermost first. Counts of a span include those of the spans it
+        encloses, for example ``commits_walked``, ``tags_seen``,
+        ``tags_rejected``, ``ancestry_checks`` and ``git_invocations``.
+        The callback can be called from any thread.
+    """
+    _CALLBACKS.append(callback)
+
+
+def remove_span_callback(callback: Callable[[Span], None]) -> None:
+    """Stop sending spans to a function.
+
+    Parameters
+    ----------
+    callback : `~collections.abc.Callable`
+        A function previously registered with `add_span_callback`.
+    """
+    _CALLBACKS.remove(callback)
+
+
+@contextlib.contextmanager
+def span(name: str, **args: Any) -> Iterator[None]:
+    """Time a phase of version determination.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the phase.
+    **args : `typing.Any`
+        Values describing what the phase works on.
+    """
+    if not _CALLBACKS:
+        yield
+        return
+    stack: List[Span] = _LOCAL.__dict__.setdefault("stack", [])
+    current = Span(name, args, stack[-1] if stack else None)
+    stack.append(current)
+    try:
+        yield
+    finally:
+        current.duration = time.perf_counter_ns() - current.start
+        stack.pop()
+        if current.parent is not None:
+            for key, value in current.counts.items():
+                current.parent.counts[key] = current.parent.counts.get(key, 0) + value
+        for callback in list(_CALLBACKS):
+            callback(current)
+
+
+def count(name: str, n: int = 1) -> None:
+    """Add to a count of the innermost open span.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the count.
+    n : `int`, optional
+        Amount to add.
+    """
+    if stack := _LOCAL.__dict__.get("stack"):
+        counts = stack[-1].counts
+        counts[name] = counts.get(name, 0) + n
+
+
+class TraceRecorder:
+    """Collect spans and write them in the Chrome trace event format.
+
+    The file can be viewed with ``chrome://tracing`` or
+    https://ui.perfetto.dev.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.spans: List[Span] = []
+
+    def __call__(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def __enter__(self) -> TraceRecorder:
+        add_span_callback(self)
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        remove_span_callback(self)
+
+    def write(self, path: str) -> None:
+        """Write the collected spans.
+
+        Parameters
+        ----------
+        path : `str`
+            The file to write.
+        """
+        pid = os.getpid()
+        events = [
+            {
+                "name": span.name,
+                "ph": "X",
+                "ts": span.start / 1000,
+                "dur": span.duration / 1000,
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": {**span.args, **span.counts},
+            }
+            for span in self.spans
+        ]
+        with open(path, "w") as fh:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fh, default=str)
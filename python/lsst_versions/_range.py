@@ -0,0 +1,217 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Versions for every commit in a range of history."""
+
+from __future__ import annotations
+
+__all__ = ["iter_lsst_versions"]
+
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from ._backend import BACKENDS, CROSS_CHECK, DEFAULT_BACKEND, GitBackend, get_backend_name, open_backend
+from ._budget import BudgetExceededError, ResolutionBudget, get_budget, limit, report_overrun
+from ._git import iter_git_lines
+from ._stream import get_tag_patterns
+from ._tags import TagTables
+from ._versions import (
+    _find_budget_fallback_version,
+    _find_relevant_release,
+    _format_dev_version,
+    _load_tag_tables,
+)
+
+_LOG = logging.getLogger("lsst_versions")
+
+
+class _RangeState:
+    """Version state carried from one commit to its first-parent child.
+
+    Parameters
+    ----------
+    backend : `GitBackend`
+        The repository.
+    rev_range : `str`
+        The revision range being processed.
+    tables : `TagTables`
+        The classified tags of the repository.
+    hexsha : `str`
+        The first commit to be processed.
+
+    Notes
+    -----
+    Finding where each newer major release stops containing the range
+    takes a separate ``git rev-list`` over the whole range for each such
+    release, so the cost of starting is proportional to the number of newer
+    major releases times the length of the range. There are usually none
+    or very few, since a range normally starts after the last release.
+    """
+
+    def __init__(self, backend: GitBackend, rev_range: str, tables: TagTables, hexsha: str):
+        self.tables = tables
+
+        # The first commit needs a full walk; after that the counter is
+        # updated as each child is visited.
+        self.counter, self.weekly_name = backend.find_nearest_weekly(hexsha, tables.weeklies)
+
+        # The newest release not containing a commit can only increase as
+        # we move to descendants. Each newer major release that does contain
+        # this commit stops doing so at a single point in the range, which
+        # is the oldest commit of the range that it can not reach. Since
+        # --reverse makes git list the whole range before the first line,
+        # each of these costs a full walk of the range.
+        self.relevant_release = _find_relevant_release(backend, hexsha, tables)
+        self.boundaries: Dict[str, int] = {}
+        for major, commit in tables.major_releases.items():
+            if major <= self.relevant_release:
+                continue
+            lines = iter_git_lines(
+                backend.git_dir, "rev-list", "--first-parent", "--reverse", rev_range, f"^{commit}", "--"
+            )
+            try:
+                boundary = next(lines, None)
+            finally:
+                lines.close()
+            if boundary is not None and self.boundaries.get(boundary, 0) < major:
+                self.boundaries[boundary] = major
+
+    def advance(self, hexsha: str) -> None:
+        """Move the state to a first-parent child of the current commit."""
+        if hexsha in self.tables.weeklies:
+            self.weekly_name = self.tables.weeklies[hexsha]
+            self.counter = 0
+        else:
+            self.counter += 1
+        self.relevant_release = max(self.relevant_release, self.boundaries.get(hexsha, 0))
+
+    def version(self, hexsha: str) -> str:
+        """Return the version of the current commit."""
+        if (release := self.tables.releases.get(hexsha)) is not None:
+            return release
+        return _format_dev_version(self.relevant_release, self.weekly_name, self.counter)
+
+
+def _start_range(
+    backends: List[GitBackend], repo_dir: str, rev_range: str, tables: TagTables, hexsha: str
+) -> _RangeState:
+    """Determine the state of the first commit of a range.
+
+    Parameters
+    ----------
+    backends : `list` [`GitBackend`]
+        The repository opened with each backend to use. The state found by
+        the first is returned.
+    repo_dir : `str`
+        Path to the repository, used in messages.
+    rev_range : `str`
+        The revision range being processed.
+    tables : `TagTables`
+        The classified tags of the repository.
+    hexsha : `str`
+        The first commit to be processed.
+
+    Returns
+    -------
+    state : `_RangeState`
+        The state of the commit.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if the backends calculate different versions.
+    """
+    states = {backend.name: _RangeState(backend, rev_range, tables, hexsha) for backend in backends}
+    versions = {name: state.version(hexsha) for name, state in states.items()}
+    if len(set(versions.values())) != 1:
+        raise RuntimeError(
+            f"Git backends disagree about the version of {hexsha} in repo '{repo_dir}': {versions}"
+        )
+    return states[backends[0].name]
+
+
+def iter_lsst_versions(
+    repo_dir: str = ".",
+    rev_range: str = "HEAD",
+    backend: Optional[str] = None,
+    budget: Optional[ResolutionBudget] = None,
+) -> Iterator[Tuple[str, str]]:
+    """Calculate the version of every commit in a range in a single pass.
+
+    Parameters
+    ----------
+    repo_dir : `str`, optional
+        Path to the relevant Git repository.
+    rev_range : `str`, optional
+        A git revision range such as ``w.2024.10..main``. A single revision
+        includes all of its first-parent history.
+    backend : `str`, optional
+        Name of the implementation of the git operations to use, as for
+        `find_lsst_version`.
+    budget : `ResolutionBudget`, optional
+        Limits on the time taken and the number of commits examined to
+        find the state of the first commit of the range, as for
+        `find_lsst_version`.
+
+    Yields
+    ------
+    hexsha : `str`
+        Hex SHA of a commit in the first-parent history of the range,
+        oldest first.
+    version : `str`
+        The version of that commit, identical to that returned by
+        `find_lsst_version`.
+
+    Notes
+    -----
+    The backend, the tags and the budget are configured in the same way as
+    for `find_lsst_version`, and the first commit is resolved in the same
+    way. Subsequent commits update the weekly counter incrementally, so
+    memory use does not grow with the length of the range. Each major
+    release newer than the first commit that still contains it costs an
+    extra walk of the range, so the total cost is proportional to the
+    length of the range times one more than the number of those releases.
+    If the budget runs out, the commits up to the next discontinuity in the
+    range are given the fallback version.
+    """
+    name = get_backend_name(repo_dir, backend)
+    names = list(BACKENDS) if name == CROSS_CHECK else [name]
+    names.sort(key=lambda name: name != DEFAULT_BACKEND)
+    backends = [open_backend(repo_dir, name) for name in names]
+    budget = get_budget(repo_dir, budget)
+    tables = _load_tag_tables(backends[0], get_tag_patterns(repo_dir))
+
+    # The range itself is streamed with git plumbing commands, whichever
+    # backend is configured.
+    state: Optional[_RangeState] = None
+    fallback = ""
+    previous: Optional[str] = None
+    for line in iter_git_lines(
+        backends[0].git_dir, "rev-list", "--first-parent", "--reverse", "--parents", rev_range, "--"
+    ):
+        hexsha, *parents = line.split()
+        if previous is not None and parents and parents[0] == previous:
+            if state is not None:
+                state.advance(hexsha)
+        elif budget is None:
+            # The start of the range, or a discontinuity if the range
+            # has more than one tip.
+            state = _start_range(backends, repo_dir, rev_range, tables, hexsha)
+        else:
+            with limit(budget) as meter:
+                try:
+                    state = _start_range(backends, repo_dir, rev_range, tables, hexsha)
+                except BudgetExceededError as e:
+                    state = None
+                    fallback = _find_budget_fallback_version(repo_dir)
+                    report_overrun(repo_dir, hexsha, meter, str(e), fallback)
+        previous = hexsha
+        yield hexsha, fallback if state is None else state.version(hexsha)
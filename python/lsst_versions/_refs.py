@@ -0,0 +1,428 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Read tag references directly from a git directory.
+
+This avoids starting a ``git`` process (or importing GitPython) when the
+tags can be determined from ``packed-refs`` and the loose files in
+``refs/tags``. Only tags whose peeled commit can not be determined from
+those files, or from a loose tag object, are resolved with ``git``.
+"""
+
+from __future__ import annotations
+
+__all__ = (
+    "find_git_dir",
+    "get_alternates",
+    "get_common_dir",
+    "read_tags",
+    "refs_fingerprint",
+    "resolve_head",
+    "resolve_ref",
+)
+
+import hashlib
+import logging
+import os
+import zlib
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from ._git import iter_tags
+
+_LOG = logging.getLogger("lsst_versions")
+
+# Beyond this many tags it is cheaper to ask git to list every tag than to
+# pass each name on the command line.
+_MAX_TAG_PATTERNS = 500
+
+# Git follows chains of alternates up to this depth.
+_MAX_ALTERNATE_DEPTH = 5
+
+# The longest header we need to read from a loose tag object to find the
+# tagged object and its type.
+_TAG_HEADER_SIZE = 256
+
+
+def _is_git_dir(path: str) -> bool:
+    """Check whether a directory looks like a git directory."""
+    return os.path.isfile(os.path.join(path, "HEAD")) and (
+        os.path.isdir(os.path.join(path, "objects")) or os.path.isfile(os.path.join(path, "commondir"))
+    )
+
+
+def find_git_dir(repo_dir: str) -> str:
+    """Locate the git directory of a repository, without searching parent
+    directories.
+
+    Parameters
+    ----------
+    repo_dir : `str`
+        Path to a working tree, whose ``.git`` is a directory or a file
+        pointing to the git directory, or to a bare repository.
+
+    Returns
+    -------
+    git_dir : `str`
+        Absolute path to the git directory.
+
+    Raises
+    ------
+    RuntimeError
+        Raised if ``repo_dir`` is not a git repository.
+    """
+    dot_git = os.path.join(repo_dir, ".git")
+    candidate = repo_dir
+    if os.path.isdir(dot_git):
+        candidate = dot_git
+    elif os.path.isfile(dot_git):
+        with open(dot_git) as fh:
+            content = fh.read().strip()
+        if content.startswith("gitdir:"):
+            candidate = os.path.join(repo_dir, content[len("gitdir:") :].strip())
+    if not _is_git_dir(candidate):
+        raise RuntimeError(f"No Git repository found in {repo_dir}")
+    return os.path.abspath(candidate)
+
+
+def get_common_dir(git_dir: str) -> str:
+    """Return the directory holding the refs and objects shared by all
+    worktrees.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to a git directory.
+
+    Returns
+    -------
+    common_dir : `str`
+        The common git directory. This is ``git_dir`` itself unless it
+        belongs to a linked worktree.
+    """
+    try:
+        with open(os.path.join(git_dir, "commondir")) as fh:
+            common = fh.read().strip()
+    except FileNotFoundError:
+        return git_dir
+    return os.path.normpath(os.path.join(git_dir, common))
+
+
+def get_alternates(git_dir: str) -> List[str]:
+    """Return the object directories borrowed from other repositories.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to a git directory.
+
+    Returns
+    -------
+    object_dirs : `list` [`str`]
+        The object directories named in ``objects/info/alternates``,
+        followed by their own alternates, in the order git searches them.
+        Clones made with ``--reference`` or ``--shared`` have alternates.
+    """
+    alternates: List[str] = []
+    pending = [(os.path.join(get_common_dir(git_dir), "objects"), 0)]
+    while pending:
+        objects_dir, depth = pending.pop(0)
+        try:
+            with open(os.path.join(objects_dir, "info", "alternates")) as fh:
+                lines = fh.read().splitlines()
+        except OSError:
+            continue
+        for line in lines:
+            if not (line := line.strip()) or line.startswith("#"):
+                continue
+            # Relative paths are relative to the object directory.
+            alternate = os.path.normpath(os.path.join(objects_dir, line))
+            if alternate not in alternates and depth < _MAX_ALTERNATE_DEPTH:
+                alternates.append(alternate)
+                pending.append((alternate, depth + 1))
+    return alternates
+
+
+def refs_fingerprint(git_dir: str) -> str:
+    """Calculate a fingerprint of the tag references without reading them.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+
+    Returns
+    -------
+    fingerprint : `str`
+        A digest of the size, modification time and inode of ``packed-refs``
+        and of every loose tag reference. Git replaces reference files
+        rather than rewriting them so any change to a tag alters this value.
+    """
+    common_dir = get_common_dir(git_dir)
+    digest = hashlib.sha1()
+    paths = [os.path.join(common_dir, "packed-refs")]
+    for dirpath, _, filenames in os.walk(os.path.join(common_dir, "refs", "tags")):
+        paths.extend(os.path.join(dirpath, filename) for filename in filenames if not _is_lock(filename))
+    for path in sorted(paths):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        name = os.path.relpath(path, common_dir)
+        digest.update(f"{name}\0{stat.st_size}\0{stat.st_mtime_ns}\0{stat.st_ino}\n".encode())
+    return digest.hexdigest()
+
+
+def resolve_head(git_dir: str) -> Optional[str]:
+    """Determine the commit checked out, without running git.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+
+    Returns
+    -------
+    hexsha : `str` or `None`
+        The hex SHA of ``HEAD``, or `None` if it could not be determined
+        from the files in the git directory.
+    """
+    try:
+        with open(os.path.join(git_dir, "HEAD")) as fh:
+            head = fh.read().strip()
+    except OSError:
+        return None
+    if not head.startswith("ref:"):
+        return head or None
+    return resolve_ref(git_dir, head[len("ref:") :].strip())
+
+
+def resolve_ref(git_dir: str, refname: str) -> Optional[str]:
+    """Determine the object a reference points to, without running git.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    refname : `str`
+        Full name of the reference, for example ``refs/heads/main``.
+
+    Returns
+    -------
+    hexsha : `str` or `None`
+        The hex SHA the reference points to, or `None` if it could not be
+        determined from the files in the git directory.
+    """
+    common_dir = get_common_dir(git_dir)
+    try:
+        with open(os.path.join(common_dir, *refname.split("/"))) as fh:
+            return fh.read().strip() or None
+    except FileNotFoundError:
+        pass
+    except OSError:
+        return None
+    try:
+        with open(os.path.join(common_dir, "packed-refs")) as fh:
+            for line in fh:
+                sha, _, name = line.rstrip("\n").partition(" ")
+                if name == refname:
+                    return sha
+    except OSError:
+        pass
+    return None
+
+
+def _read_packed_refs(common_dir: str) -> Dict[str, Tuple[str, Optional[str], bool]]:
+    """Read the tags from the ``packed-refs`` file.
+
+    Returns
+    -------
+    tags : `dict`
+        Mapping of tag name to a tuple of the object it refers to, the peeled
+        commit (if known) and whether the absence of a peeled commit means
+        that the tag is a lightweight tag.
+    """
+    tags: Dict[str, Tuple[str, Optional[str], bool]] = {}
+    try:
+        fh = open(os.path.join(common_dir, "packed-refs"))
+    except FileNotFoundError:
+        return tags
+
+    peeled_tags = False
+    last: Optional[str] = None
+    with fh:
+        for line in fh:
+            line = line.rstrip("\n")
+            if line.startswith("#"):
+                if line.startswith("# pack-refs with:"):
+                    traits = line.split(":", 1)[1].split()
+                    peeled_tags = "peeled" in traits or "fully-peeled" in traits
+                continue
+            if line.startswith("^"):
+                # Peeled value of the preceding ref.
+                if last is not None:
+                    tags[last] = (tags[last][0], line[1:], True)
+                continue
+            sha, _, refname = line.partition(" ")
+            last = None
+            if refname.startswith("refs/tags/"):
+                last = refname[len("refs/tags/") :]
+                # Without a peel line the ref is not an annotated tag,
+                # but only if the file says that tags were peeled.
+                tags[last] = (sha, None, peeled_tags)
+    return tags
+
+
+def _is_lock(filename: str) -> bool:
+    """Return whether a file in the references is a git lock file.
+
+    Git does not allow a reference name component to end in ``.lock``, so
+    such a file is always a reference that is being updated.
+    """
+    return filename.endswith(".lock")
+
+
+def _read_loose_tags(common_dir: str) -> Optional[Dict[str, str]]:
+    """Read the loose tag references.
+
+    Returns
+    -------
+    tags : `dict` [`str`, `str`] or `None`
+        Mapping of tag name to the object it refers to. `None` if a loose
+        reference could not be understood.
+    """
+    tags: Dict[str, str] = {}
+    tags_dir = os.path.join(common_dir, "refs", "tags")
+    for dirpath, _, filenames in os.walk(tags_dir):
+        for filename in filenames:
+            if _is_lock(filename):
+                # A reference being written by git, which is not a tag.
+                continue
+            path = os.path.join(dirpath, filename)
+            name = os.path.relpath(path, tags_dir).replace(os.sep, "/")
+            with open(path) as fh:
+                content = fh.read().strip()
+            if content.startswith("ref:"):
+                # Symbolic tags are unusual enough that git can handle them.
+                return None
+            tags[name] = content
+    return tags
+
+
+def _peel_loose_object(objects_dir: str, sha: str) -> Optional[Tuple[str, Optional[str]]]:
+    """Peel an object using the loose object store.
+
+    Returns
+    -------
+    result : `tuple` or `None`
+        The peeled object and the tag object (or `None` if ``sha`` is not
+        a tag object). `None` is returned if the objects could not be read
+        or the tag does not refer to a commit.
+    """
+    tag_sha: Optional[str] = None
+    # Tags of tags are allowed so keep going until something else is found.
+    while True:
+        path = os.path.join(objects_dir, sha[:2], sha[2:])
+        try:
+            with open(path, "rb") as fh:
+                header = zlib.decompressobj().decompress(fh.read(), _TAG_HEADER_SIZE)
+        except (OSError, zlib.error):
+            return None
+        object_type = header.split(b" ", 1)[0]
+        if object_type == b"commit":
+            return sha, tag_sha
+        if object_type != b"tag":
+            return None
+        # Tag objects start with "object <sha>\ntype <type>\n".
+        body = header.split(b"\0", 1)[1]
+        fields = dict(line.split(b" ", 1) for line in body.split(b"\n")[:2] if b" " in line)
+        if b"object" not in fields:
+            return None
+        if tag_sha is None:
+            tag_sha = sha
+        sha = fields[b"object"].decode()
+
+
+def read_tags(
+    git_dir: str, known: Optional[Mapping[str, Tuple[str, Optional[str]]]] = None
+) -> Optional[List[Tuple[str, str, Optional[str]]]]:
+    """Read every tag in a repository without running ``git`` if possible.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    known : `~collections.abc.Mapping`, optional
+        Previously peeled objects. Maps the object a tag reference points to
+        onto the tagged commit and the tag object (`None` for a lightweight
+        tag). Objects found here are not peeled again.
+
+    Returns
+    -------
+    tags : `list` [`tuple` [`str`, `str`, `str` or `None`]] or `None`
+        The name of each tag, the hex SHA of the commit it tags, and the hex
+        SHA of the tag object (`None` for lightweight tags), sorted by name.
+        This matches the output of `lsst_versions._git.iter_tags`.
+        `None` is returned if the references are stored in a form that
+        this reader does not understand.
+
+    Notes
+    -----
+    Tags whose peeled commit can not be found in ``packed-refs`` or by
+    reading a loose tag object are resolved with a single ``git`` call
+    restricted to just those tags.
+    """
+    common_dir = get_common_dir(git_dir)
+    if not os.path.isdir(os.path.join(common_dir, "refs")):
+        # For example a reftable repository.
+        return None
+
+    packed = _read_packed_refs(common_dir)
+    loose = _read_loose_tags(common_dir)
+    if loose is None:
+        return None
+
+    objects_dir = os.path.join(common_dir, "objects")
+    resolved: Dict[str, Tuple[str, Optional[str]]] = {}
+    unresolved: List[str] = []
+    peeled: Optional[Tuple[str, Optional[str]]]
+    if known is None:
+        known = {}
+    for name in sorted(set(packed) | set(loose)):
+        if (target := loose[name] if name in loose else packed[name][0]) in known:
+            peeled = known[target]
+        elif name in loose:
+            # Loose refs take precedence over packed refs.
+            peeled = _peel_loose_object(objects_dir, loose[name])
+        else:
+            sha, peel, authoritative = packed[name]
+            if peel is not None:
+                peeled = (peel, sha)
+            elif authoritative:
+                peeled = (sha, None)
+            else:
+                peeled = _peel_loose_object(objects_dir, sha)
+        if peeled is None:
+            unresolved.append(name)
+        else:
+            resolved[name] = peeled
+
+    unresolved_set = set(unresolved)
+    if unresolved:
+        _LOG.debug("Resolving %d tags with git", len(unresolved))
+        patterns: List[str] = []
+        if len(unresolved) <= _MAX_TAG_PATTERNS:
+            patterns = [f"refs/tags/{name}" for name in unresolved]
+        # Tags that do not refer to commits are dropped here.
+        for name, commit, tag in iter_tags(git_dir, *patterns):
+            if name in unresolved_set:
+                resolved[name] = (commit, tag)
+
+    return [(name, commit, tag) for name, (commit, tag) in sorted(resolved.items())]
@@ -0,0 +1,213 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Find the commits that have a version."""
+
+from __future__ import annotations
+
+__all__ = ["resolve_lsst_version"]
+
+import logging
+import warnings
+from typing import Dict, List, Optional, Tuple
+
+from ._backend import PlumbingBackend
+from ._history import open_history_index
+from ._versions import _calculate_version
+
+_LOG = logging.getLogger("lsst_versions")
+
+# Weeks of the year that can appear in a weekly tag.
+_MAX_WEEK = 53
+
+
+def _parse_dev_version(version: str) -> List[Tuple[str, int]]:
+    """Find the weeklies and counters that could give a developer version.
+
+    Parameters
+    ----------
+    version : `str`
+        A normalized version.
+
+    Returns
+    -------
+    candidates : `list` [`tuple` [`str`, `int`]]
+        The normalized name of the weekly, an empty string if the version
+        is from before the first weekly, and the number of first-parent
+        commits since it. The last component of the version joins the week
+        and counter, so more than one split can be possible.
+    """
+    parts = version.split(".")
+    if len(parts) != 3 or not all(part.isdigit() for part in parts):
+        return []
+    year, week_counter = parts[1], parts[2]
+    if year == "0":
+        # No weekly was found so the week is 0.
+        return [("", int(week_counter))]
+    candidates = []
+    # The counter has at least two digits and no leading zero beyond those.
+    for split in range(1, len(week_counter) - 1):
+        week, counter = week_counter[:split], week_counter[split:]
+        if len(counter) > 2 and counter.startswith("0"):
+            continue
+        if 1 <= int(week) <= _MAX_WEEK:
+            candidates.append((f"w.{year}.{int(week):02d}", int(counter)))
+    return candidates
+
+
+def _find_descendants(
+    backend: PlumbingBackend, tip: str, wanted: List[Tuple[Optional[str], int]]
+) -> List[str]:
+    """Find the commits some first-parent steps after others.
+
+    Parameters
+    ----------
+    backend : `PlumbingBackend`
+        The repository.
+    tip : `str`
+        Hex SHA of the commit whose first-parent history is searched.
+    wanted : `list` [`tuple` [`str` or `None`, `int`]]
+        Hex SHA of each commit to start from, `None` for the root commit,
+        and the number of first-parent steps towards ``tip``.
+
+    Returns
+    -------
+    hexshas : `list` [`str`]
+        The commits found. Nothing is found for a start that is not in the
+        history of ``tip`` or is fewer steps from it.
+
+    Notes
+    -----
+    History is walked once, from ``tip`` back to the oldest start, or
+    until a commit in the history index is reached. The index then gives
+    the depth of every commit below that one.
+    """
+    pending = {start for start, _ in wanted if start is not None}
+    need_root = any(start is None for start, _ in wanted)
+    index = open_history_index(backend.git_dir)
+    try:
+        # Commits above the index, newest first, and their positions.
+        chain: List[str] = []
+        positions: Dict[str, int] = {}
+        junction: Optional[int] = None
+        reached_root = False
+        history = backend.iter_first_parents(tip)
+        try:
+            for hexsha in history:
+                if index is not None and (junction := index.depth(hexsha)) is not None:
+                    break
+                positions[hexsha] = len(chain)
+                chain.append(hexsha)
+                pending.discard(hexsha)
+                if not pending and not need_root:
+                    break
+            else:
+                reached_root = True
+        finally:
+            history.close()
+
+        # Depth of the oldest commit walked. Without the index or the root
+        # depths are only relative, which is enough if every start was
+        # walked.
+        base = 0 if junction is None else junction + 1
+        top = base + len(chain) - 1
+        found = []
+        for start, steps in wanted:
+            depth: Optional[int] = None
+            if start is None:
+                depth = 0 if junction is not None or reached_root else None
+            elif (position := positions.get(start)) is not None:
+                depth = top - position
+            elif index is not None and junction is not None:
+                if (depth := index.depth(start)) is not None and depth > junction:
+                    depth = None
+            if depth is None:
+                continue
+            target = depth + steps
+            if base <= target <= top:
+                found.append(chain[top - target])
+            elif index is not None and junction is not None and target <= junction:
+                found.append(index.oid(target).hex())
+        _LOG.debug("Walked %d commits from %s to find %d descendants", len(chain), tip, len(found))
+        return found
+    finally:
+        if index is not None:
+            index.close()
+
+
+def resolve_lsst_version(version: str, repo_dir: str = ".", rev: str = "HEAD") -> List[str]:
+    """Find the commits that have a version.
+
+    Parameters
+    ----------
+    version : `str`
+        A version returned by `find_lsst_version`.
+    repo_dir : `str`, optional
+        Path to the relevant Git repository.
+    rev : `str`, optional
+        A developer version is looked for in the first-parent history of
+        this revision. Releases are found wherever they are.
+
+    Returns
+    -------
+    hexshas : `list` [`str`]
+        Hex SHAs of the commits whose version is ``version``. Usually there
+        is at most one.
+
+    Raises
+    ------
+    ValueError
+        Raised if ``version`` is not a valid version.
+
+    Notes
+    -----
+    The weekly and the number of commits since it are read from a developer
+    version and the commits that far after the weekly are found. History is
+    walked back from ``rev`` only as far as the weekly, or until it reaches
+    the history index. The version of every candidate is then
+    calculated to check that it matches.
+    """
+    from packaging.version import InvalidVersion, Version
+
+    try:
+        normalized = str(Version(version))
+    except InvalidVersion:
+        raise ValueError(f"Invalid version '{version}'") from None
+
+    backend = PlumbingBackend(repo_dir)
+    tables = backend.load_tag_tables()
+
+    candidates = [hexsha for hexsha, release in tables.releases.items() if release == normalized]
+    if not candidates:
+        by_name: Dict[str, List[str]] = {}
+        for hexsha, weekly_name in tables.weeklies.items():
+            by_name.setdefault(weekly_name, []).append(hexsha)
+        wanted: List[Tuple[Optional[str], int]] = []
+        for weekly_name, counter in _parse_dev_version(normalized):
+            if not weekly_name:
+                wanted.append((None, counter))
+            else:
+                wanted.extend((start, counter) for start in by_name.get(weekly_name, []))
+        if wanted:
+            candidates = _find_descendants(backend, backend.resolve(rev), wanted)
+
+    with warnings.catch_warnings():
+        # Early commits have no release and would warn.
+        warnings.simplefilter("ignore")
+        found = [
+            hexsha
+            for hexsha in dict.fromkeys(candidates)
+            if _calculate_version(backend, repo_dir, hexsha) == normalized
+        ]
+    _LOG.debug(
+        "Found %d commits with version %s out of %d candidates", len(found), normalized, len(candidates)
+    )
+    return found
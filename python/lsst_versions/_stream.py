@@ -0,0 +1,304 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Version determination from tags streamed newest first by git.
+
+Rather than classifying every tag of the repository, the release and weekly
+tags are listed by ``git for-each-ref`` sorted by version and only read for
+as long as they are needed: releases until a major release is found that
+does not contain the commit, weeklies until one is found in the
+first-parent history of the commit.
+
+Finding the relevant release relies on the version sort of git ordering
+the release tags by major version. If it is found not to, the caller
+should fall back to classifying every tag. The nearest weekly is checked
+and does not depend on the order of the weeklies.
+"""
+
+from __future__ import annotations
+
+__all__ = (
+    "DEFAULT_RELEASE_PATTERNS",
+    "DEFAULT_WEEKLY_PATTERNS",
+    "TagPatterns",
+    "find_nearest_weekly",
+    "find_relevant_release",
+    "find_release",
+    "get_tag_patterns",
+    "load_tag_tables",
+)
+
+import heapq
+import logging
+import os
+from typing import TYPE_CHECKING, Dict, Generator, Iterator, List, NamedTuple, Optional, Tuple
+
+from ._budget import get_meter
+from ._config import read_tool_config
+from ._git import iter_tags
+from ._profile import count
+from ._tags import RELEASE, WEEKLY, TagRecord, TagTables, build_tables, classify_tag
+
+if TYPE_CHECKING:
+    from ._backend import GitBackend
+
+_LOG = logging.getLogger("lsst_versions")
+
+DEFAULT_RELEASE_PATTERNS = ("refs/tags/v*", "refs/tags/[0-9]*")
+"""The ``for-each-ref`` patterns that list release tags by default."""
+
+DEFAULT_WEEKLY_PATTERNS = ("refs/tags/w.*",)
+"""The ``for-each-ref`` patterns that list weekly tags by default."""
+
+# Maximum number of commits whose tags are requested from git at once.
+_POINTS_AT_BATCH = 1000
+
+# Values of the tag_resolution setting.
+_INDEX = "index"
+_STREAM = "stream"
+
+
+class TagPatterns(NamedTuple):
+    """The tags to stream."""
+
+    releases: Tuple[str, ...]
+    """Patterns matching the release tags."""
+
+    weeklies: Tuple[str, ...]
+    """Patterns matching the weekly tags."""
+
+
+def get_tag_patterns(repo_dir: str) -> Optional[TagPatterns]:
+    """Determine whether versions should be found from tag streams.
+
+    Parameters
+    ----------
+    repo_dir : `str`
+        Path to the repository.
+
+    Returns
+    -------
+    patterns : `TagPatterns` or `None`
+        The tags to stream, or `None` if every tag should be classified.
+
+    Notes
+    -----
+    Streams are used if the ``tag_resolution`` key of the
+    ``[tool.lsst_versions]`` table of the ``pyproject.toml`` file in
+    ``repo_dir`` is ``stream``. The patterns are read from the
+    ``release_tag_patterns`` and ``weekly_tag_patterns`` keys.
+    """
+    try:
+        config = read_tool_config(os.path.join(repo_dir, "pyproject.toml"))
+    except FileNotFoundError:
+        return None
+    except (OSError, ImportError, ValueError) as e:
+        _LOG.debug("Unable to read tag resolution from pyproject.toml in %s: %s", repo_dir, e)
+        return None
+    if config is None:
+        return None
+    resolution = config.get("tag_resolution", _INDEX)
+    if resolution not in (_INDEX, _STREAM):
+        raise ValueError(f"Unknown tag resolution '{resolution}'. Choose from {_INDEX}, {_STREAM}.")
+    if resolution == _INDEX:
+        return None
+    return TagPatterns(
+        tuple(config.get("release_tag_patterns", DEFAULT_RELEASE_PATTERNS)),
+        tuple(config.get("weekly_tag_patterns", DEFAULT_WEEKLY_PATTERNS)),
+    )
+
+
+def _iter_records(git_dir: str, pattern: str, kind: str) -> Generator[TagRecord, None, None]:
+    """Stream the tags of one kind matching a pattern, newest first."""
+    tags = iter_tags(git_dir, pattern, sort="-version:refname")
+    try:
+        for tag in tags:
+            count("tags_seen")
+            if (record := classify_tag(*tag)).kind == kind:
+                yield record
+    finally:
+        tags.close()
+
+
+def load_tag_tables(git_dir: str, patterns: TagPatterns) -> TagTables:
+    """Classify every tag matching the patterns.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    patterns : `TagPatterns`
+        The tags to consider.
+
+    Returns
+    -------
+    tables : `TagTables`
+        The releases and weeklies matching the patterns. Versions found
+        from these tables are those found by streaming the tags.
+    """
+    records: List[TagRecord] = []
+    for kind, kind_patterns in ((RELEASE, patterns.releases), (WEEKLY, patterns.weeklies)):
+        for tag in iter_tags(git_dir, *kind_patterns):
+            count("tags_seen")
+            if (record := classify_tag(*tag)).kind == kind:
+                records.append(record)
+    return build_tables(sorted(records, key=lambda record: record.name))
+
+
+def find_release(git_dir: str, hexsha: str, patterns: TagPatterns) -> Optional[str]:
+    """Find the release of a commit.
+
+    Parameters
+    ----------
+    git_dir : `str`
+        Path to the git directory of the repository.
+    hexsha : `str`
+        Hex SHA of the commit.
+    patterns : `TagPatterns`
+        The tags to consider.
+
+    Returns
+    -------
+    release : `str` or `None`
+        The newest normalized release version of the commit, `None` if it
+        is not a release.
+    """
+    records = [classify_tag(*tag) for tag in iter_tags(git_dir, *patterns.releases, points_at=[hexsha])]
+    return build_tables(records).releases.get(hexsha)
+
+
+def find_relevant_release(backend: GitBackend, hexsha: str, patterns: TagPatterns) -> Optional[int]:
+    """Find the highest major release that does not contain a commit.
+
+    Parameters
+    ----------
+    backend : `GitBackend`
+        The repository.
+    hexsha : `str`
+        Hex SHA of the commit.
+    patterns : `TagPatterns`
+        The tags to consider.
+
+    Returns
+    -------
+    relevant_release : `int` or `None`
+        The major release, or 0 if every release contains the commit.
+        `None` if git did not list the releases in order.
+
+    Notes
+    -----
+    As when every tag is classified, each major release is represented by
+    the last of its tags in name order.
+    """
+    streams = [_iter_records(backend.git_dir, pattern, RELEASE) for pattern in patterns.releases]
+    try:
+        major: Optional[int] = None
+        name = commit = ""
+        for record in heapq.merge(*streams, key=lambda record: record.major, reverse=True):
+            if major is not None and record.major > major:
+                _LOG.debug("Release %s is out of order, after major release %d.", record.name, major)
+                return None
+            if record.major != major:
+                if major is not None and not backend.tags_containing(hexsha, {name: commit}):
+                    return major
+                major, name, commit = record.major, record.name, record.commit
+            elif record.name > name:
+                name, commit = record.name, record.commit
+        if major is not None and not backend.tags_containing(hexsha, {name: commit}):
+            return major
+        return 0
+    finally:
+        for stream in streams:
+            stream.close()
+
+
+def _find_nearest_tagged(git_dir: str, history: List[str], patterns: TagPatterns) -> Tuple[int, str]:
+    """Ask git for the first commit in history that has a weekly tag."""
+    for start in range(0, len(history), _POINTS_AT_BATCH):
+        batch = history[start : start + _POINTS_AT_BATCH]
+        weeklies: Dict[str, str] = {}
+        for tag in iter_tags(git_dir, *patterns.weeklies, points_at=batch):
+            if (record := classify_tag(*tag)).kind == WEEKLY:
+                weeklies[record.commit] = max(weeklies.get(record.commit, ""), record.value)
+        for depth, commit in enumerate(batch, start):
+            if commit in weeklies:
+                return depth, weeklies[commit]
+    return len(history) - 1, ""
+
+
+def find_nearest_weekly(backend: GitBackend, hexsha: str, patterns: TagPatterns) -> Tuple[int, str]:
+    """Find the closest weekly in the first-parent history of a commit.
+
+    Parameters
+    ----------
+    backend : `GitBackend`
+        The repository.
+    hexsha : `str`
+        Hex SHA of the commit.
+    patterns : `TagPatterns`
+        The tags to consider.
+
+    Returns
+    -------
+    counter : `int`
+        The number of first-parent steps from the commit to the weekly,
+        or to the root commit if there is none.
+    weekly_name : `str`
+        The weekly that was found, or an empty string.
+
+    Notes
+    -----
+    The walk and the weeklies, newest first, are read in step until a
+    weekly is found in the walk. Weeklies that have not been read may be
+    nearer, for example if they were not tagged in order, so git is then
+    asked for the weekly tags of the commits up to the one found.
+    """
+    streams = [_iter_records(backend.git_dir, pattern, WEEKLY) for pattern in patterns.weeklies]
+    weekly_stream: Optional[Iterator[TagRecord]] = heapq.merge(
+        *streams, key=lambda record: record.value, reverse=True
+    )
+    history: Optional[Generator[str, None, None]] = backend.iter_first_parents(hexsha)
+    walked: Dict[str, int] = {}
+    weeklies: Dict[str, str] = {}
+    found: Optional[Tuple[int, str]] = None
+    meter = get_meter()
+    try:
+        while found is None and (history is not None or weekly_stream is not None):
+            if history is not None:
+                if (commit := next(history, None)) is None:
+                    history = None
+                else:
+                    if meter is not None:
+                        meter.charge()
+                    if commit in weeklies:
+                        found = len(walked), weeklies[commit]
+                    walked[commit] = len(walked)
+            if found is None and weekly_stream is not None:
+                if (record := next(weekly_stream, None)) is None:
+                    weekly_stream = None
+                elif record.commit in walked:
+                    found = walked[record.commit], record.value
+                else:
+                    weeklies.setdefault(record.commit, record.value)
+    finally:
+        if history is not None:
+            history.close()
+        for stream in streams:
+            stream.close()
+
+    if found is None:
+        # Every weekly was read and none is in the history.
+        found = len(walked) - 1, ""
+    elif weekly_stream is not None:
+        found = _find_nearest_tagged(backend.git_dir, list(walked)[: found[0] + 1], patterns)
+    _LOG.debug("Walked %d commits to find weekly %r", len(walked), found[1])
+    count("commits_walked", len(walked))
+    return found
@@ -0,0 +1,392 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Classification of tags following LSST tagging conventions.
+
+The tables hold only what is needed to determine versions: commits are
+keyed by their binary object IDs, weeklies are packed into integers and
+releases keep the version string from the tag name.
+
+The forms of release tag used by LSST, ``x.y.z`` and ``x.y.zrcN`` with an
+optional ``v`` prefix, are parsed by a simple pattern into tuples of
+integers that sort as `packaging.version.Version` does. Only other forms
+need the full PEP 440 grammar and a `~packaging.version.Version` object.
+"""
+
+from __future__ import annotations
+
+__all__ = ("RELEASE", "WEEKLY", "TagRecord", "TagTables", "build_tables", "classify_tag", "parse_release")
+
+import functools
+import logging
+import re
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    Mapping,
+    Optional,
+    Pattern,
+    Tuple,
+    TypeVar,
+)
+
+from ._profile import count
+
+_LOG = logging.getLogger("lsst_versions")
+
+RELEASE = "release"
+"""Kind of a tag that is a formal release or release candidate."""
+
+WEEKLY = "weekly"
+"""Kind of a tag that is a weekly tag."""
+
+_WEEKLY_RE = re.compile(r"w\.([0-9]{4})\.([0-9]{1,2})")
+
+# Release versions in the form used by LSST.
+_RELEASE_RE = re.compile(r"([0-9]+)\.([0-9]+)\.([0-9]+)(?:rc([0-9]+))?")
+
+_V = TypeVar("_V")
+_S = TypeVar("_S")
+
+
+@functools.lru_cache(maxsize=None)
+def _version_re() -> Pattern[str]:
+    """Return the pattern matched by valid PEP 440 versions."""
+    from packaging.version import VERSION_PATTERN
+
+    return re.compile(r"^\s*" + VERSION_PATTERN + r"\s*$", re.VERBOSE | re.IGNORECASE)
+
+
+def parse_release(version_string: str) -> Optional[Tuple[int, int, int, int, int]]:
+    """Parse a release version in the form used by LSST.
+
+    Parameters
+    ----------
+    version_string : `str`
+        The version, without any ``v`` prefix.
+
+    Returns
+    -------
+    key : `tuple` [`int`, ...] or `None`
+        The major, minor and patch versions, whether this is a final
+        release (1) or a release candidate (0), and the release candidate
+        number. Keys sort in the same order as the corresponding
+        `packaging.version.Version` objects. `None` if the version has some
+        other form, which does not mean it is invalid.
+    """
+    if (matches := _RELEASE_RE.fullmatch(version_string)) is None:
+        return None
+    major, minor, patch, rc = matches.groups()
+    if rc is None:
+        return int(major), int(minor), int(patch), 1, 0
+    return int(major), int(minor), int(patch), 0, int(rc)
+
+
+def _is_newer_release(version_string: str, other: str) -> bool:
+    """Return whether a release version is newer than another."""
+    if (key := parse_release(version_string)) is not None and (other_key := parse_release(other)) is not None:
+        return key > other_key
+
+    from packaging.version import Version
+
+    return Version(version_string) > Version(other)
+
+
+@functools.lru_cache(maxsize=1024)
+def _normalize_release(version_string: str) -> str:
+    """Return the normalized form of a release version."""
+    if (key := parse_release(version_string)) is not None:
+        major, minor, patch, final, rc = key
+        return f"{major}.{minor}.{patch}" if final else f"{major}.{minor}.{patch}rc{rc}"
+
+    from packaging.version import Version
+
+    return str(Version(version_string))
+
+
+def _pack_weekly(name: str) -> Optional[int]:
+    """Pack the year and week of a weekly tag into an integer."""
+    if (matches := _WEEKLY_RE.fullmatch(name)) is None:
+        return None
+    return int(matches.group(1)) * 100 + int(matches.group(2))
+
+
+def _weekly_name(packed: int) -> str:
+    """Return the normalized name of a packed weekly tag."""
+    return f"w.{packed // 100}.{packed % 100:02d}"
+
+
+class TagRecord:
+    """A tag and its classification.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the tag.
+    commit : `str`
+        Hex SHA of the commit that is tagged.
+    tag : `str` or `None`
+        Hex SHA of the tag object, `None` for a lightweight tag.
+    kind : `str`
+        `RELEASE`, `WEEKLY` or an empty string for an irrelevant tag.
+    value : `str`
+        Version string of a release, as it appears in the tag name, or
+        normalized weekly tag name.
+    major : `int`
+        Major version of a release, 0 otherwise.
+
+    Notes
+    -----
+    Iterating over a record yields the fields in the order of the
+    constructor parameters, so ``TagRecord(*list(record))`` is a copy.
+    """
+
+    __slots__ = ("name", "commit", "tag", "kind", "value", "major")
+
+    def __init__(self, name: str, commit: str, tag: Optional[str], kind: str, value: str, major: int):
+        self.name = name
+        self.commit = commit
+        self.tag = tag
+        self.kind = kind
+        self.value = value
+        self.major = major
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter((self.name, self.commit, self.tag, self.kind, self.value, self.major))
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, TagRecord):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __repr__(self) -> str:
+        return "TagRecord({})".format(", ".join(repr(field) for field in self))
+
+
+class _CommitMapping(Mapping[str, _V], Generic[_S, _V]):
+    """Read-only view of a table keyed by binary object ID.
+
+    Parameters
+    ----------
+    table : `dict` [`bytes`, `typing.Any`]
+        The table.
+    convert : `~collections.abc.Callable`
+        Function converting a stored value to the value presented.
+    """
+
+    __slots__ = ("_table", "_convert")
+
+    def __init__(self, table: Dict[bytes, _S], convert: Callable[[_S], _V]):
+        self._table = table
+        self._convert = convert
+
+    def __getitem__(self, hexsha: str) -> _V:
+        try:
+            return self._convert(self._table[bytes.fromhex(hexsha)])
+        except ValueError:
+            raise KeyError(hexsha) from None
+
+    def __contains__(self, hexsha: object) -> bool:
+        try:
+            return bytes.fromhex(hexsha) in self._table  # type: ignore[arg-type]
+        except (TypeError, ValueError):
+            return False
+
+    def __iter__(self) -> Iterator[str]:
+        return (oid.hex() for oid in self._table)
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+
+class TagTables:
+    """Relevant tags of a repository indexed by commit.
+
+    Parameters
+    ----------
+    releases : `dict` [`bytes`, `str`]
+        The newest release version, as it appears in the tag name,
+        associated with each commit.
+    major_releases : `dict` [`int`, `bytes`]
+        The commit associated with each major release.
+    weeklies : `dict` [`bytes`, `int`]
+        The newest weekly associated with each commit, packed as
+        ``year * 100 + week``.
+    major_tags : `dict` [`int`, `str`]
+        The name of the tag that defines each entry in ``major_releases``.
+
+    Notes
+    -----
+    The tables are presented keyed by hex SHA. Lookups convert the key.
+    """
+
+    __slots__ = ("_releases", "_major_releases", "_weeklies", "_weekly_view", "major_tags")
+
+    def __init__(
+        self,
+        releases: Dict[bytes, str],
+        major_releases: Dict[int, bytes],
+        weeklies: Dict[bytes, int],
+        major_tags: Dict[int, str],
+    ):
+        self._releases = releases
+        self._major_releases = major_releases
+        self._weeklies = weeklies
+        # The same view is always returned so that results derived from it
+        # can be cached for as long as these tables are in use.
+        self._weekly_view: Mapping[str, str] = _CommitMapping(weeklies, _weekly_name)
+        self.major_tags = major_tags
+
+    @property
+    def releases(self) -> Mapping[str, str]:
+        """The newest normalized release version associated with each
+        commit (`~collections.abc.Mapping` [`str`, `str`]).
+        """
+        return _CommitMapping(self._releases, _normalize_release)
+
+    @property
+    def major_releases(self) -> Dict[int, str]:
+        """The commit associated with each major release
+        (`dict` [`int`, `str`]).
+        """
+        return {major: oid.hex() for major, oid in self._major_releases.items()}
+
+    @property
+    def weeklies(self) -> Mapping[str, str]:
+        """The newest normalized weekly tag associated with each commit
+        (`~collections.abc.Mapping` [`str`, `str`]).
+        """
+        return self._weekly_view
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, TagTables):
+            return NotImplemented
+        return (
+            self._releases == other._releases
+            and self._major_releases == other._major_releases
+            and self._weeklies == other._weeklies
+            and self.major_tags == other.major_tags
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"TagTables({len(self._releases)} releases, {len(self._major_releases)} major releases, "
+            f"{len(self._weeklies)} weeklies)"
+        )
+
+
+def classify_tag(name: str, commit: str, tag: Optional[str] = None) -> TagRecord:
+    """Classify a single tag.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the tag.
+    commit : `str`
+        Hex SHA of the commit that is tagged.
+    tag : `str`, optional
+        Hex SHA of the tag object for an annotated tag.
+
+    Returns
+    -------
+    record : `TagRecord`
+        The classified tag.
+    """
+    _LOG.debug("Testing relevance of tag %s", name)
+    # LSST repos have release versions as either x.y.z version
+    # strings of vx.y.z (with optional rc numbers).
+    # Extract major version numbers from these and also store them
+    # in case the requested commit is actually associated with
+    # a full release.
+    if matches_release := re.match(r"v?(\d+.*)", name):
+        _LOG.debug("Tag %s matches a release.", name)
+
+        version_string = matches_release.group(1)
+        if (matches := _RELEASE_RE.fullmatch(version_string)) is not None:
+            return TagRecord(name, commit, tag, RELEASE, version_string, int(matches.group(1)))
+
+        # Otherwise assume the version string is parseable as a modern
+        # version. Some packages have odd (old) tags like 2015_10.0
+        # or 6.2-hsc, so skip those as not being relevant. Only the
+        # validity and the major version are needed here; the version is
+        # normalized if it is ever used.
+        if (parsed := _version_re().match(version_string)) is None:
+            _LOG.info("Version string rejected: %s", version_string)
+            count("tags_rejected")
+            return TagRecord(name, commit, tag, "", "", 0)
+        major = int(parsed.group("release").split(".")[0])
+        return TagRecord(name, commit, tag, RELEASE, version_string, major)
+    elif name.startswith("w."):
+        _LOG.debug("Tag %s matches a weekly", name)
+
+        # Some weekly tags did not zero pad the week so must be normalized
+        # before comparison.
+        if (packed := _pack_weekly(name)) is None:
+            _LOG.info("Weekly tag rejected: %s", name)
+            count("tags_rejected")
+            return TagRecord(name, commit, tag, "", "", 0)
+        return TagRecord(name, commit, tag, WEEKLY, _weekly_name(packed), 0)
+    return TagRecord(name, commit, tag, "", "", 0)
+
+
+def build_tables(records: Iterable[TagRecord]) -> TagTables:
+    """Index classified tags by commit.
+
+    Parameters
+    ----------
+    records : `~collections.abc.Iterable` [`TagRecord`]
+        The classified tags, sorted by tag name.
+
+    Returns
+    -------
+    tables : `TagTables`
+        The releases, major releases and weeklies.
+    """
+    releases: Dict[bytes, str] = {}
+    major_releases: Dict[int, bytes] = {}
+    weeklies: Dict[bytes, int] = {}
+    major_tags: Dict[int, str] = {}
+
+    n_tags = 0
+    for record in records:
+        n_tags += 1
+        if record.kind == RELEASE:
+            oid = bytes.fromhex(record.commit)
+            if (previous_release := releases.get(oid)) is not None:
+                # This commit already has a version number associated with
+                # it. Check if this current version is newer and if so
+                # replace it.
+                if _is_newer_release(record.value, previous_release):
+                    releases[oid] = record.value
+            else:
+                releases[oid] = record.value
+
+            # Assume that only major releases matter when looking through
+            # the history for developer versions.
+            major_releases[record.major] = oid
+            major_tags[record.major] = record.name
+        elif record.kind == WEEKLY:
+            # There can be multiple weeklies associated with a single
+            # commit. Store the weeklies associated with the object they
+            # are tagging but only if this weekly is more recent than the one
+            # that may already be stored.
+            oid = bytes.fromhex(record.commit)
+            packed = _pack_weekly(record.value) or 0
+            if weeklies.get(oid, 0) > packed:
+                continue
+            weeklies[oid] = packed
+
+    count("tags_seen", n_tags)
+    return TagTables(releases, major_releases, weeklies, major_tags)
@@ -15,23 +15,42 @@ from __future__ import annotations
 
 __all__ = ["find_lsst_version", "get_lsst_version", "infer_version_for_setuptools"]
 
+import contextlib
+import hashlib
+import json
 import logging
 import os
-import re
 import warnings
-from typing import TYPE_CHECKING, Dict, Optional, Tuple
-
-from packaging.version import InvalidVersion, Version
-
-try:
-    import tomli
-except ImportError:
-    tomli = None  # type: ignore
-
-try:
-    import git
-except ImportError:
-    git = None  # type: ignore
+from typing import TYPE_CHECKING, Dict, Optional, Set, Tuple
+
+from . import _stream
+from ._backend import (
+    BACKEND_ENV,
+    BACKENDS,
+    CROSS_CHECK,
+    DEFAULT_BACKEND,
+    GitBackend,
+    get_backend_name,
+    open_backend,
+)
+from ._budget import (
+    BUDGET_COMMITS_ENV,
+    BUDGET_LABEL,
+    BUDGET_SECONDS_ENV,
+    BudgetExceededError,
+    Meter,
+    ResolutionBudget,
+    get_budget,
+    limit,
+    report_overrun,
+)
+from ._cache import read_version_stamp, write_version_stamp
+from ._config import read_tool_config
+from ._metadata import read_metadata_version
+from ._profile import span
+from ._refs import find_git_dir
+from ._stream import TagPatterns, get_tag_patterns
+from ._tags import TagTables
 
 if TYPE_CHECKING:
     import setuptools
@@ -39,7 +58,169 @@ if TYPE_CHECKING:
 _LOG = logging.getLogger("lsst_versions")
 
 
-def find_lsst_version(repo_dir: str = ".", version_commit: str = "HEAD") -> str:
+def _load_tag_tables(backend: GitBackend, patterns: Optional[TagPatterns]) -> TagTables:
+    """Classify the tags that determine versions.
+
+    Parameters
+    ----------
+    backend : `GitBackend`
+        The repository.
+    patterns : `TagPatterns` or `None`
+        The tags to consider when they are streamed, as returned by
+        `~lsst_versions._stream.get_tag_patterns`. `None` for every tag.
+
+    Returns
+    -------
+    tables : `TagTables`
+        The releases and weeklies.
+    """
+    if patterns is None:
+        return backend.load_tag_tables()
+    return _stream.load_tag_tables(backend.git_dir, patterns)
+
+
+def _find_relevant_release(backend: GitBackend, hexsha: str, tables: TagTables) -> int:
+    """Find the highest major release that does not contain a commit.
+
+    Parameters
+    ----------
+    backend : `GitBackend`
+        The repository.
+    hexsha : `str`
+        Hex SHA of the commit.
+    tables : `TagTables`
+        The classified tags of the repository.
+
+    Returns
+    -------
+    relevant_release : `int`
+        The major release, or 0 if every release contains the commit.
+    """
+    if not (tags := _major_release_tags(tables)):
+        return 0
+
+    # Determine which major releases contain the commit all at once.
+    return _select_relevant_release(tables, backend.tags_containing(hexsha, tags))
+
+
+def _major_release_tags(tables: TagTables) -> Dict[str, str]:
+    """Return the tags whose ancestry determines the relevant release.
+
+    Parameters
+    ----------
+    tables : `TagTables`
+        The classified tags of the repository.
+
+    Returns
+    -------
+    tags : `dict` [`str`, `str`]
+        The commit of the tag that defines each major release, indexed by
+        tag name.
+    """
+    major_releases = tables.major_releases
+    return {tag: major_releases[major] for major, tag in tables.major_tags.items()}
+
+
+def _select_relevant_release(tables: TagTables, containing: Set[str]) -> int:
+    """Find the highest major release that does not contain a commit.
+
+    Parameters
+    ----------
+    tables : `TagTables`
+        The classified tags of the repository.
+    containing : `set` [`str`]
+        The names of the tags returned by `_major_release_tags` that
+        contain the commit.
+
+    Returns
+    -------
+    relevant_release : `int`
+        The major release, or 0 if every release contains the commit.
+    """
+    # The relevant release is the newest release that does not have this
+    # commit as an ancestor.
+    return max((major for major, tag in tables.major_tags.items() if tag not in containing), default=0)
+
+
+def _make_dev_version(
+    repo_dir: str, hexsha: str, relevant_release: int, weekly_name: str, counter: int
+) -> str:
+    """Construct and report the developer version of a commit.
+
+    Parameters
+    ----------
+    repo_dir : `str`
+        Path to the repository, used in messages.
+    hexsha : `str`
+        Hex SHA of the commit.
+    relevant_release : `int`
+        The newest major release that does not contain the commit.
+    weekly_name : `str`
+        The normalized name of the closest weekly, or an empty string if
+        there is none.
+    counter : `int`
+        The number of first-parent commits since that weekly.
+
+    Returns
+    -------
+    dev_version : `str`
+        The developer version.
+    """
+    if relevant_release == 0:
+        warnings.warn(f"Could not find release tag as ancestor for {hexsha} in repo '{repo_dir}', using 0.")
+
+    dev_version = _format_dev_version(relevant_release, weekly_name, counter)
+
+    _LOG.info("Using version %s for commit %s derived from weekly %s", dev_version, hexsha, weekly_name)
+
+    return dev_version
+
+
+def _format_dev_version(relevant_release: int, weekly_name: str, counter: int) -> str:
+    """Construct a developer version.
+
+    Parameters
+    ----------
+    relevant_release : `int`
+        The newest major release that does not contain the commit.
+    weekly_name : `str`
+        The normalized name of the closest weekly, or an empty string if
+        there is none.
+    counter : `int`
+        The number of first-parent commits since that weekly.
+
+    Returns
+    -------
+    dev_version : `str`
+        The developer version in standard form.
+    """
+    if not weekly_name:
+        # No weekly was found. This must be a very early commit.
+        year, week = "0", "0"
+    else:
+        year, week = weekly_name[2:].split(".")
+
+    # Declare the developer version to be an evolution of the current
+    # release but with the year and week in the minor and patchlevel parts.
+    # Alpha versions for weeklies were used initially but once full releases
+    # are made it becomes very difficult for tooling to ever install the
+    # alphas.
+    dev_version = f"{relevant_release}.{year}.{week}{counter:02d}"
+
+    # Convert the version to standard form (this can prevent warnings
+    # coming from setuptools later on). For example 1.0.0a07 is rewritten
+    # as 1.0.0a7.
+    from packaging.version import Version
+
+    return str(Version(dev_version))
+
+
+def find_lsst_version(
+    repo_dir: str = ".",
+    version_commit: str = "HEAD",
+    backend: Optional[str] = None,
+    budget: Optional[ResolutionBudget] = None,
+) -> str:
     """Return the version for the given LSST commit.
 
     Parameters
@@ -48,11 +229,26 @@ def find_lsst_version(repo_dir: str = ".", version_commit: str = "HEAD") -> str:
         Path to the relevant Git repository.
     version_commit : `str`, optional
         Commit for which the version is to be calculated.
+    backend : `str`, optional
+        Name of the implementation of the git operations to use, either
+        ``plumbing``, ``gitpython`` or ``cross-check``. The latter uses
+        every implementation and raises if their versions differ. Defaults
+        to the value of the ``LSST_VERSIONS_BACKEND`` environment variable,
+        then the ``backend`` key of ``[tool.lsst_versions]`` in the
+        ``pyproject.toml`` file of the repository, then ``plumbing``.
+    budget : `ResolutionBudget`, optional
+        Limits on the time taken and the number of commits examined.
+        Defaults to the values of the ``LSST_VERSIONS_BUDGET_SECONDS`` and
+        ``LSST_VERSIONS_BUDGET_COMMITS`` environment variables, then the
+        ``budget_seconds`` and ``budget_commits`` keys of
+        ``[tool.lsst_versions]``, then no limit.
 
     Returns
     -------
     dev_version : `str`
-        The development version of the commit.
+        The development version of the commit. If the budget runs out, the
+        version from the package metadata, or ``0.0.0`` if there is none,
+        with a ``+budget`` local label.
 
     Notes
     -----
@@ -80,151 +276,258 @@ def find_lsst_version(repo_dir: str = ".", version_commit: str = "HEAD") -> str:
 
     If a commit matches that of a formal release tag (either proper release
     or release candidate) that version is used directly.
+
+    If the ``LSST_VERSIONS_SOCKET`` environment variable names the socket of
+    a running ``lsst-version serve`` process, the version is requested from
+    that server. The version is calculated in this process if the server
+    can not be reached.
+
+    The time taken by each phase can be monitored by registering a
+    callback with `add_span_callback`.
+    """
+    from ._daemon import request_version
+
+    with span("find_lsst_version", repo_dir=repo_dir, commit=version_commit):
+        # A server uses its own configuration so is bypassed if a specific
+        # backend or budget is requested.
+        if backend is None and budget is None:
+            with span("version_server"):
+                version = request_version(repo_dir, version_commit)
+            if version is not None:
+                return version
+        return _find_lsst_version(repo_dir, version_commit, backend, budget)
+
+
+def _find_lsst_version(
+    repo_dir: str,
+    version_commit: str,
+    backend: Optional[str] = None,
+    budget: Optional[ResolutionBudget] = None,
+) -> str:
+    """Calculate the version for the given LSST commit in this process.
+
+    Parameters
+    ----------
+    repo_dir : `str`
+        Path to the relevant Git repository.
+    version_commit : `str`
+        Commit for which the version is to be calculated.
+    backend : `str`, optional
+        Name of the backend to use.
+    budget : `ResolutionBudget`, optional
+        Limits on the work done.
+
+    Returns
+    -------
+    dev_version : `str`
+        The development version of the commit, or a fallback version if
+        the budget runs out.
+    """
+    budget = get_budget(repo_dir, budget)
+    if budget is None:
+        return _find_version_with_backends(repo_dir, version_commit, backend)
+
+    with limit(budget) as meter:
+        try:
+            return _find_version_with_backends(repo_dir, version_commit, backend)
+        except BudgetExceededError as e:
+            return _fall_back_after_overrun(repo_dir, version_commit, meter, e)
+
+
+def _fall_back_after_overrun(repo_dir: str, version_commit: str, meter: Meter, error: Exception) -> str:
+    """Report that the budget ran out and return the fallback version.
+
+    Parameters
+    ----------
+    repo_dir : `str`
+        Path to the relevant Git repository.
+    version_commit : `str`
+        Commit whose version was being calculated.
+    meter : `~lsst_versions._budget.Meter`
+        The meter of the budget.
+    error : `Exception`
+        The exception raised when the budget ran out.
+
+    Returns
+    -------
+    version : `str`
+        The fallback version.
     """
-    if git is None:
-        raise RuntimeError("GitPython package not installed. Unable to determine version.")
-
-    repo = git.Repo(repo_dir)
-
-    releases: Dict[str, Version] = {}
-    major_releases: Dict[int, git.objects.commit.Commit] = {}
-    weeklies: Dict[str, str] = {}
-
-    for tagref in repo.tags:
-        tag_name = str(tagref)
-        _LOG.debug("Testing relevance of tag %s", tag_name)
-        # LSST repos have release versions as either x.y.z version
-        # strings of vx.y.z (with optional rc numbers).
-        # Extract major version numbers from these and also store them
-        # in case the requested commit is actually associated with
-        # a full release.
-        if matches_release := re.match(r"v?(\d+.*)", tag_name):
-            _LOG.debug("Tag %s matches a release.", tag_name)
-
-            version_string = matches_release.group(1)
-            # Assume the version string is parseable as a modern
-            # version. Some packages have odd (old) tags like 2015_10.0
-            # or 6.2-hsc, so skip those as not being relevant.
-            try:
-                parsed = Version(version_string)
-            except InvalidVersion:
-                _LOG.info("Version string rejected: %s", version_string)
-                continue
-
-            # Get the relevant commit from the tag.
-            release = tagref.tag
-            if release is None:
-                # Assume a lightweight tag, so the commit is what
-                # we have to use.
-                release_commit = tagref.commit
-            else:
-                release_commit = release.object
-
-            hexsha = release_commit.hexsha
-            if hexsha in releases:
-                # This commit already has a version number associated with
-                # it. Check if this current version is newer and if so
-                # replace it.
-                if parsed > releases[hexsha]:
-                    releases[hexsha] = parsed
-            else:
-                releases[hexsha] = parsed
-
-            # Assume that only major releases matter when looking through
-            # the history for developer versions.
-            major_releases[int(parsed.major)] = release_commit
-        elif tag_name.startswith("w."):
-            _LOG.debug("Tag %s matches a weekly", tag_name)
-            weekly = tagref.tag
-            if weekly is None:
-                # Lightweight tag.
-                weekly_commit = tagref.commit
-            else:
-                weekly_commit = weekly.object
-
-            # There can be multiple weeklies associated with a single
-            # commit. Retain the newest weekly. Some weekly tags did not
-            # zero pad the week so must be normalized before comparison.
-            if len(tag_name) == 8:
-                tag_name = f"{tag_name[:7]}0{tag_name[-1]}"
-
-            # Store the weeklies associated with the object they are tagging
-            # but only if this weekly is more recent than the one that may
-            # already be stored.
-            hexsha = weekly_commit.hexsha
-            if (previous := weeklies.get(hexsha, None)) and previous > tag_name:
-                continue
-            weeklies[hexsha] = tag_name
-
-    commit = repo.commit(version_commit)
+    with span("budget_fallback", dirname=repo_dir):
+        version = _find_budget_fallback_version(repo_dir)
+    report_overrun(repo_dir, version_commit, meter, str(error), version)
+    return version
+
+
+def _find_budget_fallback_version(dirname: str) -> str:
+    """Return the version to use when the budget runs out.
+
+    Parameters
+    ----------
+    dirname : `str`
+        The directory of the distribution.
+
+    Returns
+    -------
+    version : `str`
+        The public part of the version from the package metadata, or
+        ``0.0.0`` if there is none, with a local label marking it as a
+        fallback.
+    """
+    from packaging.version import InvalidVersion, Version
+
+    base = "0.0.0"
+    if (version := _find_version_from_metadata(dirname)) is not None:
+        try:
+            base = Version(version).public
+        except InvalidVersion:
+            _LOG.debug("Ignoring invalid version %r in the metadata of %s", version, dirname)
+    return f"{base}+{BUDGET_LABEL}"
+
+
+def _find_version_with_backends(repo_dir: str, version_commit: str, backend: Optional[str] = None) -> str:
+    """Calculate the version for the given LSST commit with the configured
+    backends.
+
+    Parameters
+    ----------
+    repo_dir : `str`
+        Path to the relevant Git repository.
+    version_commit : `str`
+        Commit for which the version is to be calculated.
+    backend : `str`, optional
+        Name of the backend to use.
+
+    Returns
+    -------
+    dev_version : `str`
+        The development version of the commit.
+    """
+    name = get_backend_name(repo_dir, backend)
+    if name != CROSS_CHECK:
+        return _calculate_version(open_backend(repo_dir, name), repo_dir, version_commit)
+
+    versions = {
+        name: _calculate_version(open_backend(repo_dir, name), repo_dir, version_commit) for name in BACKENDS
+    }
+    if len(set(versions.values())) != 1:
+        raise RuntimeError(
+            f"Git backends disagree about the version of {version_commit} in repo '{repo_dir}': {versions}"
+        )
+    return versions[DEFAULT_BACKEND]
+
+
+def _calculate_version(backend: GitBackend, repo_dir: str, version_commit: str) -> str:
+    """Calculate the version of a commit using a specific backend.
+
+    Parameters
+    ----------
+    backend : `GitBackend`
+        The repository.
+    repo_dir : `str`
+        Path to the repository, used in messages.
+    version_commit : `str`
+        Commit for which the version is to be calculated.
+
+    Returns
+    -------
+    dev_version : `str`
+        The development version of the commit.
+    """
+    patterns = get_tag_patterns(repo_dir)
+    if patterns is not None:
+        return _calculate_version_streamed(backend, repo_dir, version_commit, patterns)
+
+    with span("load_tags", backend=backend.name):
+        tables = backend.load_tag_tables()
+    releases, weeklies = tables.releases, tables.weeklies
+
+    with span("resolve", backend=backend.name):
+        hexsha = backend.resolve(version_commit)
 
     # if this commit is actually a valid release, use that directly.
-    if (hexsha := commit.hexsha) in releases:
-        _LOG.debug("Requested commit %s matches release %s.", commit.hexsha, releases[hexsha])
+    if hexsha in releases:
+        _LOG.debug("Requested commit %s matches release %s.", hexsha, releases[hexsha])
         return str(releases[hexsha])
 
-    # Scan through all the releases for the first that does not have this
-    # commit as an ancestor.
-    relevant_release = 0
-    for major_release in sorted(major_releases, reverse=True):
-        major_commit = major_releases[major_release]
-        if not repo.is_ancestor(commit, major_commit):
-            relevant_release = major_release
-            break
-
-    if relevant_release == 0:
-        warnings.warn(f"Could not find release tag as ancestor for {commit} in repo '{repo_dir}', using 0.")
+    with span("relevant_release", backend=backend.name):
+        relevant_release = _find_relevant_release(backend, hexsha, tables)
 
     # Look through the parents until we find a weekly commit.
     # The counter can report confusing results if this is being used for
     # an unmerged development branch (and on GitHub a pull request will
     # include an extra commit because it merges the branch for testing).
-    counter = -1
-    weekly_name = ""
-    optional_commit: Optional[git.objects.commit.Commit] = commit
-    while optional_commit:
-        counter += 1
-        if (hexsha := optional_commit.hexsha) in weeklies:
-            weekly_name = weeklies[hexsha]
-            break
-        parents = optional_commit.parents
-        optional_commit = parents[0] if parents else None
+    # The walk is streamed and stops as soon as a weekly, or a commit in
+    # the history index, is found.
+    with span("first_parent_walk", backend=backend.name):
+        counter, weekly_name = backend.find_nearest_weekly(hexsha, weeklies)
 
-    if not weekly_name:
-        # No weekly was found. This must be a very early commit.
-        year, week = "0", "0"
-    else:
-        year, week = weekly_name[2:].split(".")
+    return _make_dev_version(repo_dir, hexsha, relevant_release, weekly_name, counter)
 
-    # Declare the developer version to be an evolution of the current
-    # release but with the year and week in the minor and patchlevel parts.
-    # Alpha versions for weeklies were used initially but once full releases
-    # are made it becomes very difficult for tooling to ever install the
-    # alphas.
-    dev_version = f"{relevant_release}.{year}.{week}{counter:02d}"
 
-    # Convert the version to standard form (this can prevent warnings
-    # coming from setuptools later on). For example 1.0.0a07 is rewritten
-    # as 1.0.0a7.
-    dev_version = str(Version(dev_version))
+def _calculate_version_streamed(
+    backend: GitBackend, repo_dir: str, version_commit: str, patterns: TagPatterns
+) -> str:
+    """Calculate the version of a commit reading only the tags needed.
 
-    _LOG.info(
-        "Using version %s for commit %s derived from weekly %s", dev_version, commit.hexsha, weekly_name
-    )
+    Parameters
+    ----------
+    backend : `GitBackend`
+        The repository.
+    repo_dir : `str`
+        Path to the repository, used in messages.
+    version_commit : `str`
+        Commit for which the version is to be calculated.
+    patterns : `TagPatterns`
+        The release and weekly tags to stream.
 
-    return dev_version
+    Returns
+    -------
+    dev_version : `str`
+        The development version of the commit.
+
+    Notes
+    -----
+    Every tag is classified instead if git lists the releases out of order.
+    """
+    with span("resolve", backend=backend.name):
+        hexsha = backend.resolve(version_commit)
+
+    with span("load_tags", backend=backend.name):
+        release = _stream.find_release(backend.git_dir, hexsha, patterns)
+    if release is not None:
+        _LOG.debug("Requested commit %s matches release %s.", hexsha, release)
+        return release
+
+    with span("relevant_release", backend=backend.name):
+        relevant_release = _stream.find_relevant_release(backend, hexsha, patterns)
+        if relevant_release is None:
+            relevant_release = _find_relevant_release(backend, hexsha, _load_tag_tables(backend, patterns))
+
+    with span("first_parent_walk", backend=backend.name):
+        counter, weekly_name = _stream.find_nearest_weekly(backend, hexsha, patterns)
+
+    return _make_dev_version(repo_dir, hexsha, relevant_release, weekly_name, counter)
 
 
 def _write_version(version: str, version_path: str) -> None:
-    """Write the version information to the specified file."""
-    with open(version_path, "w") as fh:
-        print(
-            f"""__all__ = ["__version__"]
+    """Write the version information to the specified file.
+
+    The file is left untouched if it already has the right content, so
+    that its modification time does not trigger needless rebuilds.
+    """
+    content = f"""__all__ = ["__version__"]
 __version__ = "{version}"
-""",
-            file=fh,
-            end="",
-        )
+"""
+    try:
+        with open(version_path) as fh:
+            if fh.read() == content:
+                _LOG.debug("Version file %s is already up to date.", version_path)
+                return
+    except OSError:
+        pass
+    with open(version_path, "w") as fh:
+        fh.write(content)
 
 
 def _find_version_path(dirname: str = ".") -> Optional[str]:
@@ -248,18 +551,13 @@ def _find_version_path(dirname: str = ".") -> Optional[str]:
         warnings.warn(f"No pyproject.toml file found in {dirname}.")
         return None
 
-    if tomli is None:
-        warnings.warn(  # type: ignore
-            "The tomli package is not installed. Unable to extract version file location."
-        )
+    try:
+        tool = read_tool_config(path)
+    except ImportError:
+        warnings.warn("The tomli package is not installed. Unable to extract version file location.")
         return None
 
-    with open(path) as fh:
-        parsed = tomli.loads(fh.read())
-
-    try:
-        tool = parsed["tool"]["lsst_versions"]
-    except KeyError:
+    if tool is None:
         # No valid tool entry so nothing to do.
         warnings.warn(f"[tool.lsst_versions] entry not found in pyproject.toml at {path}")
         return None
@@ -289,14 +587,7 @@ def _find_version_from_pkginfo(dirname: str = ".") -> Optional[str]:
     if not os.path.exists(pkginfo):
         return None
 
-    content: dict[str, str] = {}
-    with open(pkginfo) as fh:
-        for line in fh:
-            if ": " in line:
-                line = line.strip()
-                k, v = line.split(": ", 1)
-                content[k] = v
-    return content.get("Version", None)
+    return read_metadata_version(pkginfo)[1]
 
 
 def _find_version_from_egg_info(dirname: str = ".") -> Optional[str]:
@@ -357,7 +648,11 @@ def _find_version_from_metadata(dirname: str = ".") -> Optional[str]:
 
 
 def _process_version_writing(
-    dirname: str = ".", write_version: bool = True, fallback: bool = False
+    dirname: str = ".",
+    write_version: bool = True,
+    fallback: bool = False,
+    backend: Optional[str] = None,
+    budget: Optional[ResolutionBudget] = None,
 ) -> Tuple[str, Optional[str]]:
     """Determine the version and, optionally, write it.
 
@@ -373,6 +668,12 @@ def _process_version_writing(
         If `True` and no Git version can be found, an attempt will be made
         to find the version from package metadata. This can be important
         for source distributions that are no longer part of a Git repository.
+    backend : `str`, optional
+        Name of the implementation of the git operations to use. See
+        `find_lsst_version`.
+    budget : `ResolutionBudget`, optional
+        Limits on the work done to find the version from Git. See
+        `find_lsst_version`.
 
     Returns
     -------
@@ -382,24 +683,117 @@ def _process_version_writing(
         Path to the file that was written, or `None` if no version file was
         written.
     """
-    # Find the version file in current working directory.
-    write_to: Optional[str] = None
-    written = None
-    if write_version:
-        write_to = _find_version_path(dirname)
-        if write_to is None:
-            return "<unknown>", written
+    with span("process_version_writing", dirname=dirname):
+        # Find the version file in current working directory.
+        write_to: Optional[str] = None
+        written = None
+        if write_version:
+            with span("find_version_path"):
+                write_to = _find_version_path(dirname)
+            if write_to is None:
+                return "<unknown>", written
+
+        return _determine_version(dirname, write_to, fallback, backend, budget), write_to
+
+
+def _config_fingerprint(
+    dirname: str, backend: Optional[str] = None, budget: Optional[ResolutionBudget] = None
+) -> str:
+    """Summarize the configuration that can change a calculated version.
+
+    Parameters
+    ----------
+    dirname : `str`
+        The directory of the distribution.
+    backend : `str`, optional
+        Name of the backend requested by the caller.
+    budget : `ResolutionBudget`, optional
+        Budget requested by the caller.
+
+    Returns
+    -------
+    fingerprint : `str`
+        A hash of the ``[tool.lsst_versions]`` table of the
+        ``pyproject.toml`` file, which selects the backend, the tag
+        resolution, the tag patterns and the budget, of the environment
+        variables that override them, and of the backend and budget
+        requested by the caller.
+    """
+    try:
+        config = read_tool_config(os.path.join(dirname, "pyproject.toml"))
+    except (OSError, ImportError, ValueError):
+        config = None
+    names = (BACKEND_ENV, BUDGET_SECONDS_ENV, BUDGET_COMMITS_ENV)
+    environment = {name: os.environ.get(name) for name in names}
+    requested = {"backend": backend, "budget": budget}
+    content = json.dumps(
+        {"config": config, "environment": environment, "requested": requested}, sort_keys=True, default=str
+    )
+    return hashlib.sha1(content.encode()).hexdigest()
+
+
+def _determine_version(
+    dirname: str,
+    write_to: Optional[str],
+    fallback: bool,
+    backend: Optional[str] = None,
+    budget: Optional[ResolutionBudget] = None,
+) -> str:
+    """Determine the version of HEAD and write it to a version file.
+
+    Parameters
+    ----------
+    dirname : `str`
+        The directory to use to find a version.
+    write_to : `str` or `None`
+        Path to the version file to write, if any.
+    fallback : `bool`
+        If `True` and no Git version can be found, an attempt will be made
+        to find the version from package metadata.
+    backend : `str`, optional
+        Name of the backend to use.
+    budget : `ResolutionBudget`, optional
+        Limits on the work done to find the version from Git.
+
+    Returns
+    -------
+    version : `str`
+        The version string.
+    """
+    # When writing a version file, a build frontend may ask for the
+    # version several times. It is only calculated again if HEAD or
+    # the tags have moved since the version file was written.
+    git_dir: Optional[str] = None
+    version: Optional[str] = None
+    config = ""
+    if write_to:
+        with span("version_stamp"):
+            with contextlib.suppress(RuntimeError, OSError):
+                git_dir = find_git_dir(dirname)
+            if git_dir is not None:
+                config = _config_fingerprint(dirname, backend, budget)
+                if (version := read_version_stamp(git_dir, write_to, config)) is not None:
+                    _LOG.info("Using version %s recorded for unchanged repository %s", version, dirname)
 
-    # Find the version of HEAD and current directory.
-    version = get_lsst_version(dirname, fallback)
+    if version is None:
+        # Find the version of HEAD and current directory.
+        version = get_lsst_version(dirname, fallback, budget, backend)
+        if git_dir is not None and write_to:
+            write_version_stamp(git_dir, write_to, version, config)
 
-    if write_version and write_to:
-        _write_version(version, write_to)
+    if write_to:
+        with span("write_version"):
+            _write_version(version, write_to)
 
-    return version, write_to
+    return version
 
 
-def get_lsst_version(dirname: str = ".", fallback: bool = True) -> str:
+def get_lsst_version(
+    dirname: str = ".",
+    fallback: bool = True,
+    budget: Optional[ResolutionBudget] = None,
+    backend: Optional[str] = None,
+) -> str:
     """Determine the version and return as string
 
     Parameters
@@ -410,6 +804,12 @@ def get_lsst_version(dirname: str = ".", fallback: bool = True) -> str:
         If `True` and no Git version can be found, an attempt will be made
         to find the version from package metadata. This can be important
         for source distributions that are no longer part of a Git repository.
+    budget : `ResolutionBudget`, optional
+        Limits on the work done to find the version from Git. See
+        `find_lsst_version`.
+    backend : `str`, optional
+        Name of the implementation of the git operations to use. See
+        `find_lsst_version`.
 
     Returns
     -------
@@ -420,12 +820,13 @@ def get_lsst_version(dirname: str = ".", fallback: bool = True) -> str:
     """
     version: Optional[str] = None
     try:
-        version = find_lsst_version(dirname, "HEAD")
+        version = find_lsst_version(dirname, "HEAD", backend, budget)
     except Exception:
         if not fallback:
             raise
     if version is None:
-        version = _find_version_from_metadata(dirname)
+        with span("metadata_fallback", dirname=dirname):
+            version = _find_version_from_metadata(dirname)
         if version is None:
             raise RuntimeError(f"Unable to find a version from Git or metadata within directory {dirname}")
     return version
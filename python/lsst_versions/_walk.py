@@ -0,0 +1,109 @@
+# This file is part of lsst_versions.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# Use of this source code is governed by a 3-clause BSD-style
+# license that can be found in the LICENSE file.
+
+"""Walking first-parent history to find the nearest weekly."""
+
+from __future__ import annotations
+
+__all__ = ("WeeklySearch", "find_nearest_weekly")
+
+import logging
+from typing import Iterable, Mapping, Optional, Tuple
+
+from ._budget import Meter, get_meter
+from ._profile import count
+
+_LOG = logging.getLogger("lsst_versions")
+
+
+class WeeklySearch:
+    """A search for the closest weekly, given first-parent history one
+    commit at a time.
+
+    Parameters
+    ----------
+    weeklies : `~collections.abc.Mapping` [`str`, `str`]
+        The normalized weekly tag associated with each commit.
+    meter : `~lsst_versions._budget.Meter`, optional
+        The meter charged for each commit visited.
+    """
+
+    __slots__ = ("weeklies", "meter", "counter", "weekly_name")
+
+    def __init__(self, weeklies: Mapping[str, str], meter: Optional[Meter] = None):
+        self.weeklies = weeklies
+        self.meter = meter
+        self.counter = -1
+        self.weekly_name = ""
+
+    def visit(self, hexsha: str) -> bool:
+        """Examine the next commit of the history, newest first.
+
+        Parameters
+        ----------
+        hexsha : `str`
+            Hex SHA of the commit.
+
+        Returns
+        -------
+        found : `bool`
+            `True` if the commit is a weekly, and the search is over.
+        """
+        self.counter += 1
+        if self.meter is not None:
+            self.meter.charge()
+        if hexsha in self.weeklies:
+            self.weekly_name = self.weeklies[hexsha]
+            return True
+        return False
+
+    def result(self) -> Tuple[int, str]:
+        """Return the outcome of the search.
+
+        Returns
+        -------
+        counter : `int`
+            The number of first-parent steps from the first commit visited
+            to the weekly, or to the last commit visited if there was none.
+        weekly_name : `str`
+            The weekly that was found, or an empty string.
+        """
+        _LOG.debug("Walked %d commits to find weekly %r", self.counter + 1, self.weekly_name)
+        count("commits_walked", self.counter + 1)
+        return self.counter, self.weekly_name
+
+
+def find_nearest_weekly(history: Iterable[str], weeklies: Mapping[str, str]) -> Tuple[int, str]:
+    """Find the closest weekly in first-parent history.
+
+    Parameters
+    ----------
+    history : `~collections.abc.Iterable` [`str`]
+        Hex SHAs of a commit and its first-parent ancestors, newest first.
+        Iteration stops as soon as a weekly is found so a lazily evaluated
+        walk need not go any further back.
+    weeklies : `~collections.abc.Mapping` [`str`, `str`]
+        The normalized weekly tag associated with each commit.
+
+    Returns
+    -------
+    counter : `int`
+        The number of first-parent steps from the commit to the weekly.
+        If no weekly was found this is the number of steps to the root
+        commit.
+    weekly_name : `str`
+        The weekly that was found, or an empty string.
+    """
+    search = WeeklySearch(weeklies, get_meter())
+    for hexsha in history:
+        if search.visit(hexsha):
+            break
+    return search.result()
@@ -1,8 +1,16 @@
 """Module implementing a version source plugin for the hatch build system."""
 
+import os
+from typing import Dict, Optional, Tuple
+
 from hatchling.plugin import hookimpl
 from hatchling.version.source.plugin.interface import VersionSourceInterface
 
+# Versions already determined by this process, keyed by project root,
+# version file and repository state. Hatch asks for the version several
+# times during a single build.
+_VERSIONS: Dict[Tuple[str, Optional[str], Optional[Tuple[Tuple[str, str], ...]]], str] = {}
+
 
 @hookimpl
 def hatch_register_version_source() -> type["LsstVersionSource"]:
@@ -11,12 +19,45 @@ def hatch_register_version_source() -> type["LsstVersionSource"]:
 
 
 class LsstVersionSource(VersionSourceInterface):
-    """Implement a Hatch Version Source Interface."""
+    """Implement a Hatch Version Source Interface.
+
+    The version file named by ``write_to`` in the ``[tool.lsst_versions]``
+    table of ``pyproject.toml`` is written if present. If Git can not be
+    used, the version is read from package metadata.
+    """
 
     PLUGIN_NAME = "lsst"
 
+    def _find_write_to(self) -> Optional[str]:
+        """Return the path of the version file to write, if any."""
+        from ._config import read_tool_config
+
+        try:
+            config = read_tool_config(os.path.join(self.root, "pyproject.toml"))
+        except (OSError, ImportError, ValueError):
+            return None
+        if not config or not config.get("write_to"):
+            return None
+        return os.path.join(self.root, config["write_to"])
+
     def get_version_data(self) -> dict:
         """Return the project version data."""
-        from ._versions import find_lsst_version
-
-        return dict(version=find_lsst_version())
+        from ._cache import repository_state
+        from ._refs import find_git_dir
+        from ._versions import _determine_version, _write_version
+
+        root = os.path.abspath(self.root)
+        write_to = self._find_write_to()
+        try:
+            state = repository_state(find_git_dir(root))
+        except (RuntimeError, OSError):
+            state = None
+        key = (root, write_to, tuple(sorted(state.items())) if state else None)
+
+        if (version := _VERSIONS.get(key)) is None:
+            version = _VERSIONS[key] = _determine_version(root, write_to, fallback=True)
+        elif write_to:
+            # The file may have been removed since; it is only rewritten if
+            # the content differs.
+            _write_version(version, write_to)
+        return dict(version=version)
@@ -9,24 +9,67 @@
 # Use of this source code is governed by a 3-clause BSD-style
 # license that can be found in the LICENSE file.
 
+import contextlib
+import io
+import json
 import os
+import shutil
+import socket
+import subprocess
 import sys
 import tarfile
+import tempfile
+import threading
 import unittest
+import unittest.mock
+import warnings
 
 try:
     import git
 except ImportError:
     git = None
 
-from lsst_versions import find_lsst_version, get_lsst_version
+from lsst_versions import (
+    ResolutionBudget,
+    add_span_callback,
+    find_lsst_version,
+    find_lsst_version_async,
+    get_lsst_version,
+    get_lsst_version_async,
+    get_lsst_versions,
+    get_lsst_versions_async,
+    iter_lsst_versions,
+    remove_span_callback,
+    resolve_lsst_version,
+    scan_versions,
+)
 
-# Also need an internal function to test the lsst-versions command.
+# Internal functions are needed to test the lsst-versions command, the
+# individual stages of version determination, and pyproject.toml and
+# PKG-INFO parsing.
+from lsst_versions._backend import get_backend_name, open_backend
+from lsst_versions._budget import limit
+from lsst_versions._cache import load_tag_tables, read_version_stamp, write_version_stamp
 from lsst_versions._cmd import _run_command as run_lsst_versions
-
-# And to check pyproject.toml parsing and PKG-INFO parsing.
+from lsst_versions._cmd import _run_index as run_index
+from lsst_versions._cmd import _run_manifest as run_manifest
+from lsst_versions._cmd import _run_range as run_range
+from lsst_versions._cmd import _run_scan as run_scan
+from lsst_versions._cmd import main as lsst_version_main
+from lsst_versions._daemon import VersionServer, request_version
+from lsst_versions._git import is_ancestor, iter_first_parents, iter_tags
+from lsst_versions._graph import load_commit_graph
+from lsst_versions._history import HistoryIndex
+from lsst_versions._history import find_nearest_weekly as find_nearest_weekly_indexed
+from lsst_versions._objects import ObjectReader
+from lsst_versions._objects import iter_first_parents as iter_first_parents_from_objects
+from lsst_versions._profile import TraceRecorder
+from lsst_versions._refs import read_tags, refs_fingerprint
+from lsst_versions._reverse import _find_descendants as find_descendants
+from lsst_versions._tags import RELEASE, WEEKLY, TagRecord, build_tables, classify_tag, parse_release
 from lsst_versions._versions import _find_version_path as find_version_path
 from lsst_versions._versions import _process_version_writing as process_version_writing
+from lsst_versions._walk import find_nearest_weekly
 
 TESTDIR = os.path.abspath(os.path.dirname(__file__))
 GITDIR = os.path.join(TESTDIR, "repo")
@@ -63,6 +106,26 @@ class VersionsTestCase(unittest.TestCase):
         except Exception:
             raise unittest.SkipTest("Git repository for this package is not accessible.")
 
+    def make_clone(self, name: str = "repo") -> str:
+        """Copy the test repository to a temporary directory.
+
+        Parameters
+        ----------
+        name : `str`, optional
+            Name of the copy within the temporary directory, which is
+            removed when the test finishes.
+
+        Returns
+        -------
+        clone : `str`
+            Path to the copy.
+        """
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        clone = os.path.join(tmpdir.name, name)
+        shutil.copytree(GITDIR, clone, symlinks=True)
+        return clone
+
     def test_get_lsst_version(self):
         # test get_lsst_version which returns version for the current directory
         datadir = os.path.join(TESTDIR, "data")
@@ -106,6 +169,703 @@ class VersionsTestCase(unittest.TestCase):
             with self.subTest(tag=tag, expected=expected):
                 self.assertEqual(version, expected)
 
+    def test_backends(self):
+        """Check that the git backends agree and can be selected."""
+        plumbing = open_backend(GITDIR, "plumbing")
+        gitpython = open_backend(GITDIR, "gitpython")
+        self.assertEqual(plumbing.git_dir, gitpython.git_dir)
+        self.assertEqual(list(plumbing.iter_tags()), list(gitpython.iter_tags()))
+        self.assertEqual(plumbing.load_tag_tables(), gitpython.load_tag_tables())
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for rev in ("86427e5", "ea28756", "w.2022.05", "3082cf0", "fed5a45", "HEAD"):
+                with self.subTest(rev=rev):
+                    self.assertEqual(plumbing.resolve(rev), gitpython.resolve(rev))
+                    versions = {
+                        name: find_lsst_version(GITDIR, rev, backend=name)
+                        for name in ("plumbing", "gitpython", "cross-check")
+                    }
+                    self.assertEqual(len(set(versions.values())), 1, versions)
+
+        # A .git file pointing elsewhere is followed but parent directories
+        # are never searched.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, ".git"), "w") as fh:
+                print(f"gitdir: {plumbing.git_dir}", file=fh)
+            self.assertEqual(open_backend(tmpdir, "plumbing").git_dir, plumbing.git_dir)
+        with self.assertRaises(RuntimeError):
+            open_backend(os.path.join(TESTDIR, "data"), "plumbing")
+
+        # The backend is chosen by argument, then environment, then
+        # pyproject.toml.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.assertEqual(get_backend_name(tmpdir), "plumbing")
+            with open(os.path.join(tmpdir, "pyproject.toml"), "w") as fh:
+                print('[tool.lsst_versions]\nbackend = "gitpython"', file=fh)
+            self.assertEqual(get_backend_name(tmpdir), "gitpython")
+            with unittest.mock.patch.dict(os.environ, {"LSST_VERSIONS_BACKEND": "cross-check"}):
+                self.assertEqual(get_backend_name(tmpdir), "cross-check")
+                self.assertEqual(get_backend_name(tmpdir, "plumbing"), "plumbing")
+            with self.assertRaises(ValueError):
+                get_backend_name(tmpdir, "svn")
+
+    def test_tag_streams(self):
+        """Check that streaming sorted tags gives the same versions."""
+        commits = subprocess.run(
+            ["git", "-C", GITDIR, "rev-list", "--all"], check=True, capture_output=True, text=True
+        ).stdout.split()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected = {commit: find_lsst_version(GITDIR, commit) for commit in commits}
+
+        clone = self.make_clone()
+        pyproject = os.path.join(clone, "pyproject.toml")
+        # Replace the link to the shared test configuration.
+        os.remove(pyproject)
+        with open(pyproject, "w") as fh:
+            print('[tool.lsst_versions]\ntag_resolution = "stream"', file=fh)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for commit in commits:
+                with self.subTest(commit=commit):
+                    self.assertEqual(find_lsst_version(clone, commit), expected[commit])
+
+        # Only the newest releases and weeklies are needed for a commit
+        # on main.
+        spans = []
+        add_span_callback(spans.append)
+        try:
+            with unittest.mock.patch("lsst_versions._cache.load_tag_tables") as load:
+                version = find_lsst_version(clone, "3082cf0")
+        finally:
+            remove_span_callback(spans.append)
+        load.assert_not_called()
+        self.assertEqual(version, "3.2022.1001")
+        self.assertLess(spans[-1].counts["tags_seen"], 15)
+        self.assertEqual(spans[-1].counts["commits_walked"], 2)
+
+        # The patterns can be configured.
+        with open(pyproject, "a") as fh:
+            print('release_tag_patterns = ["refs/tags/v2*"]', file=fh)
+        self.assertEqual(find_lsst_version(clone, "3082cf0"), "2.2022.1001")
+
+        # Ranges only use the tags matching the patterns too.
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for hexsha, version in iter_lsst_versions(clone, "da7a09d..main"):
+                self.assertEqual(version, find_lsst_version(clone, hexsha), hexsha)
+
+        with open(pyproject, "w") as fh:
+            print('[tool.lsst_versions]\ntag_resolution = "all"', file=fh)
+        with self.assertRaises(ValueError):
+            find_lsst_version(clone)
+
+    def test_profiling(self):
+        """Check the spans recorded for each phase."""
+        spans = []
+        add_span_callback(spans.append)
+        try:
+            with unittest.mock.patch.dict(os.environ, {"LSST_VERSIONS_CACHE": "0"}):
+                version = find_lsst_version(GITDIR, "3082cf0", backend="plumbing")
+        finally:
+            remove_span_callback(spans.append)
+        self.assertEqual(version, "3.2022.1001")
+        names = [span.name for span in spans]
+        self.assertEqual(names[-1], "find_lsst_version")
+        for name in ("load_tags", "resolve", "relevant_release", "first_parent_walk"):
+            self.assertIn(name, names)
+        root = spans[-1]
+        self.assertEqual(root.depth, 0)
+        self.assertGreater(root.duration, 0)
+        self.assertEqual(root.counts["commits_walked"], 2)
+        self.assertGreater(root.counts["tags_seen"], root.counts["tags_rejected"])
+        self.assertGreater(root.counts["tags_rejected"], 0)
+        self.assertGreater(root.counts["ancestry_checks"], 0)
+        self.assertIn("git_invocations", root.counts)
+
+        # Nothing is recorded without a callback.
+        find_lsst_version(GITDIR, "3082cf0")
+        self.assertEqual(len(names), len(spans))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "trace.json")
+            with TraceRecorder() as recorder:
+                process_version_writing(GITDIR, write_version=False)
+            recorder.write(path)
+            with open(path) as fh:
+                events = json.load(fh)["traceEvents"]
+        self.assertEqual(events[-1]["name"], "process_version_writing")
+        self.assertEqual({event["ph"] for event in events}, {"X"})
+        self.assertIn("commits_walked", events[-1]["args"])
+
+    def test_version_range(self):
+        """Check versions of a range against individual calculation."""
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for rev_range in ("HEAD", "w.2022.05..v3.0.0", "da7a09d..main"):
+                with self.subTest(rev_range=rev_range):
+                    out = io.StringIO()
+                    run_range(GITDIR, rev_range, out)
+                    results = [tuple(line.split()) for line in out.getvalue().splitlines()]
+                    self.assertEqual(results, list(iter_lsst_versions(GITDIR, rev_range)))
+                    self.assertGreater(len(results), 3)
+                    for hexsha, version in results:
+                        self.assertEqual(version, find_lsst_version(GITDIR, hexsha), hexsha)
+
+            # The backend and budget are configured as for single versions.
+            expected = list(iter_lsst_versions(GITDIR, "da7a09d..main"))
+            for backend in ("gitpython", "cross-check"):
+                with self.subTest(backend=backend):
+                    self.assertEqual(list(iter_lsst_versions(GITDIR, "da7a09d..main", backend)), expected)
+            with unittest.mock.patch.dict(os.environ, {"LSST_VERSIONS_BACKEND": "unknown"}):
+                with self.assertRaises(ValueError):
+                    list(iter_lsst_versions(GITDIR, "da7a09d..main"))
+            with self.assertLogs("lsst_versions", level="WARNING"):
+                out = io.StringIO()
+                run_range(GITDIR, "da7a09d..main", out, budget=ResolutionBudget(seconds=0))
+            versions = {line.split()[1] for line in out.getvalue().splitlines()}
+            self.assertEqual(versions, {"0.0.0+budget"})
+
+    def test_version_resolver(self):
+        """Check that the commits with a version can be found."""
+        clone = self.make_clone()
+        commits = [commit for commit, _ in iter_lsst_versions(clone, "main")]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected = {commit: find_lsst_version(clone, commit) for commit in commits}
+
+        # Without an index, with one that stops short of main and with
+        # one that covers it.
+        for cache, indexed in (("0", None), ("1", "main~10"), ("1", "main")):
+            if indexed is not None:
+                run_index(clone, indexed)
+            with unittest.mock.patch.dict(os.environ, {"LSST_VERSIONS_CACHE": cache}):
+                for commit, version in expected.items():
+                    with self.subTest(commit=commit, indexed=indexed):
+                        self.assertIn(commit, resolve_lsst_version(version, clone, "main"))
+
+        # Without an index, history is only walked back to the weekly.
+        backend = open_backend(clone, "plumbing")
+        walked = []
+
+        def walk(hexsha):
+            for commit in iter_first_parents_from_objects(backend.git_dir, hexsha):
+                walked.append(commit)
+                yield commit
+
+        weekly = backend.resolve("w.2022.10")
+        with unittest.mock.patch.dict(os.environ, {"LSST_VERSIONS_CACHE": "0"}):
+            with unittest.mock.patch.object(backend, "iter_first_parents", walk):
+                found = find_descendants(backend, backend.resolve("main"), [(weekly, 2)])
+        self.assertEqual(walked[-1], weekly)
+        self.assertLess(len(walked), len(commits))
+        self.assertEqual(found, [walked[-3]])
+
+        hexsha = subprocess.run(
+            ["git", "-C", clone, "rev-parse", "v3.0.0^{commit}"],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+        self.assertEqual(resolve_lsst_version("3.0.0", clone), [hexsha])
+        self.assertEqual(resolve_lsst_version("v3.0.0", clone), [hexsha])
+        self.assertEqual(resolve_lsst_version("4.0.0", clone), [])
+        self.assertEqual(resolve_lsst_version("3.2022.5300", clone), [])
+        with self.assertRaises(ValueError):
+            resolve_lsst_version("not a version", clone)
+
+    @unittest.skipIf(not hasattr(socket, "AF_UNIX"), "Unix domain sockets not supported.")
+    def test_version_server(self):
+        """Test that versions can be obtained from a running server."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            socket_path = os.path.join(tmpdir, "lsst_versions.sock")
+            # No server yet.
+            self.assertIsNone(request_version(GITDIR, socket_path=socket_path))
+
+            with VersionServer(socket_path) as server:
+                thread = threading.Thread(target=server.serve_forever)
+                thread.start()
+                try:
+                    with self.assertRaises(RuntimeError):
+                        VersionServer(socket_path)
+
+                    self.assertEqual(request_version(GITDIR, socket_path=socket_path), "3.2022.1037")
+                    with self.assertLogs("lsst_versions", level="DEBUG") as cm:
+                        version = request_version(GITDIR, "v3.0.0", socket_path=socket_path)
+                        self.assertEqual(version, "3.0.0")
+                        version = request_version(GITDIR, "v3.0.0", socket_path=socket_path)
+                        self.assertEqual(version, "3.0.0")
+                    self.assertIn("Using cached version 3.0.0", "\n".join(cm.output))
+
+                    # A change of configuration is not answered from the
+                    # cache.
+                    with unittest.mock.patch.dict(os.environ, {"LSST_VERSIONS_BACKEND": "gitpython"}):
+                        with self.assertLogs("lsst_versions", level="DEBUG") as cm:
+                            version = request_version(GITDIR, "v3.0.0", socket_path=socket_path)
+                            self.assertEqual(version, "3.0.0")
+                        self.assertNotIn("Using cached version", "\n".join(cm.output))
+
+                    # Errors are reported so that the client can do the work.
+                    self.assertIsNone(request_version(GITDIR, "unknown", socket_path=socket_path))
+                    self.assertIsNone(request_version(TESTDIR, socket_path=socket_path))
+
+                    # The public API uses the server when configured.
+                    with unittest.mock.patch.dict(os.environ, {"LSST_VERSIONS_SOCKET": socket_path}):
+                        with unittest.mock.patch.object(
+                            server, "find_version", return_value="99.0.0"
+                        ) as find_version:
+                            self.assertEqual(get_lsst_version(GITDIR), "99.0.0")
+                        find_version.assert_called_once_with(GITDIR, "HEAD")
+                finally:
+                    server.shutdown()
+                    thread.join()
+            self.assertFalse(os.path.exists(socket_path))
+
+            # The public API works without a server.
+            with unittest.mock.patch.dict(os.environ, {"LSST_VERSIONS_SOCKET": socket_path}):
+                self.assertEqual(get_lsst_version(GITDIR), "3.2022.1037")
+
+    def test_tag_listing(self):
+        """Check that bulk tag resolution matches GitPython."""
+        repo = git.Repo(GITDIR)
+        expected = {}
+        for tagref in repo.tags:
+            tag = tagref.tag
+            expected[str(tagref)] = (
+                tagref.commit.hexsha if tag is None else tag.object.hexsha,
+                None if tag is None else tag.hexsha,
+            )
+        found = {name: (commit, tag) for name, commit, tag in iter_tags(repo.git_dir)}
+        self.assertEqual(found, expected)
+
+    def test_ref_reader(self):
+        """Check that reading references directly matches git."""
+        expected = list(iter_tags(os.path.join(GITDIR, ".git")))
+        self.assertEqual(read_tags(os.path.join(GITDIR, ".git")), expected)
+
+        clone = self.make_clone()
+        git_dir = os.path.join(clone, ".git")
+
+        # Loose references to tag objects that are only in a pack
+        # need git to peel them.
+        subprocess.run(["git", "-C", clone, "repack", "-adq"], check=True)
+        subprocess.run(["git", "-C", clone, "prune-packed"], check=True)
+        self.assertEqual(read_tags(git_dir), expected)
+
+        # A tag being written by git is not read until it is complete.
+        fingerprint = refs_fingerprint(git_dir)
+        with open(os.path.join(git_dir, "refs", "tags", "w.2030.01.lock"), "w") as fh:
+            print(expected[0][1], file=fh)
+        self.assertEqual(read_tags(git_dir), expected)
+        self.assertEqual(refs_fingerprint(git_dir), fingerprint)
+        os.remove(os.path.join(git_dir, "refs", "tags", "w.2030.01.lock"))
+
+        # Packed references carry the peeled commits.
+        subprocess.run(["git", "-C", clone, "pack-refs", "--all"], check=True)
+        self.assertFalse(os.listdir(os.path.join(git_dir, "refs", "tags")))
+        self.assertEqual(read_tags(git_dir), expected)
+
+    def test_tag_index(self):
+        """Check that the persistent tag index is refreshed incrementally."""
+        clone = self.make_clone()
+        git_dir = os.path.join(clone, ".git")
+        shutil.rmtree(os.path.join(git_dir, "lsst_versions"), ignore_errors=True)
+
+        with self.assertLogs("lsst_versions", level="DEBUG") as cm:
+            tables = load_tag_tables(git_dir)
+        self.assertIn("Classified 16 new or changed tags out of 16.", "\n".join(cm.output))
+        self.assertTrue(os.path.exists(os.path.join(git_dir, "lsst_versions", "tags.json")))
+
+        # Nothing changed so the index is used directly.
+        with self.assertLogs("lsst_versions", level="DEBUG") as cm:
+            self.assertEqual(load_tag_tables(git_dir), tables)
+        self.assertIn("Using cached tag index", "\n".join(cm.output))
+
+        # A new weekly is the only tag that needs classifying.
+        subprocess.run(["git", "-C", clone, "tag", "w.2022.11"], check=True)
+        with self.assertLogs("lsst_versions", level="DEBUG") as cm:
+            tables = load_tag_tables(git_dir)
+        self.assertIn("Classified 1 new or changed tags out of 17.", "\n".join(cm.output))
+        head = subprocess.run(
+            ["git", "-C", clone, "rev-parse", "HEAD"], check=True, capture_output=True, text=True
+        ).stdout.strip()
+        self.assertEqual(tables.weeklies[head], "w.2022.11")
+        self.assertEqual(find_lsst_version(clone), "3.2022.1100")
+
+    def test_tag_tables(self):
+        """Check the compact tables built from classified tags."""
+        commit, other = "a" * 40, "b" * 40
+        with unittest.mock.patch("packaging.version.Version", side_effect=AssertionError) as version:
+            records = [
+                classify_tag(name, commit)
+                for name in ("1.0.0-rc.1", "2015_10.0", "w.2022.1", "w.2022.10", "w.latest")
+            ]
+            records.append(classify_tag("v2.0", other))
+            tables = build_tables(records)
+        # Versions are only needed once releases are compared or used.
+        version.assert_not_called()
+        self.assertEqual(
+            [(record.kind, record.value, record.major) for record in records],
+            [
+                (RELEASE, "1.0.0-rc.1", 1),
+                ("", "", 0),
+                (WEEKLY, "w.2022.01", 0),
+                (WEEKLY, "w.2022.10", 0),
+                ("", "", 0),
+                (RELEASE, "2.0", 2),
+            ],
+        )
+        self.assertEqual(TagRecord(*list(records[0])), records[0])
+        self.assertFalse(hasattr(records[0], "__dict__"))
+
+        self.assertEqual(tables.releases[commit], "1.0.0rc1")
+        self.assertEqual(tables.releases.get(other), "2.0")
+        self.assertEqual(tables.weeklies[commit], "w.2022.10")
+        self.assertNotIn(other, tables.weeklies)
+        self.assertNotIn("not a sha", tables.weeklies)
+        self.assertEqual(tables.major_releases, {1: commit, 2: other})
+        self.assertEqual(tables.major_tags, {1: "1.0.0-rc.1", 2: "v2.0"})
+
+        # The newest of several releases of one commit is used.
+        tables = build_tables([classify_tag(name, commit) for name in ("v1.0.0", "1.0.0rc2", "v1.1")])
+        self.assertEqual(tables.releases[commit], "1.1")
+
+    def test_release_parser(self):
+        """Check that parsed releases agree with packaging."""
+        from packaging.version import Version
+
+        versions = (
+            "1.2.3",
+            "01.2.3",
+            "1.2.3rc1",
+            "1.2.3rc10",
+            "1.2.10",
+            "10.0.0",
+            "1.2.3.4",
+            "1.2",
+            "1.2.3RC2",
+        )
+        for version in versions:
+            with self.subTest(version=version):
+                record = classify_tag(f"v{version}", "a" * 40)
+                self.assertEqual(record.major, Version(version).major)
+                tables = build_tables([record])
+                self.assertEqual(tables.releases["a" * 40], str(Version(version)))
+            for other in versions:
+                with self.subTest(version=version, other=other):
+                    tables = build_tables([classify_tag(name, "a" * 40) for name in (version, other)])
+                    self.assertEqual(tables.releases["a" * 40], str(max(Version(version), Version(other))))
+
+        self.assertEqual(parse_release("1.2.3rc1"), (1, 2, 3, 0, 1))
+        self.assertLess(parse_release("1.2.3rc10"), parse_release("1.2.3"))
+        self.assertIsNone(parse_release("1.2"))
+        self.assertIsNone(parse_release("1.2.3-hsc"))
+
+    def test_first_parent_walk(self):
+        """Check the streamed walk against following GitPython parents."""
+        repo = git.Repo(GITDIR)
+        git_dir = os.path.join(GITDIR, ".git")
+        weeklies = load_tag_tables(git_dir).weeklies
+        for commit in repo.iter_commits("--all"):
+            counter = -1
+            weekly_name = ""
+            optional_commit = commit
+            while optional_commit:
+                counter += 1
+                if optional_commit.hexsha in weeklies:
+                    weekly_name = weeklies[optional_commit.hexsha]
+                    break
+                optional_commit = optional_commit.parents[0] if optional_commit.parents else None
+            with self.subTest(commit=commit.hexsha):
+                history = iter_first_parents(git_dir, commit.hexsha)
+                self.assertEqual(find_nearest_weekly(history, weeklies), (counter, weekly_name))
+                history.close()
+
+    def test_object_reader(self):
+        """Check parents read from loose objects and packs against git."""
+        clone = self.make_clone()
+        git_dir = os.path.join(clone, ".git")
+
+        def run(*args):
+            return subprocess.run(
+                ["git", "-C", clone, *args], check=True, capture_output=True, text=True
+            ).stdout.strip()
+
+        expected = {
+            line.split()[0]: line.split()[1:] for line in run("rev-list", "--parents", "--all").splitlines()
+        }
+        for layout in ("loose", "packed", "removed pack"):
+            if layout == "packed":
+                run("repack", "-a", "-d", "-q")
+                run("prune-packed")
+                loose = [os.path.join(git_dir, "objects", hexsha[:2], hexsha[2:]) for hexsha in expected]
+                self.assertFalse(any(map(os.path.exists, loose)))
+            elif layout == "removed pack":
+                # A pack that can not be examined is skipped.
+                os.symlink("missing.idx", os.path.join(git_dir, "objects", "pack", "pack-gone.idx"))
+            reader = ObjectReader(git_dir)
+            try:
+                with self.subTest(layout=layout):
+                    self.assertEqual({hexsha: reader.parents(hexsha) for hexsha in expected}, expected)
+                    self.assertIsNone(reader.parents("0" * 40))
+            finally:
+                reader.close()
+
+        # The walk is completed by git from any commit that can not be
+        # read.
+        head = run("rev-parse", "HEAD")
+        walk = run("rev-list", "--first-parent", "HEAD").split()
+        with unittest.mock.patch.object(
+            ObjectReader, "parents", side_effect=[expected[head], expected[walk[1]], None]
+        ):
+            self.assertEqual(list(iter_first_parents_from_objects(git_dir, head)), walk)
+
+    def test_commit_graph(self):
+        """Check that ancestry from the commit-graph matches git."""
+        env = dict(
+            os.environ,
+            GIT_AUTHOR_NAME="Test",
+            GIT_AUTHOR_EMAIL="test@example.com",
+            GIT_COMMITTER_NAME="Test",
+            GIT_COMMITTER_EMAIL="test@example.com",
+        )
+        clone = self.make_clone()
+        git_dir = os.path.join(clone, ".git")
+
+        def run(*args):
+            return subprocess.run(
+                ["git", "-C", clone, *args], check=True, env=env, capture_output=True, text=True
+            ).stdout.strip()
+
+        # Add an octopus merge so that the extra edge list is used.
+        branches = []
+        for start in ("v2.0.0", "v3.0.0", "w.2022.10"):
+            branch = f"b{start}"
+            run("checkout", "-q", "-b", branch, start)
+            run("commit", "-q", "--allow-empty", "-m", f"Side {start}")
+            branches.append(branch)
+        run("checkout", "-q", "main")
+        run("merge", "-q", "--no-edit", *branches)
+
+        # Versions calculated by asking git about release containment.
+        commits = run("rev-list", "--all").split()
+        self.assertIsNone(load_commit_graph(git_dir))
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            versions = [find_lsst_version(clone, commit) for commit in commits]
+
+        graph = load_commit_graph(git_dir, allow_write=True)
+        self.assertIsNotNone(graph)
+        self.assertEqual(graph.count, len(commits))
+        for ancestor in commits[::3]:
+            for rev in commits[::2]:
+                with self.subTest(ancestor=ancestor, rev=rev):
+                    self.assertEqual(graph.is_ancestor(ancestor, rev), is_ancestor(git_dir, ancestor, rev))
+            with self.subTest(ancestor=ancestor):
+                self.assertEqual(
+                    graph.containing(ancestor, commits[::2]),
+                    {rev for rev in commits[::2] if is_ancestor(git_dir, ancestor, rev)},
+                )
+        graph.close()
+
+        # The same versions come from the commit-graph.
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            self.assertEqual([find_lsst_version(clone, commit) for commit in commits], versions)
+            # Versions of commits on a branch from an old release change
+            # major release part way through the range.
+            for branch in branches:
+                for hexsha, version in iter_lsst_versions(clone, branch):
+                    self.assertEqual(version, versions[commits.index(hexsha)])
+
+        # A split commit-graph covering a new commit.
+        run("commit", "-q", "--allow-empty", "-m", "New")
+        head = run("rev-parse", "HEAD")
+        self.assertIsNone(load_commit_graph(git_dir).is_ancestor(commits[-1], head))
+        run("commit-graph", "write", "--reachable", "--split=no-merge")
+        graph = load_commit_graph(git_dir)
+        self.assertTrue(graph.is_ancestor(commits[-1], head))
+        self.assertFalse(graph.is_ancestor(head, commits[0]))
+        self.assertEqual(graph.hexsha(graph.position(head)), head)
+        graph.close()
+        self.assertEqual(find_lsst_version(clone, "bv2.0.0"), "3.2022.702")
+
+    def test_history_index(self):
+        """Check versions answered from the first-parent history index."""
+        env = dict(
+            os.environ,
+            GIT_AUTHOR_NAME="Test",
+            GIT_AUTHOR_EMAIL="test@example.com",
+            GIT_COMMITTER_NAME="Test",
+            GIT_COMMITTER_EMAIL="test@example.com",
+        )
+        clone = self.make_clone()
+        git_dir = os.path.join(clone, ".git")
+
+        def run(*args):
+            return subprocess.run(
+                ["git", "-C", clone, *args], check=True, env=env, capture_output=True, text=True
+            ).stdout.strip()
+
+        def versions(commits, cache="1"):
+            with unittest.mock.patch.dict(os.environ, {"LSST_VERSIONS_CACHE": cache}):
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    return [find_lsst_version(clone, commit, backend="plumbing") for commit in commits]
+
+        # Branches that are not part of the indexed history.
+        for start in ("v2.0.0", "w.2022.10"):
+            run("checkout", "-q", "-b", f"b{start}", start)
+            run("commit", "-q", "--allow-empty", "-m", f"Side {start}")
+        run("checkout", "-q", "main")
+
+        commits = run("rev-list", "--all").split()
+        expected = versions(commits, cache="0")
+        self.assertEqual(run_index(clone, "main"), 51)
+        self.assertEqual(versions(commits), expected)
+        index = HistoryIndex(os.path.join(git_dir, "lsst_versions", "first_parents.idx"))
+        self.assertEqual(index.count, 51)
+        self.assertEqual(index.tip, run("rev-parse", "main"))
+        self.assertTrue(index.boundaries)
+
+        # The weeklies are found by bisection over depths that are only
+        # found once for the same tags.
+        weeklies = load_tag_tables(git_dir).weeklies
+        self.assertIs(load_tag_tables(git_dir).weeklies, weeklies)
+        chain = run("rev-list", "--first-parent", "main").split()
+        for depth in range(index.count):
+            self.assertEqual(
+                index.nearest_weekly(depth, weeklies), find_nearest_weekly(chain[-1 - depth :], weeklies)
+            )
+        self.assertIs(index.weekly_depths(weeklies)[0], index.weekly_depths(weeklies)[0])
+        index.close()
+
+        # A commit in the index needs no walk and no git.
+        spans = []
+        add_span_callback(spans.append)
+        try:
+            versions(["HEAD"])
+        finally:
+            remove_span_callback(spans.append)
+        counts = {span.name: span.counts for span in spans}
+        self.assertEqual(counts["first_parent_walk"].get("commits_walked", 0), 0)
+        self.assertNotIn("git_invocations", counts["find_lsst_version"])
+
+        # New commits are added to the index once walked.
+        for i in range(3):
+            run("commit", "-q", "--allow-empty", "-m", f"New {i}")
+        self.assertEqual(versions(["HEAD"]), versions(["HEAD"], cache="0"))
+        index = HistoryIndex(os.path.join(git_dir, "lsst_versions", "first_parents.idx"))
+        self.assertEqual(index.count, 54)
+        self.assertEqual(index.depth(run("rev-parse", "HEAD")), 53)
+        self.assertEqual(index.branch, "refs/heads/main")
+        index.close()
+        self.assertEqual(versions(commits), expected)
+
+        def index_count():
+            index = HistoryIndex(os.path.join(git_dir, "lsst_versions", "first_parents.idx"))
+            try:
+                return index.count
+            finally:
+                index.close()
+
+        # A feature branch reaching the tip of the index does not extend
+        # it, so main still can.
+        run("checkout", "-q", "-b", "feature")
+        run("commit", "-q", "--allow-empty", "-m", "Feature")
+        self.assertEqual(versions(["feature"]), versions(["feature"], cache="0"))
+        self.assertEqual(index_count(), 54)
+        run("checkout", "-q", "main")
+        run("commit", "-q", "--allow-empty", "-m", "Main")
+        self.assertEqual(versions(["HEAD"]), versions(["HEAD"], cache="0"))
+        self.assertEqual(index_count(), 55)
+
+        # The walk stops at a weekly, so a budget is not spent on
+        # commits beyond it.
+        run("commit", "-q", "--allow-empty", "-m", "Weekly")
+        run("tag", "w.2030.01")
+        run("commit", "-q", "--allow-empty", "-m", "After weekly")
+        head = run("rev-parse", "HEAD")
+        with limit(ResolutionBudget(commits=2)):
+            found = find_nearest_weekly_indexed(
+                git_dir,
+                head,
+                load_tag_tables(git_dir).weeklies,
+                lambda commit: iter_first_parents_from_objects(git_dir, commit),
+            )
+        self.assertEqual(found, (1, "w.2030.01"))
+        self.assertEqual(index_count(), 55)
+        self.assertEqual(versions(["HEAD"]), versions(["HEAD"], cache="0"))
+        self.assertEqual(index_count(), 57)
+
+    def test_shared_caches(self):
+        """Check that worktrees and clones with alternates share caches."""
+        env = dict(
+            os.environ,
+            GIT_AUTHOR_NAME="Test",
+            GIT_AUTHOR_EMAIL="test@example.com",
+            GIT_COMMITTER_NAME="Test",
+            GIT_COMMITTER_EMAIL="test@example.com",
+        )
+        clone = self.make_clone()
+        tmpdir = os.path.dirname(clone)
+        git_dir = os.path.join(clone, ".git")
+        shutil.rmtree(os.path.join(git_dir, "lsst_versions"), ignore_errors=True)
+
+        def run(repo, *args):
+            return subprocess.run(
+                ["git", "-C", repo, *args], check=True, env=env, capture_output=True, text=True
+            ).stdout.strip()
+
+        load_tag_tables(git_dir)
+        self.assertEqual(run_index(clone, "main"), 51)
+        run(clone, "commit-graph", "write", "--reachable")
+
+        # A worktree uses the caches of the repository.
+        worktree = os.path.join(tmpdir, "worktree")
+        run(clone, "worktree", "add", "-q", "--detach", worktree, "3082cf0")
+        self.assertEqual(find_lsst_version(worktree), "3.2022.1001")
+        self.assertEqual(os.listdir(os.path.join(git_dir, "worktrees", "worktree")).count("lsst_versions"), 0)
+
+        # A clone borrowing the objects starts from the caches of the
+        # repository it borrows from.
+        shared = os.path.join(tmpdir, "shared")
+        subprocess.run(["git", "clone", "-q", "--shared", clone, shared], check=True, capture_output=True)
+        shared_git_dir = os.path.join(shared, ".git")
+        with self.assertLogs("lsst_versions", level="DEBUG") as cm:
+            self.assertEqual(load_tag_tables(shared_git_dir), load_tag_tables(git_dir))
+        self.assertIn("Classified 0 new or changed tags out of 16.", "\n".join(cm.output))
+        graph = load_commit_graph(shared_git_dir, allow_write=False)
+        self.assertIsNotNone(graph)
+        graph.close()
+
+        spans = []
+        add_span_callback(spans.append)
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                version = find_lsst_version(shared, backend="plumbing")
+        finally:
+            remove_span_callback(spans.append)
+        self.assertEqual(version, find_lsst_version(clone, "main"))
+        counts = {span.name: span.counts for span in spans}
+        self.assertEqual(counts["first_parent_walk"].get("commits_walked", 0), 0)
+        self.assertNotIn("git_invocations", counts["find_lsst_version"])
+
+        # Extending the history index writes one of its own.
+        run(shared, "commit", "-q", "--allow-empty", "-m", "New")
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            find_lsst_version(shared, backend="plumbing")
+        index = HistoryIndex(os.path.join(shared_git_dir, "lsst_versions", "first_parents.idx"))
+        self.assertEqual(index.count, 52)
+        index.close()
+        index = HistoryIndex(os.path.join(git_dir, "lsst_versions", "first_parents.idx"))
+        self.assertEqual(index.count, 51)
+        index.close()
+
     def test_version_writing(self):
         """Test that a version file can be written."""
         version_file = "version_test.py"
@@ -130,11 +890,207 @@ class VersionsTestCase(unittest.TestCase):
         # Now write the file.
         with self.assertLogs("lsst_versions", level="INFO") as cm:
             version = run_lsst_versions(GITDIR, True)
-        self.assertEqual(len(cm.output), 3, cm.output)
+        # Rejected tags are only reported when the tag index is built.
+        self.assertIn("Using version 3.2022.1037", cm.output[-2])
         self.assertRegex(cm.output[-1], f"Written version file to .*{version_file}$")
         self.assertEqual(version, "3.2022.1037")
         self.assertTrue(os.path.exists(version_path))
 
+        # Later calls use the recorded version without determining it
+        # again, and leave an up-to-date file untouched.
+        os.utime(version_path, (0, 0))
+        with unittest.mock.patch(
+            "lsst_versions._versions.get_lsst_version", side_effect=AssertionError("Recalculated")
+        ):
+            version, written = process_version_writing(GITDIR, True)
+        self.assertEqual(version, "3.2022.1037")
+        self.assertEqual(os.stat(version_path).st_mtime, 0)
+
+        # The version is determined again if the configuration changes.
+        with unittest.mock.patch.dict(os.environ, {"LSST_VERSIONS_BACKEND": "gitpython"}):
+            with unittest.mock.patch("lsst_versions._versions.get_lsst_version", return_value="9.9.9"):
+                version, _ = process_version_writing(GITDIR, True)
+        self.assertEqual(version, "9.9.9")
+
+        # A fallback found when the budget ran out is never recorded.
+        git_dir = os.path.join(GITDIR, ".git")
+        write_version_stamp(git_dir, version_path, "0.0.0+budget", "")
+        self.assertIsNone(read_version_stamp(git_dir, version_path, ""))
+
+        # Without the cache the version is always determined.
+        with unittest.mock.patch.dict(os.environ, {"LSST_VERSIONS_CACHE": "0"}):
+            with unittest.mock.patch("lsst_versions._versions.get_lsst_version", return_value="9.9.9"):
+                version, _ = process_version_writing(GITDIR, True)
+        self.assertEqual(version, "9.9.9")
+        self.assertNotEqual(os.stat(version_path).st_mtime, 0)
+
+        # The recorded version is still valid and is written again.
+        version, _ = process_version_writing(GITDIR, True)
+        self.assertEqual(version, "3.2022.1037")
+        with open(version_path) as fh:
+            self.assertIn('"3.2022.1037"', fh.read())
+
+    def test_hatch_version_source(self):
+        """Test the Hatch version source plugin."""
+        try:
+            from lsst_versions import hatch
+        except ImportError:
+            raise unittest.SkipTest("hatchling is not installed") from None
+
+        version_path = os.path.join(GITDIR, "version_test.py")
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(version_path)
+        hatch._VERSIONS.clear()
+
+        source = hatch.LsstVersionSource(GITDIR, {"source": "lsst"})
+        self.assertEqual(source.get_version_data(), {"version": "3.2022.1037"})
+        self.assertTrue(os.path.exists(version_path))
+
+        # Later requests in the same build reuse the version and only
+        # restore the version file if it has gone.
+        os.remove(version_path)
+        with unittest.mock.patch(
+            "lsst_versions._versions._determine_version", side_effect=AssertionError("Recalculated")
+        ):
+            self.assertEqual(source.get_version_data(), {"version": "3.2022.1037"})
+        self.assertTrue(os.path.exists(version_path))
+
+        # Package metadata is used when there is no repository.
+        source = hatch.LsstVersionSource(os.path.join(TESTDIR, "data", "something.egg-info"), {})
+        self.assertEqual(source.get_version_data(), {"version": "1.1.0"})
+
+    def test_command_line(self):
+        """Test the arguments of the command."""
+
+        def run(*argv):
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                lsst_version_main(list(argv))
+            return out.getvalue().strip()
+
+        # A package whose path is the name of a subcommand.
+        clone = self.make_clone("index")
+        cwd = os.getcwd()
+        os.chdir(os.path.dirname(clone))
+        try:
+            with unittest.mock.patch.dict(os.environ):
+                for name in ("LSST_VERSIONS_BACKEND", "LSST_VERSIONS_BUDGET_COMMITS"):
+                    os.environ.pop(name, None)
+                environment = dict(os.environ)
+                self.assertEqual(run("./index"), "3.2022.1037")
+                self.assertEqual(run("--", "index"), "3.2022.1037")
+                self.assertEqual(run("--backend", "gitpython", "./index"), "3.2022.1037")
+                with self.assertLogs("lsst_versions", level="WARNING"):
+                    self.assertEqual(run("--budget-commits", "1", "./index"), "0.0.0+budget")
+                # The options are passed on, not left in the environment.
+                self.assertEqual(dict(os.environ), environment)
+        finally:
+            os.chdir(cwd)
+
+    def test_multiple_versions(self):
+        """Test that many packages can be versioned in one call."""
+        datadir = os.path.join(TESTDIR, "data")
+        dirnames = [
+            GITDIR,
+            os.path.join(datadir, "something.egg-info"),
+            os.path.join(datadir, "no-pyproject"),
+        ]
+        results = {result.path: result for result in get_lsst_versions(dirnames * 3, max_workers=2)}
+        self.assertEqual(results[GITDIR].version, "3.2022.1037")
+        self.assertEqual(results[dirnames[1]].version, "1.1.0")
+        self.assertIsNone(results[dirnames[2]].version)
+        self.assertIn("Unable to find a version", results[dirnames[2]].error)
+
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as fh:
+            print(f"# Packages\n{dirnames[1]}\n\n{dirnames[2]}", file=fh, flush=True)
+            out = io.StringIO()
+            with self.assertLogs("lsst_versions", level="WARNING"):
+                n_failed = run_manifest([GITDIR], fh.name, False, 2, out)
+        self.assertEqual(n_failed, 2)
+        manifest = {entry["path"]: entry for entry in map(json.loads, out.getvalue().splitlines())}
+        self.assertEqual(set(manifest), set(dirnames))
+        self.assertEqual(manifest[GITDIR]["version"], "3.2022.1037")
+        self.assertIsNone(manifest[GITDIR]["error"])
+        # The command does not fall back to package metadata.
+        self.assertIsNone(manifest[dirnames[1]]["version"])
+
+    def test_async_versions(self):
+        """Test versions determined from an event loop."""
+        import asyncio
+
+        revs = ("86427e5", "ea28756", "w.2022.05", "v3.0.0", "3082cf0", "fed5a45", "HEAD")
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected = [find_lsst_version(GITDIR, rev) for rev in revs]
+
+            async def find_all():
+                semaphore = asyncio.Semaphore(2)
+                return await asyncio.gather(
+                    *(find_lsst_version_async(GITDIR, rev, semaphore=semaphore) for rev in revs)
+                )
+
+            self.assertEqual(asyncio.run(find_all()), expected)
+
+        # A timeout is reported unless package metadata is available.
+        datadir = os.path.join(TESTDIR, "data")
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(get_lsst_version_async(GITDIR, fallback=False, timeout=0))
+        self.assertEqual(
+            asyncio.run(get_lsst_version_async(os.path.join(datadir, "something.egg-info"))), "1.1.0"
+        )
+
+        async def get_all(dirnames, **kwargs):
+            return {result.path: result async for result in get_lsst_versions_async(dirnames, **kwargs)}
+
+        dirnames = [GITDIR, os.path.join(datadir, "no-pyproject")]
+        results = asyncio.run(get_all(dirnames * 3, max_concurrency=2))
+        self.assertEqual(results[GITDIR].version, "3.2022.1037")
+        self.assertIsNone(results[dirnames[1]].version)
+        self.assertIn("Unable to find a version", results[dirnames[1]].error)
+        results = asyncio.run(get_all([GITDIR], fallback=False, timeout=0))
+        self.assertIn("Timed out", results[GITDIR].error)
+
+        # Files are read in worker threads, not the event loop.
+        def load_in_thread(git_dir):
+            self.assertIsNot(threading.current_thread(), threading.main_thread())
+            return load_tag_tables(git_dir)
+
+        with unittest.mock.patch("lsst_versions._async.load_tag_tables", side_effect=load_in_thread) as load:
+            self.assertEqual(asyncio.run(find_lsst_version_async(GITDIR, "3082cf0")), "3.2022.1001")
+        load.assert_called_once()
+
+        # The configuration is honored as for find_lsst_version.
+        clone = self.make_clone()
+        run_index(clone, "main~10")
+        pyproject = os.path.join(clone, "pyproject.toml")
+        os.remove(pyproject)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            for config in ("", 'tag_resolution = "stream"', 'backend = "gitpython"'):
+                with open(pyproject, "w") as fh:
+                    print(f"[tool.lsst_versions]\n{config}", file=fh)
+                for rev, version in zip(revs, expected):
+                    with self.subTest(config=config, rev=rev):
+                        self.assertEqual(asyncio.run(find_lsst_version_async(clone, rev)), version)
+
+        with unittest.mock.patch.dict(os.environ, {"LSST_VERSIONS_CACHE": "0"}):
+            for budget in (ResolutionBudget(commits=1), ResolutionBudget(seconds=0)):
+                with self.subTest(budget=budget):
+                    with self.assertLogs("lsst_versions", level="WARNING") as cm:
+                        version = asyncio.run(
+                            find_lsst_version_async(clone, "HEAD", backend="plumbing", budget=budget)
+                        )
+                    self.assertEqual(version, "0.0.0+budget")
+                    self.assertIn("budget_exceeded", [getattr(r, "event", None) for r in cm.records])
+                    # The directory level functions give the same
+                    # fallback rather than the package metadata.
+                    with self.assertLogs("lsst_versions", level="WARNING"):
+                        version = asyncio.run(get_lsst_version_async(clone, budget=budget))
+                    self.assertEqual(version, "0.0.0+budget")
+                    with self.assertLogs("lsst_versions", level="WARNING"):
+                        results = asyncio.run(get_all([clone], backend="plumbing", budget=budget))
+                    self.assertEqual(results[clone].version, "0.0.0+budget")
+
     def test_pyproject_finding(self):
         """Test that we can find failure modes in pyproject.toml."""
         datadir = os.path.join(TESTDIR, "data")
@@ -154,6 +1110,49 @@ class VersionsTestCase(unittest.TestCase):
         self.assertIsNone(path)
         self.assertIn("no write_to setting", str(cm.warning))
 
+    def test_import_cost(self):
+        """Test that importing and the setuptools hook stay lightweight."""
+        script = """
+import json, sys, warnings
+import lsst_versions
+heavy = (
+    "asyncio",
+    "git",
+    "packaging",
+    "tomli",
+    "tomllib",
+    "lsst_versions._versions",
+    "lsst_versions._backend",
+    "lsst_versions._cache",
+    "lsst_versions._history",
+    "lsst_versions._objects",
+    "lsst_versions._graph",
+)
+loaded = [name for name in heavy if name in sys.modules]
+hook_heavy = ("asyncio", "git", "packaging", "tomli")
+
+class Metadata:
+    version = None
+
+class Distribution:
+    metadata = Metadata()
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    lsst_versions.infer_version_for_setuptools(Distribution())
+hook_loaded = [name for name in hook_heavy if name in sys.modules]
+print(json.dumps({"loaded": loaded, "hook_loaded": hook_loaded}))
+"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, "pyproject.toml"), "w") as fh:
+                fh.write('[project]\nname = "unrelated"\n')
+            result = subprocess.run(
+                [sys.executable, "-c", script], cwd=tmpdir, capture_output=True, text=True, check=True
+            )
+        report = json.loads(result.stdout)
+        self.assertEqual(report["loaded"], [])
+        self.assertEqual(report["hook_loaded"], [])
+
     def test_fallback_version(self):
         """Test that fallback to PKG-INFO works correctly."""
         datadir = os.path.join(TESTDIR, "data")
@@ -182,6 +1181,99 @@ class VersionsTestCase(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             process_version_writing(os.path.join(datadir, "no-pyproject"), write_version=False, fallback=True)
 
+    def test_resolution_budget(self):
+        """Test that a fallback version is used when the budget runs out."""
+        clone = self.make_clone()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected = find_lsst_version(clone, "HEAD")
+            with unittest.mock.patch.dict(os.environ, {"LSST_VERSIONS_CACHE": "0"}):
+                for budget in (ResolutionBudget(commits=1), ResolutionBudget(seconds=0)):
+                    with self.subTest(budget=budget):
+                        with self.assertLogs("lsst_versions", level="WARNING") as cm:
+                            version = find_lsst_version(clone, "HEAD", budget=budget)
+                        self.assertEqual(version, "0.0.0+budget")
+                        (record,) = [r for r in cm.records if getattr(r, "event", None)]
+                        self.assertEqual(record.event, "budget_exceeded")
+                        self.assertEqual(record.details["fallback_version"], version)
+                        self.assertEqual(record.details["budget_commits"], budget.commits)
+                budget = ResolutionBudget(seconds=60, commits=10_000)
+                self.assertEqual(find_lsst_version(clone, "HEAD", budget=budget), expected)
+
+            # The metadata provides the public part of the fallback.
+            with open(os.path.join(clone, "PKG-INFO"), "w") as fh:
+                fh.write("Metadata-Version: 2.1\nName: test\nVersion: 1.2.3+local\n")
+            with self.assertLogs("lsst_versions", level="WARNING"):
+                version = find_lsst_version(clone, "HEAD", budget=ResolutionBudget(seconds=0))
+            self.assertEqual(version, "1.2.3+budget")
+            os.remove(os.path.join(clone, "PKG-INFO"))
+
+            # The budget can be configured and a fallback version is not
+            # recorded for later builds.
+            pyproject = os.path.join(clone, "pyproject.toml")
+            os.remove(pyproject)
+            with open(pyproject, "w") as fh:
+                fh.write('[tool.lsst_versions]\nwrite_to = "version_test.py"\nbudget_seconds = 0\n')
+            with self.assertLogs("lsst_versions", level="WARNING"):
+                version, written = process_version_writing(clone)
+            self.assertEqual(version, "0.0.0+budget")
+            with open(written) as fh:
+                self.assertIn("0.0.0+budget", fh.read())
+            with unittest.mock.patch.dict(os.environ, {"LSST_VERSIONS_BUDGET_COMMITS": "10000"}):
+                self.assertEqual(process_version_writing(clone)[0], expected)
+            with unittest.mock.patch.dict(os.environ, {"LSST_VERSIONS_BUDGET_SECONDS": "-1"}):
+                with self.assertRaises(ValueError):
+                    find_lsst_version(clone, "HEAD")
+
+    def test_metadata_scan(self):
+        """Test that versions are read from trees of metadata."""
+        datadir = os.path.join(TESTDIR, "data")
+        found = {
+            (os.path.relpath(result.path, datadir), result.version) for result in scan_versions([datadir])
+        }
+        self.assertEqual(
+            found,
+            {
+                (os.path.join("something.egg-info", "PKG-INFO"), "1.1.0"),
+                (os.path.join("pyproject", "python", "other.egg-info", "PKG-INFO"), "3.4.0a32"),
+            },
+        )
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            site = os.path.join(tmpdir, "site-packages")
+            os.makedirs(os.path.join(site, "lsst_daf_butler-27.0.0.dist-info"))
+            with open(os.path.join(site, "lsst_daf_butler-27.0.0.dist-info", "METADATA"), "w") as fh:
+                # Only the headers are examined.
+                print("Metadata-Version: 2.1\nName: lsst-daf-butler\nVersion: 27.0.0\n\nVersion: 1", file=fh)
+            with open(os.path.join(site, "old-1.0.egg-info"), "w") as fh:
+                print("Metadata-Version: 1.0\nName: old\nSummary: x\n  continued\n\nVersion: 2", file=fh)
+            os.makedirs(os.path.join(site, "broken.dist-info"))
+            sdist = os.path.join(tmpdir, "sdists", "lsst_utils-26.0.0")
+            shutil.copytree(os.path.join(datadir, "pyproject"), sdist)
+            with open(os.path.join(sdist, "PKG-INFO"), "w") as fh:
+                print("Metadata-Version: 2.1\nName: lsst-utils\nVersion: 26.0.0", file=fh)
+
+            results = sorted(scan_versions([site, os.path.join(tmpdir, "sdists")], max_workers=2))
+            self.assertEqual(
+                [(result.name, result.version) for result in results],
+                [("lsst-utils", "26.0.0"), (None, None), ("lsst-daf-butler", "27.0.0"), ("old", None)],
+            )
+            self.assertIsNotNone(results[1].error)
+            self.assertEqual(results[3].error, "No Version field found.")
+
+            # The depth can be limited.
+            self.assertEqual(list(scan_versions([tmpdir], max_depth=0)), [])
+            self.assertEqual(len(list(scan_versions([tmpdir], max_depth=1))), 3)
+
+            out = io.StringIO()
+            self.assertEqual(run_scan([site], None, None, out), 2)
+            entries = [json.loads(line) for line in out.getvalue().splitlines()]
+            self.assertEqual(len(entries), 3)
+            self.assertIn(
+                {"path": results[2].path, "name": "lsst-daf-butler", "version": "27.0.0", "error": None},
+                entries,
+            )
+
 
 if __name__ == "__main__":
     setup_module(sys.modules[__name__])